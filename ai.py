@@ -11,16 +11,24 @@
 # ---------------------------------------------------------------------------------------------------------
 
 
+import sys
+import threading
 import time
 
 import settings as s
 import evaluation as e
 import evaluation_settings as es
 import helper_functions as hf
+import move_notation as mn
+import tablebase as tb
+
+# The stop timer thread has to wait for the search thread to release the GIL before it can set the stopped flag,
+# a shorter switch interval than the default 5 ms makes the search stop closer to the stop time
+sys.setswitchinterval(s.switch_interval)
 
 class Ai:
 
-    def __init__(self, gamestate, search_depth=64, stoptime=0, timeset=0, check_timeout=2000):
+    def __init__(self, gamestate, search_depth=64, stoptime=0, timeset=0, stop_event=None, node_limit=0, root_moves=None, multi_pv=1):
 
         # Input variables
         self.gamestate = gamestate
@@ -36,20 +44,37 @@ class Ai:
         self.max_ply = 60
         self.pv_length = [0] * self.max_ply  # ply
         self.pv_table = [[0] * self.max_ply for _ in range(self.max_ply)]  # [ply][ply]
-        self.pv_line = ''
+        self.pv_follow = [0] * self.max_ply  # PV line from the previous search (move[:4]) used to sort moves, [ply]
+        self.pv_line = ''  # SAN format
+        self.pv_moves = []  # Moves in the latest complete PV-line
 
         self.print_info = {}
 
-        self.mate_score = 98000
-        self.mate_value = 99000
+        self.mate_score = s.mate_score
+        self.mate_value = s.mate_value
         self.alpha = -100000
         self.beta = 100000
 
         self.tt = {0: {'key': 0, 'depth': 0, 'flag': 0, 'score': 0}}
         self.tt_move = {}
 
-        # UCI parameters
+        # UCI parameters. The stop event can be set from another thread (UCI stop/quit) to stop the search at the next node.
+        # The stopped flag is set by a timer thread when the stop event is set or the time is up, so the search only tests a boolean.
         self.stopped = False
+        self.stop_event = stop_event if stop_event else threading.Event()
+        self.timer_lock = threading.Lock()
+
+        # UCI search limits. The search is stopped when the node limit is reached (go nodes), and only the
+        # root moves in the list are searched (go searchmoves, UCI format).
+        self.node_limit = node_limit if node_limit else sys.maxsize
+        self.root_moves = root_moves
+
+        # MultiPV, the number of best lines to search. The lines from the latest complete iteration are stored as
+        # (score, PV moves), best first. Root moves of lines already found in the current iteration are excluded.
+        self.multi_pv = multi_pv
+        self.multi_pv_lines = []
+        self.excluded_root_moves = []
+        self.info_output = None  # Function to send info lines to during search (e.g. aspiration window fails in UCI)
 
         # Keep track of 3-fold repetition
         self.repetition_table = {}
@@ -67,15 +92,33 @@ class Ai:
         self.follow_pv = False
         self.score_pv = False
         self.nodes = -1
+        self.tb_hits = 0
+
+        # Progress info read by the UCI info reporter during the search: the current iteration depth, the highest ply
+        # reached in the quiescence search (seldepth), and the root move being searched with its number in the move list
+        self.current_depth = 0
+        self.seldepth = 0
+        self.current_move = None
+        self.current_move_number = 0
         self.can_reduce = True
 
+        # Search extensions. Keep track of which extension that was made at each ply and how many nodes each extension type has searched.
+        # Each node is counted once, for the innermost extension made above it on the path from the root (extension_path).
+        self.extended = [''] * self.max_ply  # ply
+        self.extension_path = [''] * self.max_ply  # ply
+        self.quiescence_extension = ''  # The same for all nodes in a quiescence search, which can go deeper than max_ply
+        self.extension_nodes = {'check': 0, 'one_reply': 0, 'recapture': 0}
+
+        # Count how often each evaluation tier is reached, and the evaluation cache hits/misses, during this search
+        for tier in e.eval_counts:
+            e.eval_counts[tier] = 0
+        for stat in e.eval_hash_stats:
+            e.eval_hash_stats[stat] = 0
+
         # Time how long time it takes to calculate the move
         self.timer = 0
         self.time_start = time.time()
 
-        # How often to check for timeout (nodes)
-        self.check_timeout = check_timeout
-
 # ---------------------------------------------------------------------------------------------------------
 # /////////////////////////////////////////////////////////////////////////////////////////////////////////
 #
@@ -88,40 +131,27 @@ class Ai:
 
         # Init variables
         self.timer = 0
-        ply = 0
+        self.current_depth = current_depth
+        self.seldepth = 0
 
         # Reset killer and history moves
         self.killer_moves = [[0]*self.max_ply for _ in range(2)]  # [1st or 2nd killer move][ply]
         self.history_moves = [[0]*120 for _ in range(12)]  # [piece][target square]
 
-        # Reset stopped timer
-        self.stopped = False
-
-        # Initiate PV line variables
-        self.follow_pv = True
-        self.pv_length = [0] * 60  # ply
-        self.pv_table = [[0] * 60 for _ in range(60)]  # [ply][ply]
+        # Reset stopped flag and start the timer, stop directly if the time is already up
+        self.stopped = self.stop_event.is_set() or (self.timeset == 1 and time.time() >= self.stoptime) or self.nodes >= self.node_limit
+        search_done = threading.Event()
+        threading.Thread(target=self.stop_timer, args=(search_done,), daemon=True).start()
 
-        # Search the position with the recursive Negamax function
-        score = self.negamax(current_depth, ply, self.alpha, self.beta, False)
-
-        # Test if aspiration window failed, if so need to redo with full window
-        if self.beta <= score or score <= self.alpha:
-
-            # Reset alpha and beta
-            self.alpha, self.beta = -100000, 100000
-
-            # Reset stopped timer
-            self.stopped = False
-
-            # Enable follow_pv line
-            self.follow_pv = True
-
-            self.pv_length = [0] * 60  # ply
-            self.pv_table = [[0] * 60 for _ in range(60)]  # [ply][ply]
+        # Search the position, the best line ends up in the PV table
+        if self.multi_pv == 1:
+            score = self.aspiration_search(current_depth, self.alpha, self.beta)
+        else:
+            score = self.multi_pv_search(current_depth)
 
-            # Search again with full window
-            score = self.negamax(current_depth, ply, self.alpha, self.beta, False)
+        # Stop the timer, the stopped flag can't change after this
+        with self.timer_lock:
+            search_done.set()
 
         # Set aspiration window, 50 works the best for som test positions
         self.alpha = score - s.aspiration_window
@@ -134,8 +164,9 @@ class Ai:
         # If we have not yet timed out, save parameters to use later, otherwise best values from last iteration is used
         if not self.stopped:
 
-            # Get PV-line on a nice format
-            self.pv_line = hf.get_pv_line(self.gamestate, self.pv_table[0][:self.pv_length[0]])
+            # Get PV-line on SAN format
+            self.pv_moves = self.pv_table[0][:self.pv_length[0]]
+            self.pv_line = mn.get_san_line(self.gamestate, self.pv_moves)
 
             # Update best move and best score
             best_move = self.pv_table[0][0]
@@ -143,11 +174,90 @@ class Ai:
 
             # Update print info dict which is used for printing info in GUI
             self.print_info[current_depth - 1] = {'depth': str(current_depth), 'time': f'{self.timer:.2f}', 'nodes': str(self.nodes), 'nodes_s': str(round((self.nodes * 1000) / (self.timer * 1000))),
-                                                  'score': score, 'main_line': self.pv_line}
+                                                  'score': score, 'main_line': self.pv_line, 'extension_nodes': dict(self.extension_nodes),
+                                                  'eval_counts': dict(e.eval_counts), 'eval_hash_stats': dict(e.eval_hash_stats)}
+
+            # All lines in a MultiPV search, (score, SAN line)
+            if self.multi_pv > 1:
+                self.print_info[current_depth - 1]['multi_pv'] = [(line_score, mn.get_san_line(self.gamestate, line_moves)) for line_score, line_moves in self.multi_pv_lines]
 
         # Return the best move found before timing out
         return best_move, best_score
 
+    # Aspiration window loop (https://www.chessprogramming.org/Aspiration_Windows).
+    # If the search fails outside the window, only the failing side is widened with a doubled delta each time.
+    # The PV line and move ordering tables are kept between re-searches.
+    def aspiration_search(self, current_depth, alpha, beta, pv_moves=None):
+
+        delta = s.aspiration_window
+        while True:
+
+            # Follow the latest PV line, from the previous iteration (or given line) or from the failed search
+            self.update_pv_follow(pv_moves)
+            pv_moves = None
+
+            # Search the position with the recursive Negamax function
+            score = self.negamax(current_depth, 0, alpha, beta, False)
+
+            # Stop re-searching if time is up
+            if self.stopped:
+                break
+
+            # Fail low, widen alpha
+            if score <= alpha and alpha > -100000:
+                self.output_bound_info(current_depth, score, 'upperbound')
+                delta *= 2
+                alpha = max(score - delta, -100000)
+
+            # Fail high, widen beta
+            elif score >= beta and beta < 100000:
+                self.output_bound_info(current_depth, score, 'lowerbound')
+                delta *= 2
+                beta = min(score + delta, 100000)
+
+            # Score inside the window
+            else:
+                break
+
+        return score
+
+    # MultiPV search (https://www.chessprogramming.org/Multiple_PV). The best lines are found one at a time, each search
+    # excludes the root moves of the lines found before it. A line uses an aspiration window around its score from the
+    # previous iteration, a new line is searched with a full window. The best line is put in the PV table.
+    def multi_pv_search(self, current_depth):
+
+        root_moves = [move for move in self.gamestate.get_valid_moves() if not self.root_moves or mn.move_to_uci(move) in self.root_moves]
+
+        lines = []
+        for line in range(min(self.multi_pv, len(root_moves))):
+
+            if line < len(self.multi_pv_lines):
+                previous_score, previous_pv = self.multi_pv_lines[line]
+                score = self.aspiration_search(current_depth, previous_score - s.aspiration_window, previous_score + s.aspiration_window, previous_pv)
+            else:
+                score = self.aspiration_search(current_depth, -100000, 100000, [])
+
+            if self.stopped or not self.pv_length[0]:
+                break
+
+            lines.append((score, self.pv_table[0][:self.pv_length[0]]))
+            self.excluded_root_moves.append(mn.move_to_uci(self.pv_table[0][0]))
+
+        self.excluded_root_moves = []
+
+        if self.stopped or not lines:
+            return score
+
+        # Sort the lines by score, a later line can get a better score than an earlier one
+        lines.sort(key=lambda line: line[0], reverse=True)
+        self.multi_pv_lines = lines
+
+        score, pv_moves = lines[0]
+        self.pv_table[0][:len(pv_moves)] = pv_moves
+        self.pv_length[0] = len(pv_moves)
+
+        return score
+
 # ---------------------------------------------------------------------------------------------------------
 # /////////////////////////////////////////////////////////////////////////////////////////////////////////
 #
@@ -156,37 +266,80 @@ class Ai:
 # /////////////////////////////////////////////////////////////////////////////////////////////////////////
 # ---------------------------------------------------------------------------------------------------------
 
-    def negamax(self, depth, ply, alpha, beta, allow_nullmove):
+    def negamax(self, depth, ply, alpha, beta, allow_nullmove, extensions=0):
 
         # TT
         #key = self.gamestate.zobrist_key
         #if key in self.tt:
         #   if self.tt[key]['depth'] >= depth:
-        #        return self.tt[key]['score']
+        #        return hf.score_from_tt(self.tt[key]['score'], ply)
 
         # Init PV length
         self.pv_table[ply][ply] = 0
         self.pv_length[ply] = 0
 
-        # Find if the position is a draw due to 3 fold repetition, if so return a draw score
-        if self.is_repetition():
+        # Init extension made in this node
+        self.extended[ply] = ''
+
+        # Find if the position is a draw due to 3 fold repetition, if so return a draw score. Not at the root since a move
+        # has to be returned even if the current position has been seen before.
+        if ply and self.is_repetition():
+            return 0
+
+        # Draw by insufficient material, neither side can checkmate
+        if ply and self.gamestate.is_material_draw:
             return 0
 
+        # Can't go deeper than the size of the PV and killer tables
+        if ply >= self.max_ply - 1:
+            return e.evaluate(self.gamestate, alpha, beta)
+
+        # Endgame tablebases (https://www.chessprogramming.org/Endgame_Tablebases). The score of a position in the tablebases
+        # is exact, so it is returned directly. At the root a move has to be returned, so only one ply is searched instead
+        # and the positions after each move are probed.
+        if self.gamestate.material_key in tb.tables:
+            score = tb.probe(self.gamestate, ply)
+            if score is not None:
+                if ply:
+                    self.tb_hits += 1
+                    return score
+                depth = 1
+
+        # Mate distance pruning (https://www.chessprogramming.org/Mate_Distance_Pruning).
+        # We can't do better than mating on the next ply or worse than getting mated on this ply,
+        # so if a shorter mate is already found higher up in the tree there is no need to search further.
+        if ply:
+            alpha = max(alpha, -self.mate_value + ply)
+            beta = min(beta, self.mate_value - ply - 1)
+            if alpha >= beta:
+                return alpha
+
         # Check if in check
         is_in_check = self.gamestate.check_for_checks(self.gamestate.king_location[not self.gamestate.is_white_turn])
 
-        # Check extension
-        if is_in_check:
-            depth += 1
+        # Check extension, only if there is extension budget left for this path
+        if is_in_check and extensions + s.check_extension <= s.max_extensions:
+            depth += s.check_extension
+            extensions += s.check_extension
+            self.extended[ply] = 'check'
+
+        # The quiescence search can't be used in check, since it only looks at captures and doesn't find mates. When the
+        # extension budget is used up, the node is still searched one ply deep so that all check evasions are tried.
+        elif is_in_check and depth == 0:
+            depth = 1
+            self.extended[ply] = 'check'
 
         # Depth with quiescence search
         if depth == 0:
+            self.quiescence_extension = self.extension_path[ply]
             score = self.quiescence(ply, alpha, beta)
-            #self.tt[key] = {'key': key, 'depth': depth, 'flag': 0, 'score': score}
+            #self.tt[key] = {'key': key, 'depth': depth, 'flag': 0, 'score': hf.score_to_tt(score, ply)}
             return score
 
-        # Increment node count
+        # Increment node count, also for the extension this node is searched under
         self.nodes += 1
+        if self.extension_path[ply]:
+            self.extension_nodes[self.extension_path[ply]] += 1
 
         # Null move logic
         if allow_nullmove:
@@ -205,7 +358,8 @@ class Ai:
                 temp_key = self.gamestate.zobrist_key
 
                 # Search position
-                score = -self.negamax(depth - 1 - s.R, ply + 1, -beta, -beta + 1, False)
+                self.extension_path[ply + 1] = self.extended[ply] or self.extension_path[ply]
+                score = -self.negamax(depth - 1 - s.R, ply + 1, -beta, -beta + 1, False, extensions)
 
                 self.gamestate.zobrist_key = temp_key
 
@@ -227,9 +381,15 @@ class Ai:
             self.tt_move[key] = children'''
         children = self.gamestate.get_valid_moves()
 
-        # Extend if there is only one possible move (forced line) and if not in check (since we have that extension above).
-        '''if len(children) == 1 and not is_in_check:
-            depth += 1'''
+        # Extend if there is only one possible move (forced line) and if not already extended above.
+        if len(children) == 1 and not self.extended[ply] and extensions + s.one_reply_extension <= s.max_extensions:
+            depth += s.one_reply_extension
+            extensions += s.one_reply_extension
+            self.extended[ply] = 'one_reply'
+
+        # Only search the given root moves, and skip the root moves of the lines already found in a MultiPV search
+        if not ply and (self.root_moves or self.excluded_root_moves):
+            children = [child for child in children if mn.move_to_uci(child) not in self.excluded_root_moves and (not self.root_moves or mn.move_to_uci(child) in self.root_moves)]
 
         # Sort moves before Negamax
         children = self.sort_moves(ply, children)
@@ -242,15 +402,29 @@ class Ai:
         legal_moves = 0
         moves_searched = 0
 
+        # The previous move, used to find recaptures
+        previous_square, previous_captured = self.gamestate.move_log[-1][0][1], self.gamestate.move_log[-1][2]
+
         # Negamax loop
         for child in children:
 
+            # Recapture extension, recapture on the same square as the previous capture with an equal trade
+            extension = 0
+            if previous_captured != '--' and child[1] == previous_square and self.gamestate.board[child[1]] != '--' and \
+                    s.mvv_lva_values[self.gamestate.board[child[1]]] == s.mvv_lva_values[previous_captured] and \
+                    extensions + s.recapture_extension <= s.max_extensions:
+                extension = s.recapture_extension
+
             # Make the move
             self.gamestate.make_move(child)
 
             # Increment legal moves
             legal_moves += 1
 
+            # Keep track of the root move being searched
+            if not ply:
+                self.current_move, self.current_move_number = child, legal_moves
+
             # LMR
             '''if moves_searched >= s.full_depth_moves and \
                 depth >= s.reduction_limit and \
@@ -270,7 +444,9 @@ class Ai:
             else:
                 self.can_reduce = True
                 score = -self.negamax(depth - 1, ply + 1, -beta, -alpha, True)'''
-            score = -self.negamax(depth - 1, ply + 1, -beta, -alpha, True)
+            # The nodes below this move are searched under the recapture extension, or else the innermost extension above
+            self.extension_path[ply + 1] = 'recapture' if extension else self.extended[ply] or self.extension_path[ply]
+            score = -self.negamax(depth - 1 + extension, ply + 1, -beta, -alpha, True, extensions + extension)
 
             # Unmake the move
             self.gamestate.unmake_move()
@@ -278,11 +454,10 @@ class Ai:
             # Increase searched moves
             moves_searched += 1
 
-            # Return if time is up, check every x nodes
-            if not self.nodes % self.check_timeout:
-                if self.timeset == 1 and time.time() >= self.stoptime:
-                    self.stopped = True
-                    return 0
+            # Return if the search was stopped, time is up or the node limit is reached
+            if self.stopped or self.nodes >= self.node_limit:
+                self.stopped = True
+                return 0
 
             # Found a better move (PV-node)
             if score > alpha:
@@ -337,21 +512,24 @@ class Ai:
 
     def quiescence(self, ply, alpha, beta):
 
-        # Return if time is up, check every x nodes
-        if not self.nodes % self.check_timeout:
-            if self.timeset == 1 and time.time() >= self.stoptime:
-                self.stopped = True
-                return 0
+        # Return if the search was stopped or time is up
+        if self.stopped:
+            return 0
 
-        # Increment nodes count
+        # Increment nodes count (also for the extension this node is searched under) and selective depth
         self.nodes += 1
-
-        # Find if the position is a draw due to 3 fold repetition, if so return a draw score
-        if self.is_repetition():
+        if self.quiescence_extension:
+            self.extension_nodes[self.quiescence_extension] += 1
+        if ply > self.seldepth:
+            self.seldepth = ply
+
+        # Find if the position is a draw due to 3 fold repetition or insufficient material, if so return a draw score.
+        # Not at the root since a move has to be returned even if the current position is a draw.
+        if ply and (self.is_repetition() or self.gamestate.is_material_draw):
             return 0
 
         # Evaluate the position
-        score = e.evaluate(self.gamestate)
+        score = e.evaluate(self.gamestate, alpha, beta)
 
         # Fail-hard beta cutoff (node fails high)
         if score >= beta:
@@ -420,7 +598,7 @@ class Ai:
         if self.score_pv:
 
             # Make sure we are dealing with PV move
-            if self.pv_table[0][ply] == move:
+            if self.pv_follow[ply] == move[:4]:
                 # Disable score pv flag
                 self.score_pv = False
 
@@ -479,6 +657,20 @@ class Ai:
 # /////////////////////////////////////////////////////////////////////////////////////////////////////////
 # ---------------------------------------------------------------------------------------------------------
 
+    # Runs in its own thread during each iteration and sets the stopped flag when the search is stopped from outside
+    # (UCI stop/quit) or when time is up. It wakes up at least every timer_interval seconds, so a stop time that
+    # is changed during the search (ponderhit) is also noticed.
+    def stop_timer(self, search_done):
+        while not search_done.is_set():
+            timeout = s.timer_interval
+            if self.timeset == 1:
+                timeout = min(timeout, self.stoptime - time.time())
+            if timeout <= 0 or self.stop_event.wait(timeout):
+                with self.timer_lock:
+                    if not search_done.is_set():
+                        self.stopped = True
+                return
+
     # Find if a position is stalemated due to 3 fold repetition or 50 move rule
     def is_repetition(self):
 
@@ -506,6 +698,24 @@ class Ai:
         # No 3-fold was found
         return False
 
+    # Copy the latest PV line to follow in the next search. The PV table itself is overwritten during search.
+    def update_pv_follow(self, pv_moves=None):
+
+        if pv_moves is None:
+            pv_moves = self.pv_table[0][:self.pv_length[0]]
+
+        if pv_moves:
+            self.pv_follow = [move[:4] for move in pv_moves] + [0] * (self.max_ply - len(pv_moves))
+
+        # Enable following and scoring of the PV line, starting from the root
+        self.follow_pv = self.score_pv = bool(self.pv_follow[0])
+
+    # Print info about a failed aspiration window search
+    def output_bound_info(self, depth, score, bound):
+
+        if self.info_output:
+            self.info_output('info depth %d score %s %s nodes %ld time %d' % (depth, hf.get_uci_score(score), bound, self.nodes, (time.time() - self.time_start) * 1000))
+
     def enable_pv_scoring(self, ply, moves):
 
         # Disable following PV line
@@ -515,7 +725,7 @@ class Ai:
         for move in moves:
 
             # Make sure we hit PV move
-            if self.pv_table[0][ply] == move:
+            if self.pv_follow[ply] == move[:4]:
 
                 # Enable move scoring and follow pv
                 self.score_pv = True
@@ -0,0 +1,202 @@
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                          analyze.py
+#
+#                   - Analyzes all positions in an EPD/FEN file with the AI, without going through UCI
+#                   - The search is limited by depth, nodes and/or time per position
+#                   - The positions are searched in a pool of worker processes
+#                   - The results are written as one JSON object per line (JSONL), in the same order as the
+#                     positions in the file, as soon as they are ready
+#                   - Only a limited number of positions are read ahead of the output, so the memory use doesn't
+#                     grow with the size of the file
+#
+#  Run from the main folder:
+#      python analyze.py positions.epd --depth 6
+#      python analyze.py positions.epd --nodes 50000 --workers 4 --output results.jsonl
+#      python analyze.py positions.epd --time 1.5
+#
+#  Each line in the file is a FEN (6 fields) or an EPD (4 fields, followed by optional operations such as
+#  bm or id). Empty lines and lines starting with # are skipped. Each result line looks like:
+#      {"index": 0, "fen": "...", "bestmove": "e2e4", "score": 35, "mate": null, "depth": 6, "pv": ["e2e4", ...],
+#       "nodes": 12345, "time": 0.87}
+#  The score is in centipawns from the perspective of the side to move. For a mate score, mate is the number of
+#  moves to mate (negative if getting mated, 0 if the side to move is checkmated).
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import evaluation as e
+import fen_handling as fh
+import helper_functions as hf
+import move_notation as mn
+import settings as s
+from gamestate import GameState
+from ai import Ai
+from time_manager import TimeManager
+
+# Number of positions per worker that are read and sent to the pool ahead of the output
+positions_per_worker = 8
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                      Read positions
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Read the positions one at a time as (index, FEN). EPD lines get halfmove and move counters so they are full FENs.
+def read_positions(path):
+
+    with open(path) as f:
+        index = 0
+        for line in f:
+            tokens = line.split()
+            if not tokens or tokens[0].startswith('#'):
+                continue
+            if len(tokens) >= 6 and tokens[4].isdigit() and tokens[5].isdigit():
+                fen = ' '.join(tokens[:6])
+            else:
+                fen = ' '.join(tokens[:4] + ['0', '1'])
+            yield index, fen
+            index += 1
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                      Analyze positions
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Search limits for the positions, set in each worker process
+limits = {}
+
+
+def init_worker(depth, nodes, move_time, eval_hash_mb):
+
+    limits.update(depth=depth, nodes=nodes, move_time=move_time)
+    e.set_eval_hash_size(eval_hash_mb)
+
+
+# Search a position with iterative deepening until the depth, node or time limit is reached.
+# Runs in a worker process, the result is a dict that is written as a JSON line.
+def analyze_position(position):
+
+    index, fen = position
+    result = {'index': index, 'fen': fen}
+
+    try:
+        if not fh.test_fen(fen):
+            raise ValueError('invalid FEN')
+        gamestate = GameState(fen)
+    except (ValueError, KeyError, IndexError) as error:
+        result['error'] = str(error) or 'invalid FEN'
+        return result
+
+    # The evaluation cache is cleared so that the result doesn't depend on which positions the worker searched before
+    e.clear_eval_hash()
+
+    # Checkmate (mate 0) or stalemate, there is nothing to search
+    if not gamestate.get_valid_moves():
+        is_checkmate = gamestate.check_for_checks(gamestate.king_location[not gamestate.is_white_turn])
+        result.update(bestmove=None, score=-s.mate_value if is_checkmate else 0, mate=0 if is_checkmate else None, depth=0, pv=[], nodes=0, time=0)
+        return result
+
+    time_manager = TimeManager(movetime=limits['move_time'], move_overhead=0)
+    ai = Ai(gamestate, search_depth=limits['depth'], stoptime=time_manager.stoptime, timeset=time_manager.timeset, node_limit=limits['nodes'])
+
+    best_move, best_score, best_depth, pv_moves = None, 0, 0, []
+    for current_depth in range(1, ai.search_depth + 1):
+        move, score = ai.ai_make_move(current_depth=current_depth, best_move=best_move, best_score=best_score)
+        if ai.stopped:
+            break
+        best_move, best_score, best_depth, pv_moves = move, score, current_depth, ai.pv_moves
+
+        # Stop if a mate is found within the searched depth, a deeper search can't find a shorter mate
+        if abs(score) > s.mate_score and s.mate_value - abs(score) <= current_depth:
+            break
+
+        # Stop if there is no time for another iteration
+        time_manager.update(move, score)
+        if time_manager.is_done():
+            break
+
+    # The search was stopped before the first iteration was done, use the first legal move
+    if not best_move:
+        best_move = gamestate.get_valid_moves()[0]
+        pv_moves = [best_move]
+
+    result.update(bestmove=mn.move_to_uci(best_move), score=round(best_score), mate=hf.moves_to_mate(best_score) or None, depth=best_depth,
+                  pv=mn.get_uci_line(pv_moves).split(), nodes=max(0, ai.nodes), time=round(time.time() - time_manager.start, 3))
+    return result
+
+
+# Analyze the positions in the pool and yield the results in the same order as the positions. At most
+# workers * positions_per_worker positions are waiting in the pool at the same time.
+def analyze_positions(positions, pool, workers):
+
+    pending = collections.deque()
+    for position in positions:
+        pending.append(pool.apply_async(analyze_position, (position,)))
+        if len(pending) >= workers * positions_per_worker:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                            Main
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Analyze all positions in an EPD/FEN file')
+    parser.add_argument('positions', help='file with one FEN or EPD per line')
+    parser.add_argument('--depth', type=int, default=0, help='max depth per position')
+    parser.add_argument('--nodes', type=int, default=0, help='max nodes per position, gives the same result on any machine')
+    parser.add_argument('--time', type=float, default=0, help='max time per position (seconds)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--hash', type=int, default=s.eval_hash_mb, help='evaluation cache size (MB) in each worker, a small cache is faster to clear between short searches')
+    parser.add_argument('--output', help='JSONL file to write the results to (default standard output)')
+    args = parser.parse_args()
+
+    if not (args.depth or args.nodes or args.time):
+        parser.error('give at least one of --depth, --nodes and --time')
+
+    depth = min(args.depth, 64) if args.depth else 64
+    output = open(args.output, 'w') if args.output else sys.stdout
+
+    start_time = time.time()
+    analyzed = 0
+    try:
+        with Pool(args.workers, initializer=init_worker, initargs=(depth, args.nodes, args.time, min(1024, max(1, args.hash)))) as pool:
+            for result in analyze_positions(read_positions(args.positions), pool, args.workers):
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+                analyzed += 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(f'Analyzed {analyzed} positions in {time.time() - start_time:.1f} s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,21 +5,81 @@
 #
 #                   - Static evaluation on the gamestate input
 #                   - Base piece values and PST evaluation
+#                   - Evaluation cache keyed by the Zobrist key, shared between searches
+#                   - Lazy evaluation, skip the positional terms if far outside the alpha/beta window
+#                   - Pawn structure and rooks on open files, cached in a pawn hash table
+#                   - Mobility, king attacks and center control from one attack count pass per position
 #                   - Possibility to add other bonuses which are currently commented out
-#                   - Special late endgame logic to find common mate patterns
+#                   - Special late endgame logic to find common mate patterns, looked up on the material key
+#                   - Scaling of the score when the side ahead can't win
+#                   - Batch evaluation of many positions at once with NumPy (e.g. for tuning)
 #
 # /////////////////////////////////////////////////////////////////////////////////////////////////////////
 # ---------------------------------------------------------------------------------------------------------
 
+import numpy as np
+
 import settings as s
 import evaluation_settings as es
 
+# Pawn structure hash table. [pawn key] = (score, open files, white semi open files, black semi open files)
+pawn_hash_table = {}
+
+# How many times each evaluation tier is reached (material/PST, early exit after material/PST, full evaluation)
+eval_counts = {'material': 0, 'lazy_exit': 0, 'full': 0}
+
+# Board squares on each file, files numbered 1-8 as in square % 10
+file_squares = {file: [row * 10 + file for row in range(2, 10)] for file in range(1, 9)}
+
+# Evaluation cache, direct mapped on the lowest bits of the Zobrist key. A new position always replaces the old one in its slot.
+# Only exact scores (white perspective) are stored, not scores from a lazy exit since they depend on the alpha/beta window.
+eval_hash_keys = []
+eval_hash_scores = []
+eval_hash_mask = np.uint64(0)
+eval_hash_stats = {'hits': 0, 'misses': 0}
+
+
+# Allocate the evaluation cache. The number of entries is the largest power of 2 that fits in the given size in MB.
+def set_eval_hash_size(megabytes):
+
+    global eval_hash_keys, eval_hash_scores, eval_hash_mask
+
+    entries = 1 << max(0, (megabytes * 1024 * 1024 // s.eval_hash_entry_bytes).bit_length() - 1)
+    eval_hash_keys = [0] * entries
+    eval_hash_scores = [0] * entries
+    eval_hash_mask = np.uint64(entries - 1)
+
 
-def evaluate(gamestate):
+# Empty the evaluation cache without changing its size
+def clear_eval_hash():
 
+    eval_hash_keys[:] = [0] * len(eval_hash_keys)
+    eval_hash_scores[:] = [0] * len(eval_hash_scores)
 
-    # Piece values with base and piece-dependent values (updated in make/unmake move functions)
+
+# How full the evaluation cache is in permille (UCI hashfull), estimated from the first 1000 entries
+def get_eval_hash_full():
+
+    sample = eval_hash_keys[:1000]
+    return sum(1 for key in sample if key) * 1000 // len(sample)
+
+
+set_eval_hash_size(s.eval_hash_mb)
+
+
+def evaluate(gamestate, alpha=-100000, beta=100000):
+
+    # Look for the position in the evaluation cache
+    key = gamestate.zobrist_key
+    index = key & eval_hash_mask
+    if eval_hash_keys[index] == key:
+        eval_hash_stats['hits'] += 1
+        return eval_hash_scores[index] if gamestate.is_white_turn else -eval_hash_scores[index]
+    eval_hash_stats['misses'] += 1
+
+    # Tier 1: Piece values with base and piece-dependent values (updated in make/unmake move functions)
     # Interpolated between mid and endgame.
+    eval_counts['material'] += 1
     score_opening = gamestate.piece_values[0] - gamestate.piece_values[1]
     score_endgame = gamestate.piece_values[2] - gamestate.piece_values[3]
     score = ((score_opening * gamestate.game_phase_score) + (score_endgame*(es.opening_phase_score - gamestate.game_phase_score))) // es.opening_phase_score
@@ -35,9 +95,9 @@ def evaluate(gamestate):
 #                                  Endgame related functions
 # -------------------------------------------------------------------------------------------------
 
-    if gamestate.game_phase_score <= es.endgame_phase_score*2:
+    '''if gamestate.game_phase_score <= es.endgame_phase_score*2:
 
-        '''# Knights better with lots of pawns, bishops worse. Rooks better with less pawns.
+        # Knights better with lots of pawns, bishops worse. Rooks better with less pawns.
         score += ((gamestate.piece_dict[0]['N'] * gamestate.piece_dict[0]['p']) -
                   (gamestate.piece_dict[1]['N'] * gamestate.piece_dict[1]['p'])) * es.knight_pawn_bonus
 
@@ -47,34 +107,502 @@ def evaluate(gamestate):
         score += ((gamestate.piece_dict[0]['R'] * gamestate.piece_dict[0]['p']) -
                   (gamestate.piece_dict[1]['R'] * gamestate.piece_dict[1]['p'])) * es.rook_pawn_punishment'''
 
-        # Finding mate with no pawns on the board without syzygy. Don't work for KNB vs K yet.
-        if gamestate.piece_dict[0]['p'] == gamestate.piece_dict[1]['p'] == 0:
+    # Special endgames and scaling factors, looked up in the endgame table on the material key. Endgames without pawns
+    # are scored only by their endgame evaluator, e.g. mop-up evaluation to find mate.
+    evaluator, white_scale, black_scale = endgame_table.get(gamestate.material_key) or add_endgame(gamestate.material_key)
+    if evaluator:
+        score = evaluator(gamestate)
+        score = score * white_scale if score > 0 else score * black_scale
+
+        eval_hash_keys[index], eval_hash_scores[index] = key, score
+        return score if gamestate.is_white_turn else -score
 
-            # Add a small term for piece values, otherwise it sometimes sacrificed a piece for no reason.
-            score = 0.5*gamestate.piece_values[2] - 0.5*gamestate.piece_values[3]
+# -------------------------------------------------------------------------------------------------
+#                                  Lazy evaluation
+# -------------------------------------------------------------------------------------------------
+
+    # If the material and PST score is too far outside the alpha/beta window for the remaining terms to
+    # change the outcome of the search, there is no need to calculate them.
+    # A scaled score can be much closer to the window, so there is no lazy exit if the side ahead can't win.
+    side_score = score if gamestate.is_white_turn else -score
+    if white_scale == black_scale == 1 and (side_score + s.lazy_eval_margin <= alpha or side_score - s.lazy_eval_margin >= beta):
+        eval_counts['lazy_exit'] += 1
+        return side_score
 
-            # White advantage (no rooks or queens on enemy side and a winning advantage)
-            if gamestate.piece_dict[1]['R'] == gamestate.piece_dict[1]['Q'] == 0 and score > 0:
+# -------------------------------------------------------------------------------------------------
+#                                  Tier 2: Positional terms
+# -------------------------------------------------------------------------------------------------
 
-                # Lone K vs K and (R, Q and/or at least 2xB). Only using mop-up evaluation (https://www.chessprogramming.org/Mop-up_Evaluation).
-                if gamestate.piece_dict[0]['R'] >= 1 or gamestate.piece_dict[0]['Q'] >= 1 or gamestate.piece_dict[0]['B'] >= 2:
-                    black_king_real_pos = es.real_board_squares.index(gamestate.king_location[1])
-                    score += 10 * (4.7 * es.manhattan_distance[black_king_real_pos] + 1.6 * (14 - gamestate.kings_distance))
+    eval_counts['full'] += 1
 
-                # Lone K vs K, N and B (NOT COMPLETED YET)
-                if gamestate.piece_dict[0]['R'] == gamestate.piece_dict[0]['Q'] == 0 and gamestate.piece_dict[0]['B'] >= 1 and gamestate.piece_dict[0]['N'] >= 1:
-                    pass
+    # Pawn structure and rooks on open and semi open files. Only depends on the pawns so it is stored in the pawn hash table.
+    pawn_score, open_files, white_semi_open_files, black_semi_open_files = get_pawn_structure(gamestate)
+    score += pawn_score
 
-            # Black advantage (no rooks or queens on enemy side and a winning advantage)
-            if gamestate.piece_dict[0]['R'] == gamestate.piece_dict[0]['Q'] == 0 and score < 0:
+    board = gamestate.board
+    for file in open_files:
+        for square in file_squares[file]:
+            if board[square] == 'wR':
+                score += es.open_file
+            elif board[square] == 'bR':
+                score -= es.open_file
+    for file in white_semi_open_files:
+        for square in file_squares[file]:
+            if board[square] == 'wR':
+                score += es.semi_open_file
+    for file in black_semi_open_files:
+        for square in file_squares[file]:
+            if board[square] == 'bR':
+                score -= es.semi_open_file
 
-                # Lone K vs K and (R, Q and/or at least 2xB). Only using mop-up evaluation (https://www.chessprogramming.org/Mop-up_Evaluation).
-                if gamestate.piece_dict[1]['R'] >= 1 or gamestate.piece_dict[1]['Q'] >= 1 or gamestate.piece_dict[1]['B'] >= 2:
-                    white_king_real_pos = es.real_board_squares.index(gamestate.king_location[0])
-                    score -= 10 * (4.7 * es.manhattan_distance[white_king_real_pos] + 1.6 * (14 - gamestate.kings_distance))
+    # Mobility, attacks on the squares around the enemy king and attacks on the center squares. All three are counted in
+    # the same pass over the piece bitboards, which is cached in the gamestate for the position.
+    mobility, king_attacks, center_attacks = gamestate.get_attack_info()
+    score += sum([count * factor for count, factor in zip(mobility, es.mobility_factor)])
+    score += es.king_attack_bonus_factor * (king_attacks[0] - king_attacks[1])
+    score += es.center_attack_bonus_factor * (center_attacks[0] - center_attacks[1])
 
-                # Lone K vs K, N and B (NOT COMPLETED YET)
-                if gamestate.piece_dict[1]['R'] == gamestate.piece_dict[1]['Q'] == 0 and gamestate.piece_dict[1]['B'] >= 1 and gamestate.piece_dict[1]['N'] >= 1:
-                    pass
+    # Scale down the score if the side that is ahead can't win
+    score = score * white_scale if score > 0 else score * black_scale
 
+    eval_hash_keys[index], eval_hash_scores[index] = key, score
     return score if gamestate.is_white_turn else -score
+
+
+# -------------------------------------------------------------------------------------------------
+#                                  Endgame table
+# -------------------------------------------------------------------------------------------------
+
+# Endgame evaluators, score from white perspective. Only used for positions without pawns.
+
+# Insufficient material (K vs K, K and a single minor piece vs K), no side can mate
+def evaluate_draw(gamestate):
+
+    return 0
+
+
+# Add a small term for piece values, otherwise it sometimes sacrificed a piece for no reason.
+def evaluate_pawnless(gamestate):
+
+    return 0.5*gamestate.piece_values[2] - 0.5*gamestate.piece_values[3]
+
+
+# Lone K vs K and (R, Q and/or at least 2xB). Only using mop-up evaluation (https://www.chessprogramming.org/Mop-up_Evaluation).
+def evaluate_white_mop_up(gamestate):
+
+    black_king_real_pos = es.real_board_index[gamestate.king_location[1]]
+    return evaluate_pawnless(gamestate) + 10 * (4.7 * es.manhattan_distance[black_king_real_pos] + 1.6 * (14 - gamestate.kings_distance))
+
+
+def evaluate_black_mop_up(gamestate):
+
+    white_king_real_pos = es.real_board_index[gamestate.king_location[0]]
+    return evaluate_pawnless(gamestate) - 10 * (4.7 * es.manhattan_distance[white_king_real_pos] + 1.6 * (14 - gamestate.kings_distance))
+
+
+# Lone K vs K, N and B. Mate can only be forced in a corner with the same color as the bishop, so the lone king is driven
+# towards the nearest of those corners and the kings towards each other. The term is at most 210, within the range of the
+# mop-up term, so it only steers the kings and doesn't make the search prefer KBNK over winning more material.
+def evaluate_white_kbnk(gamestate):
+
+    bishop = gamestate.piece_bitboards[es.piece_to_number['wB']].bit_length() - 1
+    white_king, black_king = es.real_board_index[gamestate.king_location[0]], es.real_board_index[gamestate.king_location[1]]
+    return evaluate_pawnless(gamestate) + 20 * (7 - es.corner_distance[es.square_color[bishop]][black_king]) + 10 * (7 - es.king_distance[white_king][black_king])
+
+
+def evaluate_black_kbnk(gamestate):
+
+    bishop = gamestate.piece_bitboards[es.piece_to_number['bB']].bit_length() - 1
+    white_king, black_king = es.real_board_index[gamestate.king_location[0]], es.real_board_index[gamestate.king_location[1]]
+    return evaluate_pawnless(gamestate) - 20 * (7 - es.corner_distance[es.square_color[bishop]][white_king]) - 10 * (7 - es.king_distance[white_king][black_king])
+
+
+# Endgame table [material key] = (evaluator, white scale, black scale). The evaluator is None for positions with a normal
+# evaluation. The score is multiplied by the scale of the side that is ahead, which is less than 1 if that side can't win.
+endgame_table = {}
+
+
+# Material key from the pieces (not the king) of each side, e.g. get_material_key('BN', '') for KBN vs K
+def get_material_key(white_pieces, black_pieces):
+
+    return sum(es.material_key_bits[f'w{piece}'] for piece in white_pieces) + sum(es.material_key_bits[f'b{piece}'] for piece in black_pieces)
+
+
+# Number of each piece [color][piece type] from a material key
+def get_piece_counts(material_key):
+
+    return [{piece_type: material_key >> (4 * es.piece_to_number[f'{color}{piece_type}']) & 15 for piece_type in 'pNBRQ'} for color in 'wb']
+
+
+# Find the evaluator and scaling factors for a material key and add them to the endgame table
+def add_endgame(material_key):
+
+    white, black = get_piece_counts(material_key)
+    game_phase_score = sum(count * es.piece_phase_calc[piece_type] for pieces in (white, black) for piece_type, count in pieces.items())
+    white_material = sum(count * es.base_end_game[piece_type] for piece_type, count in white.items())
+    black_material = sum(count * es.base_end_game[piece_type] for piece_type, count in black.items())
+
+    # Without pawns a single minor piece or two knights can't force mate
+    white_can_win = white['p'] or white['R'] or white['Q'] or (white['B'] and white['N'] + white['B'] >= 2)
+    black_can_win = black['p'] or black['R'] or black['Q'] or (black['B'] and black['N'] + black['B'] >= 2)
+    white_scale = 1 if white_can_win else es.drawish_scale
+    black_scale = 1 if black_can_win else es.drawish_scale
+
+    evaluator = None
+    if white['p'] == black['p'] == 0 and game_phase_score <= es.endgame_phase_score*2:
+        if not white_can_win and not black_can_win and white['N'] + white['B'] + black['N'] + black['B'] <= 1:
+            evaluator = evaluate_draw
+        elif material_key == get_material_key('BN', ''):
+            evaluator = evaluate_white_kbnk
+        elif material_key == get_material_key('', 'BN'):
+            evaluator = evaluate_black_kbnk
+        elif black['R'] == black['Q'] == 0 and (white['R'] or white['Q'] or white['B'] >= 2) and white_material > black_material:
+            evaluator = evaluate_white_mop_up
+        elif white['R'] == white['Q'] == 0 and (black['R'] or black['Q'] or black['B'] >= 2) and black_material > white_material:
+            evaluator = evaluate_black_mop_up
+        else:
+            evaluator = evaluate_pawnless
+
+    endgame_table[material_key] = (evaluator, white_scale, black_scale)
+
+    return endgame_table[material_key]
+
+
+# The endgames with a lone king: KRK, KQK, KBBK, KBNK, KBK, KNK and KK. All other material keys are added the first time they are evaluated.
+for pieces in ('R', 'Q', 'BB', 'BN', 'B', 'N', ''):
+    add_endgame(get_material_key(pieces, ''))
+    add_endgame(get_material_key('', pieces))
+
+
+# -------------------------------------------------------------------------------------------------
+#                                  Pawn structure
+# -------------------------------------------------------------------------------------------------
+
+# Get the pawn structure from the pawn hash table, or evaluate and store it if the pawn structure is not seen before
+def get_pawn_structure(gamestate):
+
+    entry = pawn_hash_table.get(gamestate.pawn_key)
+    if entry is None:
+
+        # Clear the table if it is full
+        if len(pawn_hash_table) >= s.pawn_hash_size:
+            pawn_hash_table.clear()
+
+        entry = pawn_hash_table[gamestate.pawn_key] = evaluate_pawn_structure(gamestate.board)
+
+    return entry
+
+
+# Passed, doubled and isolated pawns and open files. Score from white perspective.
+def evaluate_pawn_structure(board):
+
+    # Ranks (1-8) of the pawns on each file. File 0 and 9 are always empty to not have to handle the edges.
+    white_pawns = [[] for _ in range(10)]
+    black_pawns = [[] for _ in range(10)]
+    for square in s.real_board_squares:
+        if board[square] == 'wp':
+            white_pawns[square % 10].append(10 - square // 10)
+        elif board[square] == 'bp':
+            black_pawns[square % 10].append(10 - square // 10)
+
+    score = 0
+    open_files, white_semi_open_files, black_semi_open_files = [], [], []
+    for file in range(1, 9):
+
+        # Doubled pawns, punish each extra pawn on the file
+        if len(white_pawns[file]) > 1:
+            score += (len(white_pawns[file]) - 1) * es.double_pawn
+        if len(black_pawns[file]) > 1:
+            score -= (len(black_pawns[file]) - 1) * es.double_pawn
+
+        # Isolated pawns have no own pawns on the files next to it.
+        # Passed pawns have no enemy pawns in front of it on the same file or the files next to it.
+        for rank in white_pawns[file]:
+            if not white_pawns[file - 1] and not white_pawns[file + 1]:
+                score += es.isolated_pawn
+            if all(enemy_rank <= rank for enemy_rank in black_pawns[file - 1] + black_pawns[file] + black_pawns[file + 1]):
+                score += es.passed_pawn[rank - 1]
+
+        for rank in black_pawns[file]:
+            if not black_pawns[file - 1] and not black_pawns[file + 1]:
+                score -= es.isolated_pawn
+            if all(enemy_rank >= rank for enemy_rank in white_pawns[file - 1] + white_pawns[file] + white_pawns[file + 1]):
+                score -= es.passed_pawn[8 - rank]
+
+        # Open files (no pawns) and semi open files (only enemy pawns)
+        if not white_pawns[file] and not black_pawns[file]:
+            open_files.append(file)
+        elif not white_pawns[file]:
+            white_semi_open_files.append(file)
+        elif not black_pawns[file]:
+            black_semi_open_files.append(file)
+
+    return score, open_files, white_semi_open_files, black_semi_open_files
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                        Batch evaluation
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Positions are packed into a (N, 64) int8 board array, piece number + 1 (es.piece_to_number) on each square and 0 for empty
+# squares, in the order of s.real_board_squares (a8, b8, ..., h1). Together with the side to move (1 if white) and the game
+# phase score of each position. evaluate_batch gives the same score as evaluate with a full window for each position.
+
+# Rank (1-8) and file (0-7) of each of the 64 squares
+batch_ranks = np.array([10 - square // 10 for square in s.real_board_squares], dtype=np.int8)
+batch_files = np.array([square % 10 - 1 for square in s.real_board_squares])
+
+# Tables for a byte with bit rank - 1 set for each pawn on a file: number of pawns, highest and lowest rank (0 and 9 if
+# no pawns) and bits for all ranks from/to a rank.
+batch_bit_count = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.int8)
+batch_highest_rank = np.array([byte.bit_length() for byte in range(256)], dtype=np.int8)
+batch_lowest_rank = np.array([(byte & -byte).bit_length() if byte else 9 for byte in range(256)], dtype=np.int8)
+batch_ranks_from = np.array([(0xff << max(rank - 1, 0)) & 0xff for rank in range(10)], dtype=np.uint8)
+batch_ranks_to = np.array([0xff >> (8 - min(rank, 8)) for rank in range(10)], dtype=np.uint8)
+
+# Attack tables. Index 64 is used for squares off the board. For each direction the target square of each square after
+# 1-7 steps, for knights and pawns after one step.
+batch_square_index = {square: i for i, square in enumerate(s.real_board_squares)}
+
+
+def get_batch_targets(d, steps):
+
+    targets = np.full((steps, 64), 64, dtype=np.intp)
+    for i, square in enumerate(s.real_board_squares):
+        for step in range(steps):
+            square += d
+            if square not in batch_square_index:
+                break
+            targets[step][i] = batch_square_index[square]
+
+    return targets
+
+
+batch_slider_targets = [get_batch_targets(d, 7) for d in s.directions]
+batch_knight_targets = [get_batch_targets(d, 1)[0] for d in s.knight_moves]
+batch_pawn_targets = {'w': [get_batch_targets(d, 1)[0] for d in (-11, -9)], 'b': [get_batch_targets(d, 1)[0] for d in (9, 11)]}
+
+# Color of the piece number + 1 (1 = white, 2 = black, 0 = empty), center squares and the squares around a king.
+# Material key bits [piece number] and a number for each endgame evaluator.
+batch_piece_color = np.array([0] + [1 if piece[0] == 'w' else 2 for piece in sorted(es.piece_to_number, key=es.piece_to_number.get)], dtype=np.int8)
+batch_center = np.array([square in (54, 55, 64, 65) for square in s.real_board_squares] + [False])
+batch_material_key_bits = np.array([es.material_key_bits[piece] for piece in sorted(es.piece_to_number, key=es.piece_to_number.get)], dtype=np.int64)
+batch_endgame_evaluators = {None: 0, evaluate_draw: 1, evaluate_pawnless: 2, evaluate_white_mop_up: 3, evaluate_black_mop_up: 4,
+                            evaluate_white_kbnk: 5, evaluate_black_kbnk: 6}
+batch_king_zones = np.zeros((64, 65), dtype=np.int8)
+for i, square in enumerate(s.real_board_squares):
+    batch_king_zones[i][[batch_square_index[zone_square] for zone_square in es.king_attack_squares[square]]] = 1
+
+
+# Build the batch evaluation tables from the evaluation settings. Needs to be called again if the settings are changed.
+def init_batch_tables():
+
+    global batch_pst_mid, batch_pst_end, batch_white_passed_pawn, batch_black_passed_pawn, batch_manhattan_distance, batch_mobility_factor
+    global batch_king_distance, batch_square_color, batch_corner_distance
+
+    # Material and PST values [piece number + 1][square], white pieces positive and black pieces negative
+    batch_pst_mid = np.zeros((13, 64), dtype=np.int64)
+    batch_pst_end = np.zeros((13, 64), dtype=np.int64)
+    for piece, number in es.piece_to_number.items():
+        for i, square in enumerate(s.real_board_squares):
+            if piece[0] == 'w':
+                batch_pst_mid[number + 1][i] = es.pst_mid[number][square]
+                batch_pst_end[number + 1][i] = es.pst_end[number][square]
+            else:
+                batch_pst_mid[number + 1][i] = -es.pst_mid[number][s.black_side[square]]
+                batch_pst_end[number + 1][i] = -es.pst_end[number][s.black_side[square]]
+
+    # Passed pawn bonus for white and black pawns on the set ranks of a file byte
+    batch_white_passed_pawn = np.array([sum(es.passed_pawn[rank - 1] for rank in range(1, 9) if byte >> (rank - 1) & 1) for byte in range(256)])
+    batch_black_passed_pawn = np.array([sum(es.passed_pawn[8 - rank] for rank in range(1, 9) if byte >> (rank - 1) & 1) for byte in range(256)])
+    batch_manhattan_distance = np.array(es.manhattan_distance, dtype=np.float64)
+    batch_king_distance = np.array(es.king_distance)
+    batch_square_color = np.array(es.square_color)
+    batch_corner_distance = np.array(es.corner_distance)
+
+    # Mobility factor [piece number + 1], only knights, bishops, rooks and queens
+    batch_mobility_factor = np.zeros(13, dtype=np.int64)
+    for piece, number in es.piece_to_number.items():
+        if piece[1] in 'NBRQ':
+            batch_mobility_factor[number + 1] = es.mobility_factor[number]
+
+
+init_batch_tables()
+
+
+# Pack gamestates into the arrays used by evaluate_batch
+def pack_positions(gamestates):
+
+    boards = np.zeros((len(gamestates), 64), dtype=np.int8)
+    is_white_turn = np.zeros(len(gamestates), dtype=np.int8)
+    game_phase = np.zeros(len(gamestates), dtype=np.int64)
+    for n, gamestate in enumerate(gamestates):
+        boards[n] = [es.piece_to_number[gamestate.board[square]] + 1 if gamestate.board[square] != '--' else 0 for square in s.real_board_squares]
+        is_white_turn[n] = gamestate.is_white_turn
+        game_phase[n] = gamestate.game_phase_score
+
+    return boards, is_white_turn, game_phase
+
+
+# Evaluate a batch of positions (boards, is_white_turn, game_phase) from pack_positions. Score from side to move perspective.
+def evaluate_batch(positions):
+
+    boards, is_white_turn, game_phase = positions
+    game_phase = np.asarray(game_phase, dtype=np.int64)
+    n = len(boards)
+    squares = np.arange(64)
+    wp, wR, wK = es.piece_to_number['wp'] + 1, es.piece_to_number['wR'] + 1, es.piece_to_number['wK'] + 1
+    bp, bR, bK = es.piece_to_number['bp'] + 1, es.piece_to_number['bR'] + 1, es.piece_to_number['bK'] + 1
+
+    # Material and PST, interpolated between mid and endgame
+    pst_index = boards.astype(np.intp) * 64 + squares
+    end_values = np.take(batch_pst_end, pst_index)
+    score_opening = np.take(batch_pst_mid, pst_index).sum(axis=1)
+    score_endgame = end_values.sum(axis=1)
+    score = ((score_opening * game_phase) + (score_endgame * (es.opening_phase_score - game_phase))) // es.opening_phase_score
+
+    # Number of each piece [position][piece number + 1]
+    piece_count = np.bincount((boards + 13 * np.arange(n).reshape(n, 1)).ravel(), minlength=13 * n).reshape(n, 13)
+
+    # Pawns on each file as a byte [position][file], bit rank - 1 is set if there is a pawn on that rank.
+    # File -1 and 8 are always empty to not have to handle the edges.
+    white_pawns = np.zeros((n, 10), dtype=np.uint8)
+    black_pawns = np.zeros((n, 10), dtype=np.uint8)
+    white_pawns[:, 1:-1] = np.packbits((boards == wp).reshape(n, 8, 8), axis=1)[:, 0]
+    black_pawns[:, 1:-1] = np.packbits((boards == bp).reshape(n, 8, 8), axis=1)[:, 0]
+    white_file_count, black_file_count = batch_bit_count[white_pawns], batch_bit_count[black_pawns]
+
+    # Doubled pawns
+    score += (np.maximum(white_file_count - 1, 0).sum(axis=1, dtype=np.int64) - np.maximum(black_file_count - 1, 0).sum(axis=1, dtype=np.int64)) * es.double_pawn
+
+    # Isolated pawns
+    white_isolated = (white_pawns[:, :-2] == 0) & (white_pawns[:, 2:] == 0)
+    black_isolated = (black_pawns[:, :-2] == 0) & (black_pawns[:, 2:] == 0)
+    score += ((white_file_count[:, 1:-1] * white_isolated).sum(axis=1, dtype=np.int64) - (black_file_count[:, 1:-1] * black_isolated).sum(axis=1, dtype=np.int64)) * es.isolated_pawn
+
+    # Passed pawns, the most advanced enemy pawn on the own and adjacent files is not in front of the pawn
+    black_max_rank = batch_highest_rank[black_pawns[:, :-2] | black_pawns[:, 1:-1] | black_pawns[:, 2:]]
+    white_min_rank = batch_lowest_rank[white_pawns[:, :-2] | white_pawns[:, 1:-1] | white_pawns[:, 2:]]
+    score += batch_white_passed_pawn[white_pawns[:, 1:-1] & batch_ranks_from[black_max_rank]].sum(axis=1, dtype=np.int64)
+    score -= batch_black_passed_pawn[black_pawns[:, 1:-1] & batch_ranks_to[white_min_rank]].sum(axis=1, dtype=np.int64)
+
+    # Rooks on open and semi open files
+    white_rooks = batch_bit_count[np.packbits((boards == wR).reshape(n, 8, 8), axis=1)[:, 0]]
+    black_rooks = batch_bit_count[np.packbits((boards == bR).reshape(n, 8, 8), axis=1)[:, 0]]
+    white_files, black_files = white_pawns[:, 1:-1] > 0, black_pawns[:, 1:-1] > 0
+    open_files = ~white_files & ~black_files
+    score += ((white_rooks - black_rooks) * open_files).sum(axis=1, dtype=np.int64) * es.open_file
+    score += ((white_rooks * (~white_files & black_files)).sum(axis=1, dtype=np.int64) - (black_rooks * (white_files & ~black_files)).sum(axis=1, dtype=np.int64)) * es.semi_open_file
+
+    # Mobility, king attacks and center attacks
+    score += evaluate_batch_attacks(boards)
+
+    # Special endgames and scaling factors from the endgame table, looked up once for each material key in the batch
+    material_keys = piece_count[:, 1:] @ batch_material_key_bits
+    unique_keys, key_index = np.unique(material_keys, return_inverse=True)
+    endgames = [endgame_table.get(material_key) or add_endgame(material_key) for material_key in unique_keys.tolist()]
+    evaluators = np.array([batch_endgame_evaluators[evaluator] for evaluator, _, _ in endgames])[key_index]
+    white_scale = np.array([white_scale for _, white_scale, _ in endgames], dtype=np.float64)[key_index]
+    black_scale = np.array([black_scale for _, _, black_scale in endgames], dtype=np.float64)[key_index]
+
+    # Endgames without pawns, scored only by their endgame evaluator. Only calculated for those positions.
+    score = score.astype(np.float64)
+    no_pawns = np.nonzero(evaluators)[0]
+    if len(no_pawns):
+        endgame_boards, endgame_values, endgame_evaluators = boards[no_pawns], end_values[no_pawns], evaluators[no_pawns]
+
+        # Add a small term for piece values (white and black endgame values as in gamestate.piece_values)
+        white_pieces = endgame_boards <= wK
+        endgame_score = 0.5*np.where(white_pieces, endgame_values, 0).sum(axis=1) - 0.5*np.where(white_pieces, 0, -endgame_values).sum(axis=1)
+
+        white_king, black_king = np.argmax(endgame_boards == wK, axis=1), np.argmax(endgame_boards == bK, axis=1)
+        kings_distance = np.abs(batch_files[white_king] - batch_files[black_king]) + np.abs(batch_ranks[white_king] - batch_ranks[black_king])
+
+        # Mop-up evaluation
+        white_mop_up = endgame_evaluators == batch_endgame_evaluators[evaluate_white_mop_up]
+        endgame_score = np.where(white_mop_up, endgame_score + 10 * (4.7 * batch_manhattan_distance[black_king] + 1.6 * (14 - kings_distance)), endgame_score)
+        black_mop_up = endgame_evaluators == batch_endgame_evaluators[evaluate_black_mop_up]
+        endgame_score = np.where(black_mop_up, endgame_score - 10 * (4.7 * batch_manhattan_distance[white_king] + 1.6 * (14 - kings_distance)), endgame_score)
+
+        # K, B and N vs K, drive the lone king to a corner with the same color as the bishop
+        white_kbnk = endgame_evaluators == batch_endgame_evaluators[evaluate_white_kbnk]
+        black_kbnk = endgame_evaluators == batch_endgame_evaluators[evaluate_black_kbnk]
+        if white_kbnk.any() or black_kbnk.any():
+            king_distance = batch_king_distance[white_king, black_king]
+            white_bishop = batch_square_color[np.argmax(endgame_boards == es.piece_to_number['wB'] + 1, axis=1)]
+            black_bishop = batch_square_color[np.argmax(endgame_boards == es.piece_to_number['bB'] + 1, axis=1)]
+            endgame_score = np.where(white_kbnk, endgame_score + 20 * (7 - batch_corner_distance[white_bishop, black_king]) + 10 * (7 - king_distance), endgame_score)
+            endgame_score = np.where(black_kbnk, endgame_score - 20 * (7 - batch_corner_distance[black_bishop, white_king]) - 10 * (7 - king_distance), endgame_score)
+
+        # Insufficient material
+        endgame_score = np.where(endgame_evaluators == batch_endgame_evaluators[evaluate_draw], 0, endgame_score)
+
+        score[no_pawns] = endgame_score
+
+    # Scale down the score if the side that is ahead can't win
+    score = np.where(score > 0, score * white_scale, score * black_scale)
+
+    return np.where(is_white_turn, score, -score)
+
+
+# Mobility, attacks around the enemy king and attacks on the center for a batch of boards, score from white perspective.
+# Same counts as gamestate.get_attack_info. The attacking pieces of all boards are gathered into one list, and each piece
+# type attacks one step at a time in its directions. A slider stops in a direction when its ray is blocked.
+def evaluate_batch_attacks(boards):
+
+    n = len(boards)
+    boards = boards.astype(np.intp)
+    pieces = {piece: es.piece_to_number[piece] + 1 for piece in es.piece_to_number}
+
+    # Color of the piece on each square (index 64 is off the board), and the squares around each king as bits (1 = around
+    # the white king, 2 = around the black king)
+    color = np.zeros((n, 65), dtype=np.int8)
+    color[:, :64] = batch_piece_color[boards]
+    white_king, black_king = np.argmax(boards == pieces['wK'], axis=1), np.argmax(boards == pieces['bK'], axis=1)
+    zones = batch_king_zones[white_king] | (batch_king_zones[black_king] << 1)
+
+    # All pawns, knights, bishops, rooks and queens (position, square, piece number + 1)
+    position, square = np.nonzero((boards != 0) & (boards != pieces['wK']) & (boards != pieces['bK']))
+    piece = boards[position, square]
+    own_color = batch_piece_color[piece]
+    enemy_zone = 3 - own_color
+    mobility_factor = batch_mobility_factor[piece]
+    attack_factor = np.where(own_color == 1, 1, -1)
+    values = np.zeros(len(piece), dtype=np.int64)
+
+    # Add the value of the attacks on the target squares for the given pieces. Returns the pieces still on the board and the
+    # color on their target square.
+    def add_attacks(attackers, targets):
+        target = targets[square[attackers]]
+        on_board = target != 64
+        attackers, target = attackers[on_board], target[on_board]
+        attacker_position = position[attackers]
+        target_color = color[attacker_position, target]
+        values[attackers] += mobility_factor[attackers] * (target_color != own_color[attackers]) + attack_factor[attackers] * (
+            es.king_attack_bonus_factor * ((zones[attacker_position, target] & enemy_zone[attackers]) != 0) + es.center_attack_bonus_factor * batch_center[target])
+        return attackers, target_color
+
+    for color_name in 'wb':
+        pawns = np.nonzero(piece == pieces[f'{color_name}p'])[0]
+        for targets in batch_pawn_targets[color_name]:
+            add_attacks(pawns, targets)
+
+    knights = np.nonzero((piece == pieces['wN']) | (piece == pieces['bN']))[0]
+    for targets in batch_knight_targets:
+        add_attacks(knights, targets)
+
+    straight = np.nonzero((piece == pieces['wR']) | (piece == pieces['wQ']) | (piece == pieces['bR']) | (piece == pieces['bQ']))[0]
+    diagonal = np.nonzero((piece == pieces['wB']) | (piece == pieces['wQ']) | (piece == pieces['bB']) | (piece == pieces['bQ']))[0]
+    for direction, steps in enumerate(batch_slider_targets):
+        attackers = straight if direction < 4 else diagonal
+        for targets in steps:
+            if not len(attackers):
+                break
+            attackers, target_color = add_attacks(attackers, targets)
+            attackers = attackers[target_color == 0]
+
+    return np.bincount(position, weights=values, minlength=n).astype(np.int64)
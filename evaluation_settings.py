@@ -29,6 +29,7 @@ center_attack_bonus_factor = 1  # Factor to multiply with how many center square
 king_attack_bonus_factor = 5  # Factor to multiply with how many squares around enemy king that are attacked by own pieces
 knight_pawn_bonus = 2  # Knights better with lots of pawns
 bishop_endgame_bonus = 10  # Bonus for bishops in endgame, per piece
+drawish_scale = 0.125  # Factor to multiply the score with if the side ahead can't win (no pawns and only a single minor piece or two knights)
 rook_on_semi_open_file_bonus = 20  # Give rook a bonus for being on an open file without any own pawns, right now it is per rook
 rook_on_open_file_bonus = 20  # Give rook a bonus for being on an open file without any pawns, right now it is per rook
 
@@ -64,9 +65,24 @@ real_board_squares = [21, 22, 23, 24, 25, 26, 27, 28,
                       81, 82, 83, 84, 85, 86, 87, 88,
                       91, 92, 93, 94, 95, 96, 97, 98]
 
+# Index (0-63, a8 = 0) of each square in real_board_squares, None for the squares outside the board
+real_board_index = [None] * 120
+for i, square in enumerate(real_board_squares):
+    real_board_index[square] = i
+
+# Distance in king moves between two squares [index][index]
+king_distance = [[max(abs(i % 8 - j % 8), abs(i // 8 - j // 8)) for j in range(64)] for i in range(64)]
+
+# Color of each square (0 = light, 1 = dark) and the Manhattan distance to the nearest corner with that color [color][index]
+square_color = [(i // 8 + i % 8) % 2 for i in range(64)]
+corner_distance = [[min(abs(i % 8 - corner % 8) + abs(i // 8 - corner // 8) for corner in corners) for i in range(64)] for corners in ((0, 63), (7, 56))]
+
 piece_to_number = {'wp': 0, 'wN': 1, 'wB': 2, 'wR': 3, 'wQ': 4, 'wK': 5,
                    'bp': 6, 'bN': 7, 'bB': 8, 'bR': 9, 'bQ': 10, 'bK': 11}
 
+# Material key, the number of each piece (not the kings) packed into an int with 4 bits per piece in piece number order
+material_key_bits = {piece: 0 if piece[1] == 'K' else 1 << (4 * number) for piece, number in piece_to_number.items()}
+
 # --------------------------------------------------------------------------------
 #                   Pre-calculated king attack square
 # --------------------------------------------------------------------------------
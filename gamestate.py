@@ -18,6 +18,68 @@ import evaluation_settings as es
 
 import numpy as np
 
+# Zobrist random numbers (pieces, enpassant, castling, side), generated by the first gamestate
+zobrist_tables = None
+
+# Piece bitboards and attack tables used to count attacks for the evaluation. Squares are bits in an int, bit i is
+# s.real_board_squares[i] (a8 = bit 0, h1 = bit 63). The tables are lists indexed by the bit number.
+square_bits = {square: 1 << i for i, square in enumerate(s.real_board_squares)}
+not_a_file = sum(square_bits[square] for square in s.real_board_squares if square % 10 != 1)
+not_h_file = sum(square_bits[square] for square in s.real_board_squares if square % 10 != 8)
+
+# Number of set bits in an int (int.bit_count is only available from Python 3.10)
+bit_count = getattr(int, 'bit_count', lambda bits: bin(bits).count('1'))
+
+
+# Squares attacked by a sliding piece on square in the given directions, stopping at the first blocking piece
+def get_slider_attacks(square, directions, blockers):
+
+    attacked = 0
+    for d in directions:
+        target = square + d
+        while target in square_bits:
+            attacked |= square_bits[target]
+            if square_bits[target] & blockers:
+                break
+            target += d
+
+    return attacked
+
+
+# Squares that can block a sliding piece (the last square in each direction never blocks anything)
+def get_slider_mask(square, directions):
+
+    mask = 0
+    for d in directions:
+        target = square + d
+        while target + d in square_bits:
+            mask |= square_bits[target]
+            target += d
+
+    return mask
+
+
+knight_attacks = [sum(square_bits[square + d] for d in s.knight_moves if square + d in square_bits) for square in s.real_board_squares]
+
+# Bishop and rook attacks for each square, looked up by the blocking pieces. The tables are filled the first time a
+# combination of blocking pieces is seen.
+bishop_masks = [get_slider_mask(square, s.directions[4:8]) for square in s.real_board_squares]
+rook_masks = [get_slider_mask(square, s.directions[0:4]) for square in s.real_board_squares]
+bishop_attacks = [{} for _ in s.real_board_squares]
+rook_attacks = [{} for _ in s.real_board_squares]
+
+king_zones = {square: sum(square_bits[zone_square] for zone_square in es.king_attack_squares[square]) for square in s.real_board_squares}
+center_squares = square_bits[54] | square_bits[55] | square_bits[64] | square_bits[65]
+
+# Squares of each color (0 = light, 1 = dark), used to find bishops on the same color
+color_squares = [sum(1 << i for i in range(64) if es.square_color[i] == color) for color in (0, 1)]
+
+# Material keys where neither side can checkmate with a single minor piece (king against king is covered by the bishops)
+minor_draw_keys = {es.material_key_bits[piece] for piece in ('wN', 'bN', 'wB', 'bB')}
+
+# Bits in the material key for the number of bishops. Positions with only bishops left, all on the same color, are also dead draws.
+bishop_key_mask = (15 << (4 * es.piece_to_number['wB'])) | (15 << (4 * es.piece_to_number['bB']))
+
 
 class GameState:
 
@@ -35,6 +97,10 @@ class GameState:
         self.piece_values = [0, 0, 0, 0]  # White mid game, black mid game, white end game black end game
         self.init_piece_values()
 
+        # Init one bitboard per piece type, indexed by the piece number (used to count attacks in evaluation)
+        self.piece_bitboards = [0] * 12
+        self.init_piece_bitboards()
+
         # Init king positions and distance between each other (used in evaluation)
         self.king_location, self.kings_distance = [0, 0], 0
         self.init_king_positions()
@@ -42,6 +108,12 @@ class GameState:
 
         # Init game phase scores
         self.game_phase_score = self.init_game_phase()
+
+        # Material key with the number of each piece (used to look up special endgames in evaluation)
+        self.material_key = self.init_material_key()
+
+        # If neither side has enough material to checkmate. Only changes after captures and promotions.
+        self.is_material_draw = self.get_material_draw()
         self.game_phase = 0  # 0 = opening, 1 = middle game, 2 = end game
 
         # Get possible moves for a certain piece type
@@ -74,6 +146,9 @@ class GameState:
         self.pins, self.checks = [], []
         self.is_in_check = False
 
+        # Attack counts for the evaluation and the Zobrist key of the position they were counted for
+        self.attack_info, self.attack_info_key = None, None
+
         # Move related variables
         self.piece_moved = self.piece_captured = '--'
 
@@ -93,11 +168,15 @@ class GameState:
         self.init_zobrist_key()
         self.zobrist_key = self.generate_zobrist_key()
 
+        # Zobrist key with only the pawns, used for the pawn structure hash table in evaluation
+        self.pawn_key = self.generate_pawn_key()
+
         # Keep track of 3-fold repetition
         self.repetition_table = [(self.zobrist_key, '', [0, 0, 0, 0, 0])]
 
-        # Init the move log. [move(from, to, piece, piece_increase, piece_moved), piece moved, piece_captured, castling rights, enpassant square, zobrist key, piece_values]
-        self.move_log = [[[0, 0, 0, 0, 0], '--', '--', self.castling_rights, self.enpassant_square, self.zobrist_key, self.piece_values[:], self.halfmove_counter]]
+        # Init the move log. [move(from, to, piece, piece_increase, piece_moved), piece moved, piece_captured, castling rights, enpassant square, zobrist key, piece_values, halfmove counter, pawn key, piece bitboards, material key, material draw]
+        self.move_log = [[[0, 0, 0, 0, 0], '--', '--', self.castling_rights, self.enpassant_square, self.zobrist_key, self.piece_values[:], self.halfmove_counter, self.pawn_key,
+                          self.piece_bitboards[:], self.material_key, self.is_material_draw]]
 
 # ---------------------------------------------------------------------------------------------------------
 # /////////////////////////////////////////////////////////////////////////////////////////////////////////
@@ -134,10 +213,19 @@ class GameState:
         self.board[start_square] = '--'
         self.board[end_square] = self.piece_moved
 
+        # Update piece bitboards
+        self.piece_bitboards[es.piece_to_number[self.piece_moved]] ^= square_bits[start_square] | square_bits[end_square]
+
         # Update Zobrist key
         self.zobrist_key ^= self.zobrist_pieces[s.zobrist_pieces[self.piece_moved]][start_square]  # Remove piece from start square
         self.zobrist_key ^= self.zobrist_pieces[s.zobrist_pieces[self.piece_moved]][end_square]  # Place the moved piece on its end square
 
+        # Update pawn key, a promoted pawn is removed from the pawn structure
+        if self.piece_moved[1] == 'p':
+            self.pawn_key ^= self.zobrist_pieces[s.zobrist_pieces[self.piece_moved]][start_square]
+            if move_type not in 'pQpRpBpN':
+                self.pawn_key ^= self.zobrist_pieces[s.zobrist_pieces[self.piece_moved]][end_square]
+
         # Update the king position and kings distance
         if self.piece_moved[1] == 'K':
             self.king_location[not self.is_white_turn] = end_square
@@ -152,6 +240,8 @@ class GameState:
                 self.zobrist_key ^= self.zobrist_pieces[es.piece_to_number[rook]][s.rook_castling[end_square][1]]
                 self.zobrist_key ^= self.zobrist_pieces[es.piece_to_number[rook]][s.rook_castling[end_square][0]]
 
+                self.piece_bitboards[es.piece_to_number[rook]] ^= square_bits[s.rook_castling[end_square][1]] | square_bits[s.rook_castling[end_square][0]]
+
                 self.piece_values[(not self.is_white_turn)] += -es.pst_mid_squares[es.piece_to_number[rook]][s.rook_castling[to_square][1]] + es.pst_mid_squares[es.piece_to_number[rook]][
                     s.rook_castling[to_square][0]]
                 self.piece_values[(not self.is_white_turn) + 2] += -es.pst_end_square[es.piece_to_number[rook]][s.rook_castling[to_square][1]] + es.pst_end_square[es.piece_to_number[rook]][
@@ -167,10 +257,15 @@ class GameState:
 
             self.piece_dict[not self.is_white_turn]['p'] -= 1
             self.piece_dict[not self.is_white_turn][f'{move_type[1]}'] += 1
+            self.game_phase_score += es.piece_phase_calc[move_type[1]] - es.piece_phase_calc['p']
+            self.material_key += es.material_key_bits[f'{self.piece_moved[0]}{move_type[1]}'] - es.material_key_bits[self.piece_moved]
 
             self.zobrist_key ^= self.zobrist_pieces[s.zobrist_pieces[self.piece_moved]][end_square]  # Remove the pawn from end_square again since it now changed
             self.zobrist_key ^= self.zobrist_pieces[s.zobrist_pieces[f'{self.piece_moved[0]}{move_type[1]}']][end_square]  # Place the promoted piece there instead
 
+            self.piece_bitboards[es.piece_to_number[self.piece_moved]] ^= square_bits[end_square]
+            self.piece_bitboards[es.piece_to_number[f'{self.piece_moved[0]}{move_type[1]}']] ^= square_bits[end_square]
+
             # Update piece value change
             self.piece_values[(not self.is_white_turn)] += -es.pst_mid[es.piece_to_number[self.piece_moved]][from_square] + es.pst_mid[es.piece_to_number[f'{self.piece_moved[0]}{move_type[-1]}']][to_square]
             self.piece_values[(not self.is_white_turn) + 2] += -es.pst_end[es.piece_to_number[self.piece_moved]][from_square] + es.pst_end[es.piece_to_number[f'{self.piece_moved[0]}{move_type[-1]}']][to_square]
@@ -195,13 +290,16 @@ class GameState:
                 self.board[end_square + d] = '--'
                 self.piece_captured = f'{color}p'
                 self.zobrist_key ^= self.zobrist_pieces[s.zobrist_pieces[f'{color}p']][end_square + d]  # Remove pawn from its start square
+                self.pawn_key ^= self.zobrist_pieces[s.zobrist_pieces[f'{color}p']][end_square + d]
+                self.piece_bitboards[es.piece_to_number[f'{color}p']] ^= square_bits[end_square + d]
 
                 # Captured piece square is now capture square - d since piece is not on the actual capture square
                 capture_square = -10
 
-            # Update piece dict and game phase
+            # Update piece dict, game phase and material key
             self.piece_dict[self.is_white_turn][self.piece_captured[1]] -= 1
             self.game_phase_score -= es.piece_phase_calc[self.piece_captured[1]]
+            self.material_key -= es.material_key_bits[self.piece_captured]
 
             capture_square += end_square if not self.is_white_turn else s.black_side[end_square]
 
@@ -210,6 +308,11 @@ class GameState:
 
             if move_type != 'ep':
                 self.zobrist_key ^= self.zobrist_pieces[s.zobrist_pieces[self.piece_captured]][end_square]  # Remove the piece that was on the end square
+                self.piece_bitboards[es.piece_to_number[self.piece_captured]] ^= square_bits[end_square]
+
+                # Remove captured pawn from pawn key
+                if self.piece_captured[1] == 'p':
+                    self.pawn_key ^= self.zobrist_pieces[s.zobrist_pieces[self.piece_captured]][end_square]
 
         # Two square pawn move, update enpassant possible square
         elif move_type == 'ts':
@@ -232,6 +335,10 @@ class GameState:
         self.is_white_turn = not self.is_white_turn
         self.zobrist_key ^= self.zobrist_side
 
+        # Material draw can only change when the material changes
+        if self.piece_captured != '--' or move_type[0] == 'p':
+            self.is_material_draw = self.get_material_draw()
+
         # Generate new Zobrist key
         #self.zobrist_key = self.generate_zobrist_key()
 
@@ -240,7 +347,8 @@ class GameState:
 
         # Update move log
         self.move_log.append([move, self.piece_moved, self.piece_captured, self.castling_rights,
-                              self.enpassant_square, self.zobrist_key, self.piece_values[:], self.halfmove_counter])
+                              self.enpassant_square, self.zobrist_key, self.piece_values[:], self.halfmove_counter, self.pawn_key, self.piece_bitboards[:],
+                              self.material_key, self.is_material_draw])
 
         # Test
         '''test_key = self.generate_zobrist_key()
@@ -283,6 +391,7 @@ class GameState:
             if move_type in 'pQpRpBpN':
                 self.piece_dict[not self.is_white_turn]['p'] += 1
                 self.piece_dict[not self.is_white_turn][f'{move_type[1]}'] -= 1
+                self.game_phase_score -= es.piece_phase_calc[move_type[1]] - es.piece_phase_calc['p']
 
             elif move_type == 'castling':
                 self.board[s.rook_castling[end_square][0]] = '--'  # Remove R
@@ -302,6 +411,10 @@ class GameState:
         self.zobrist_key = self.move_log[-1][5]
         self.piece_values = self.move_log[-1][6][:]
         self.halfmove_counter = self.move_log[-1][7]
+        self.pawn_key = self.move_log[-1][8]
+        self.piece_bitboards = self.move_log[-1][9][:]
+        self.material_key = self.move_log[-1][10]
+        self.is_material_draw = self.move_log[-1][11]
 
         # Clear position from repetition table
         self.repetition_table.pop()
@@ -324,6 +437,24 @@ class GameState:
                 self.piece_values[1] += es.pst_mid[es.piece_to_number[piece]][s.black_side[square]]
                 self.piece_values[3] += es.pst_end[es.piece_to_number[piece]][s.black_side[square]]
 
+    def init_piece_bitboards(self):
+        for square in s.real_board_squares:
+            piece = self.board[square]
+            if piece != '--':
+                self.piece_bitboards[es.piece_to_number[piece]] |= square_bits[square]
+
+    def init_material_key(self):
+        return sum(es.material_key_bits[self.board[square]] for square in s.real_board_squares if self.board[square] != '--')
+
+    # Dead draw by insufficient material: king against king and a knight or bishop, or only bishops on the same color
+    def get_material_draw(self):
+        if self.material_key in minor_draw_keys:
+            return True
+        if self.material_key & ~bishop_key_mask:
+            return False
+        bishops = self.piece_bitboards[es.piece_to_number['wB']] | self.piece_bitboards[es.piece_to_number['bB']]
+        return not bishops & color_squares[0] or not bishops & color_squares[1]
+
     def init_piece_dict(self):
         for square in self.board:
             piece_type, color = self.board[square][1], self.board[square][0]
@@ -371,6 +502,14 @@ class GameState:
     # Init Zobrist key
     def init_zobrist_key(self):
 
+        # The random numbers are the same for every gamestate since the random state always starts from the same number,
+        # so they are only generated for the first gamestate and then copied.
+        global zobrist_tables
+        if zobrist_tables is not None:
+            self.zobrist_pieces, self.zobrist_enpassant, self.zobrist_castling = (table.copy() for table in zobrist_tables[:3])
+            self.zobrist_side = zobrist_tables[3]
+            return
+
         # Loop over pieces and squares and dd random piece key to each position in zobrist piece array
         for piece in s.zobrist_pieces:
             for square in s.real_board_squares:
@@ -387,6 +526,8 @@ class GameState:
         # Initialize random side key
         self.zobrist_side = np.uint64(self.get_random_64bit_number())
 
+        zobrist_tables = (self.zobrist_pieces.copy(), self.zobrist_enpassant.copy(), self.zobrist_castling.copy(), self.zobrist_side)
+
     def generate_zobrist_key(self):
 
         # Init a key variable
@@ -411,6 +552,19 @@ class GameState:
 
         return key
 
+    def generate_pawn_key(self):
+
+        # Init a key variable
+        key = np.uint64(0)
+
+        # Loop over squares and add the pawns to the key
+        for square in s.real_board_squares:
+            piece = self.board[square]
+            if piece[1] == 'p':
+                key ^= self.zobrist_pieces[s.zobrist_pieces[piece]][square]
+
+        return key
+
     def get_random_32bit_number(self):
 
         number = self.random_state
@@ -1264,6 +1418,93 @@ class GameState:
                 elif end_piece in f'{self.colors[0]}F':
                     break
 
+# ---------------------------------------------------------------------------------------------------------
+#                        Helpers: Check moves given from outside the engine
+# ---------------------------------------------------------------------------------------------------------
+
+    # Make a move given from outside the engine (e.g. in a UCI position command) if it is legal, without generating all
+    # legal moves. Returns False and leaves the position unchanged if the move is illegal.
+    def make_legal_move(self, move):
+
+        if not self.is_pseudo_legal(move):
+            return False
+
+        self.make_move(move)
+
+        # The king of the side that made the move can't be in check after it
+        self.is_white_turn = not self.is_white_turn
+        is_in_check = self.check_for_checks(self.king_location[not self.is_white_turn])
+        self.is_white_turn = not self.is_white_turn
+
+        if is_in_check:
+            self.unmake_move()
+            return False
+
+        return True
+
+    # Find if the piece on the start square can make the move, not considering pins and checks. Knight and slider moves
+    # are looked up in the attack tables, pawn moves, castling and promotions are checked on the board.
+    def is_pseudo_legal(self, move):
+
+        start_square, end_square, move_type, piece = move[:4]
+        color = 'w' if self.is_white_turn else 'b'
+        end_piece = self.board[end_square]
+        if piece != self.board[start_square] or piece[0] != color or end_piece[0] in f'{color}F':
+            return False
+
+        # Only pawns reaching the last rank promote, and they have to
+        end_row = s.end_row_white if self.is_white_turn else s.end_row_black
+        is_promotion = move_type in ('pQ', 'pR', 'pB', 'pN')
+        if is_promotion != (piece[1] == 'p' and end_square in end_row) or (move_type[0] == 'p' and not is_promotion):
+            return False
+
+        if piece[1] == 'p':
+            move_dir = -10 if self.is_white_turn else 10
+            start_row = s.start_row_white if self.is_white_turn else s.start_row_black
+            if end_square == start_square + move_dir:
+                return end_piece == '--'
+            if end_square == start_square + 2*move_dir:
+                return start_square in start_row and end_piece == '--' and self.board[start_square + move_dir] == '--'
+            if end_square in (start_square + move_dir - 1, start_square + move_dir + 1):
+                return end_piece != '--' or (move_type == 'ep' and end_square == self.enpassant_square)
+            return False
+
+        if piece[1] == 'K':
+            if move_type != 'castling':
+                return end_square - start_square in s.directions
+
+            # Castling, with the rights for that side, no pieces in between and the king not passing an attacked square.
+            # The end square is checked after the move is made.
+            side = 'k' if end_square > start_square else 'q'
+            between = (start_square + 1, start_square + 2) if side == 'k' else (start_square - 1, start_square - 2, start_square - 3)
+            return start_square == (95 if self.is_white_turn else 25) and bool(self.castling_rights & s.castling_numbers[f'{color}{side}']) and \
+                all(self.board[square] == '--' for square in between) and not self.check_for_checks(start_square) and \
+                not self.check_for_checks((start_square + end_square) // 2)
+
+        i, end_bit = es.real_board_index[start_square], square_bits[end_square]
+        if piece[1] == 'N':
+            return bool(knight_attacks[i] & end_bit)
+
+        all_occupied = 0
+        for bitboard in self.piece_bitboards:
+            all_occupied |= bitboard
+
+        attacked = 0
+        if piece[1] != 'R':
+            blockers = all_occupied & bishop_masks[i]
+            attacks = bishop_attacks[i].get(blockers)
+            if attacks is None:
+                attacks = bishop_attacks[i][blockers] = get_slider_attacks(start_square, s.directions[4:8], blockers)
+            attacked |= attacks
+        if piece[1] != 'B':
+            blockers = all_occupied & rook_masks[i]
+            attacks = rook_attacks[i].get(blockers)
+            if attacks is None:
+                attacks = rook_attacks[i][blockers] = get_slider_attacks(start_square, s.directions[0:4], blockers)
+            attacked |= attacks
+
+        return bool(attacked & end_bit)
+
 # ---------------------------------------------------------------------------------------------------------
 #                        Helpers: Check for checks, pins and both
 # ---------------------------------------------------------------------------------------------------------
@@ -1394,3 +1635,74 @@ class GameState:
                     break
 
         return pins
+
+# ---------------------------------------------------------------------------------------------------------
+#                        Helpers: Attack counts for the evaluation
+# ---------------------------------------------------------------------------------------------------------
+
+    # Count the squares attacked by each piece for both colors. Returns (mobility [piece number], king attacks [white, black],
+    # center attacks [white, black]) where:
+    #   - Mobility is the number of attacked squares not occupied by an own piece, for knights, bishops, rooks and queens
+    #   - King attacks is the number of attacks by pawns, knights, bishops, rooks and queens on the squares around the enemy king
+    #   - Center attacks is the number of attacks by the same pieces on d4, e4, d5 and e5
+    # The attacks are found from the piece bitboards that are updated in make/unmake move, so no board walk is needed. The
+    # result is cached for the current position, so it is only counted once per node.
+    def get_attack_info(self):
+
+        if self.attack_info_key == self.zobrist_key:
+            return self.attack_info
+
+        bitboards = self.piece_bitboards
+        occupied = [bitboards[0] | bitboards[1] | bitboards[2] | bitboards[3] | bitboards[4] | bitboards[5],
+                    bitboards[6] | bitboards[7] | bitboards[8] | bitboards[9] | bitboards[10] | bitboards[11]]
+        all_occupied = occupied[0] | occupied[1]
+
+        mobility = [0] * 12
+        king_attacks, center_attacks = [0, 0], [0, 0]
+        zones = [king_zones[self.king_location[1]], king_zones[self.king_location[0]]]
+
+        # Pawns attack diagonally forward, all pawns of a color are shifted at once (one shift per direction)
+        white_left, white_right = (bitboards[0] & not_a_file) >> 9, (bitboards[0] & not_h_file) >> 7
+        black_left, black_right = (bitboards[6] & not_a_file) << 7, (bitboards[6] & not_h_file) << 9
+        king_attacks[0] = bit_count(white_left & zones[0]) + bit_count(white_right & zones[0])
+        king_attacks[1] = bit_count(black_left & zones[1]) + bit_count(black_right & zones[1])
+        center_attacks[0] = bit_count(white_left & center_squares) + bit_count(white_right & center_squares)
+        center_attacks[1] = bit_count(black_left & center_squares) + bit_count(black_right & center_squares)
+
+        # Knights, bishops, rooks and queens, one piece at a time
+        for side in (0, 1):
+            not_own, zone = ~occupied[side], zones[side]
+            for piece_type in 'NBRQ':
+                piece_number = es.piece_to_number['wb'[side] + piece_type]
+                pieces = bitboards[piece_number]
+                while pieces:
+                    bit = pieces & -pieces
+                    pieces ^= bit
+                    i = bit.bit_length() - 1
+
+                    if piece_type == 'N':
+                        attacked = knight_attacks[i]
+                    else:
+                        attacked = 0
+                        if piece_type != 'R':
+                            blockers = all_occupied & bishop_masks[i]
+                            attacks = bishop_attacks[i].get(blockers)
+                            if attacks is None:
+                                attacks = bishop_attacks[i][blockers] = get_slider_attacks(s.real_board_squares[i], s.directions[4:8], blockers)
+                            attacked |= attacks
+                        if piece_type != 'B':
+                            blockers = all_occupied & rook_masks[i]
+                            attacks = rook_attacks[i].get(blockers)
+                            if attacks is None:
+                                attacks = rook_attacks[i][blockers] = get_slider_attacks(s.real_board_squares[i], s.directions[0:4], blockers)
+                            attacked |= attacks
+
+                    mobility[piece_number] += bit_count(attacked & not_own)
+                    if attacked & zone:
+                        king_attacks[side] += bit_count(attacked & zone)
+                    if attacked & center_squares:
+                        center_attacks[side] += bit_count(attacked & center_squares)
+
+        self.attack_info, self.attack_info_key = (mobility, king_attacks, center_attacks), self.zobrist_key
+
+        return self.attack_info
@@ -20,13 +20,15 @@ sys.path.insert(0, up1)
 import gamestate as gs
 import settings as s
 from ai import Ai
+from time_manager import TimeManager
 import fen_handling as fh
+import helper_functions as hf
+import move_notation as mn
 from gui.gui_theme import Theme
 from gui.gui_popup import Popup
 
 import time
 import pyperclip
-import math
 import cProfile
 import ctypes
 import pygame
@@ -409,6 +411,10 @@ class Gui:
                         elif event.key == pygame.K_c:
                             pyperclip.copy(self.current_fen)
 
+                        # Copy the game on PGN format with 'g'-key
+                        elif event.key == pygame.K_g:
+                            pyperclip.copy(mn.get_pgn(self.gamestate.start_fen, self.moves_made))
+
                         # Pause time with 'p'-key
                         elif event.key == pygame.K_p:
                             self.paused = not self.paused
@@ -525,37 +531,42 @@ class Gui:
         pygame.draw.line(self.screen, self.theme.black, (self.theme.board_offset, start_y + 4*self.theme.margin + self.theme.pv_font.get_height()), (self.theme.win_width - self.theme.board_offset - 1, start_y + 4*self.theme.margin + self.theme.pv_font.get_height()))
 
         # Draw AI info if game has started and AI has info to provide
-        if self.ai.pv_line:
+        if self.ai.pv_line and self.ai.print_info:
             # Draw PV info (Depth, time, nodes, (nodes/s), score, PV-line)
             start_y += 0.27 * self.theme.sq_size
-            length = len(self.ai.print_info)
-            for items, depth in enumerate(reversed(range(length))):
+
+            # In a MultiPV search all lines from the latest depth are shown, else the main line from each depth
+            latest_info = self.ai.print_info[len(self.ai.print_info) - 1]
+            if 'multi_pv' in latest_info:
+                rows = [dict(latest_info, score=score, main_line=main_line) for score, main_line in latest_info['multi_pv']]
+            else:
+                rows = [self.ai.print_info[depth] for depth in reversed(range(len(self.ai.print_info)))]
+
+            for row, info in enumerate(rows):
 
                 # Break to fit the text in the gui vertically
-                if items >= 6:
+                if row >= 6:
                     break
 
                 # Break fit the text in the gui horizontally
-                if len(self.ai.print_info[depth]['main_line'].split()) >= 9:
-                    self.ai.print_info[depth]['main_line'] = ' '.join(self.ai.print_info[depth]['main_line'].split()[0:9]).rstrip(',')
+                main_line = ' '.join(info['main_line'].split()[0:9])
 
                 # If score is large enough, make it maximum a mate score and find how many moves we are from mating
-                score = self.ai.print_info[depth]['score']
-                if -self.ai.mate_value <= score <= -self.ai.mate_score:
-                    length_to_mate = math.ceil(len(self.ai.print_info[depth]['main_line'].split()) / 2)
-                    score_text = f'-M{length_to_mate:.0f}'
-                elif self.ai.mate_score <= score <= self.ai.mate_value:
-                    length_to_mate = math.ceil(len(self.ai.print_info[depth]['main_line'].split()) / 2)
-                    score_text = f'M{length_to_mate:.0f}'
+                score = info['score']
+                length_to_mate = hf.moves_to_mate(score)
+                if length_to_mate < 0:
+                    score_text = f'-M{-length_to_mate}'
+                elif length_to_mate > 0:
+                    score_text = f'M{length_to_mate}'
                 else:
                     score_text = f'{score / 100:.2f}'
 
-                self.create_text(self.ai.print_info[depth]['depth'], self.theme.pv_font, self.theme.black, start_x + 0.32 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (length - depth), 'center')
-                self.create_text(self.ai.print_info[depth]['time'], self.theme.pv_font, self.theme.black, start_x + 1.3 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (length - depth), 'right')
-                self.create_text(f'{self.ai.print_info[depth]["nodes"]}', self.theme.pv_font, self.theme.black, start_x + 2.16 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (length - depth), 'right')
-                self.create_text(f'{self.ai.print_info[depth]["nodes_s"]}', self.theme.pv_font, self.theme.black, start_x + 3 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (length - depth), 'right')
-                self.create_text(score_text, self.theme.pv_font, self.theme.black, start_x + 3.79 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (length - depth), 'right')
-                self.create_text(self.ai.print_info[depth]['main_line'], self.theme.pv_font, self.theme.black, start_x + 4 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (length - depth), 'left')
+                self.create_text(info['depth'], self.theme.pv_font, self.theme.black, start_x + 0.32 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (row + 1), 'center')
+                self.create_text(info['time'], self.theme.pv_font, self.theme.black, start_x + 1.3 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (row + 1), 'right')
+                self.create_text(f'{info["nodes"]}', self.theme.pv_font, self.theme.black, start_x + 2.16 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (row + 1), 'right')
+                self.create_text(f'{info["nodes_s"]}', self.theme.pv_font, self.theme.black, start_x + 3 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (row + 1), 'right')
+                self.create_text(score_text, self.theme.pv_font, self.theme.black, start_x + 3.79 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (row + 1), 'right')
+                self.create_text(main_line, self.theme.pv_font, self.theme.black, start_x + 4 * self.theme.sq_size, start_y + 0.21 * self.theme.sq_size * (row + 1), 'left')
 
     # Draws the chess board with pieces
     def draw_board(self):
@@ -868,9 +879,6 @@ class Gui:
 
         # Calculate time parameters
         fixed_depth = 64
-        timeset = 0
-        stoptime = 0
-        starttime = time.time()
         movestogo = max(5, self.theme.movestogo - round(self.gamestate.move_counter))  # If we have less than 5 moves to go, always divide time left by 5
 
         # Set game time
@@ -880,31 +888,11 @@ class Gui:
         if self.theme.fixed_depth != 64:
             fixed_depth = self.theme.fixed_depth
 
-        # If move time was given, update time to movetime and moves to go to 1
-        if self.theme.movetime != 0:
-            tot_time = self.theme.movetime
-            movestogo = 1
-
-        # If time control is available, flag that we play with time control and set timing
-        if tot_time != 0:
-            timeset = 1
-
-            # Divide time equally between how many moves we should do
-            tot_time /= movestogo
-
-            # Add time and increment to get what time we should stop at (with lag compensation)
-            stoptime = max(starttime + 0.05, starttime + tot_time + self.theme.inc - 0.1)
-
-        # How often to check for timeout (at what nodes interval)
-        if tot_time < 5:
-            check_timeout = 800
-        elif 5 <= stoptime - starttime <= 10:
-            check_timeout = 12000
-        else:
-            check_timeout = 2000
+        # Time for the move, with the same time management as in UCI
+        time_manager = TimeManager(time_left=tot_time, inc=self.theme.inc, movestogo=movestogo, movetime=self.theme.movetime)
 
         # Init AI and variables
-        self.ai = Ai(self.gamestate, search_depth=fixed_depth, stoptime=stoptime, timeset=timeset, check_timeout=check_timeout)
+        self.ai = Ai(self.gamestate, search_depth=fixed_depth, stoptime=time_manager.stoptime, timeset=time_manager.timeset, multi_pv=self.theme.multi_pv)
 
         self.ai.pv_line = ''
         self.ai.print_info = {}
@@ -941,6 +929,11 @@ class Gui:
             else:
                 best_move, best_score = move, score
 
+            # Stop if there is no time for another iteration
+            time_manager.update(move, score)
+            if time_manager.is_done():
+                break
+
         return best_move, best_score
 
     # Make a move on the board
@@ -1051,6 +1044,10 @@ class Gui:
         if self.gamestate.halfmove_counter >= 100:
             return 'stalemate'
 
+        # Check for draw by insufficient material
+        if self.gamestate.is_material_draw:
+            return 'material draw'
+
         # Check for time out (ignore for user if forfeit on time option is not on
         if self.white_time < 0 and not self.theme.fixed_depth and not self.theme.movetime:
             self.white_time = 0
@@ -403,6 +403,7 @@ class Popup:
         # Change the input text to suit purpose
         text = {'checkmate': 'Checkmate',
                 'stalemate': 'Stalemate',
+                'material draw': 'Draw, insufficient material',
                 'white time': 'White lost on time',
                 'black time': 'Black lost on time'}[input_text]
 
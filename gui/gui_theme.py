@@ -26,6 +26,7 @@ class Theme:
         self.forfeit_on_time = False
         self.enable_shortcuts = True
         self.auto_flip = True
+        self.multi_pv = 1  # Number of best lines the AI searches and shows in the PV panel
 
         # Timings
         self.fixed_depth = 0
@@ -4,7 +4,7 @@
 #                                     helper_functions.py
 #
 #                   - Tasks that are used in several files are handled here
-#                   - Printing, board manipulations, getting PV-line etc
+#                   - Printing, board manipulations, mate score conversions etc
 #
 # /////////////////////////////////////////////////////////////////////////////////////////////////////////
 # ---------------------------------------------------------------------------------------------------------
@@ -12,92 +12,51 @@
 import settings as s
 
 
-# Print the principal variation line
-def get_pv_line(gamestate, pv_line):
+# Mate scores are stored relative to the root (mate_value - ply). When caching a score it needs to be relative to
+# the node it was found in instead, otherwise the mate distance is wrong when the position is reached at another ply.
+def score_to_tt(score, ply):
 
-    import copy
+    if score > s.mate_score:
+        return score + ply
+    if score < -s.mate_score:
+        return score - ply
 
-    # Copy the gamestate
-    gamestate_copy = copy.deepcopy(gamestate)
+    return score
 
-    # Loop over the PV-line and extract each moves from and to square
-    move_list_pv, move_list = [], ''
-    for move in pv_line:
 
-        # Make the move on the copied board to not ruin normal gamestate
-        gamestate_copy.make_move(move)
+# Convert a cached (node relative) mate score back to be relative to the root
+def score_from_tt(score, ply):
 
-        # From and to square for PV line standard print
-        from_sq = s.square_to_board[move[0]]
-        to_sq = s.square_to_board[move[1]]
-
-        # Piece moved and promotion piece
-        piece = move[3][1]
-        move_type = move[2]
-        promo = move_type[-1].lower() if move_type in 'pQpRpBpN' else ''
-
-        # Captures
-        if gamestate_copy.piece_captured != '--':
-
-            # Enpassant are special
-            if 'ep' in move_type:
-                text = f'{from_sq}x{to_sq} e.p.'
-
-            # Else normal capture
-            else:
-                if piece in 'pP':
-                    text = f'{from_sq}x{to_sq}'
-                else:
-                    text = f'{piece}{from_sq}x{to_sq}'
-
-        # Quiet moves
-        else:
-
-            # Castling king side
-            if move_type == 'castling' and move[0] - move[1] == -2:
-                text = 'O-O'
-                # Queen side
-            elif move_type == 'castling' and move[0] - move[1] == 2:
-                text = 'O-O-O'
-
-            # Normal quiet moves
-            else:
-                if piece in 'pP':
-                    text = f'{from_sq}-{to_sq}'
-                else:
-                    text = f'{piece}{from_sq}-{to_sq}'
+    if score > s.mate_score:
+        return score - ply
+    if score < -s.mate_score:
+        return score + ply
 
-        # If promotion, add the promoted piece to the text
-        if promo:
-            text += promo
+    return score
 
-        # Handle check, checkmate or stalemate
-        # See if there are any legal moves left for opponent, break if we find a legal move to speed up process
-        possible_moves = gamestate_copy.get_valid_moves()
 
-        # If is in check and no moves -> checkmate. If not in check and no moves -> stalemate.
-        if gamestate_copy.is_in_check:
+# Full moves until mate, positive if the side to move mates and negative if it gets mated. Returns 0 if not a mate score.
+def moves_to_mate(score):
 
-            # Checkmate
-            if not possible_moves:
-                text += '#'
+    # Mating, a mate at ply 1 is mate in 1, ply 3 is mate in 2 etc
+    if score > s.mate_score:
+        return (s.mate_value - score + 1) // 2
 
-            # Normal check
-            else:
-                text += '+'
+    # Getting mated, a mate at ply 2 is mated in 1, ply 4 is mated in 2 etc
+    if score < -s.mate_score:
+        return -((s.mate_value + score) // 2)
 
-        elif not possible_moves:
+    return 0
 
-            # Draw
-            text += ' 1/2-1/2'
 
-        # Add to move list
-        move_list += f'{text}, '
+# Get the score on UCI format, 'mate x' if mate is found or else 'cp x'
+def get_uci_score(score):
 
-    # Remove last comma
-    move_list = move_list[:-2]
+    mate_in = moves_to_mate(score)
+    if mate_in:
+        return f'mate {mate_in}'
 
-    return move_list
+    return f'cp {int(score)}'
 
 
 # Rotate a board to blacks perspective
@@ -0,0 +1,471 @@
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                        match_runner.py
+#
+#                   - Plays engine vs engine matches without a GUI, to validate search and evaluation changes
+#                   - Each engine is a parameter set for Endamat Chess (run with parameters.py) or any UCI engine
+#                   - The games are played in a pool of worker processes, each worker plays one game at a time
+#                     with its own two engine processes. Only one engine thinks at a time, so the number of games
+#                     per second grows linearly with the number of workers up to the number of cores.
+#                   - Each opening is played twice with the colors switched
+#                   - Games are adjudicated as a draw or a win when both engines agree on the score for some
+#                     moves, and with the endgame tablebases
+#                   - Reports the Elo difference and a live SPRT verdict after each game
+#
+#  Run from the main folder:
+#      python match_runner.py params.json default --games 1000 --tc 10+0.1
+#      python match_runner.py evaluation_settings_tuned.py default --nodes 20000 --openings openings.epd --elo0 0 --elo1 5
+#      python match_runner.py default "uci:stockfish" --tc 5+0.05 --workers 4
+#
+#  An engine is given as "default" (Endamat Chess with the normal settings), a parameter set (.json or .py,
+#  see parameters.py) or "uci:<command>" for any UCI engine. The Elo difference is for the first engine.
+#
+#  The openings file has one FEN or EPD per line. Without an openings file, each opening is a few random
+#  moves from the start position.
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+import argparse
+import math
+import multiprocessing.util
+import os
+import queue
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import Pool
+
+import fen_handling as fh
+import move_notation as mn
+import settings as s
+import tablebase as tb
+from analyze import read_positions
+from gamestate import GameState
+
+main_folder = os.path.dirname(os.path.abspath(__file__))
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                           Engines
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# A UCI engine running in its own process. The output is read in a thread so that it can be waited for with a timeout.
+class Engine:
+
+    def __init__(self, spec):
+
+        self.spec = spec
+        self.start()
+
+    def start(self):
+
+        spec = self.spec
+        if spec.startswith('uci:'):
+            command = shlex.split(spec[4:])
+        else:
+            command = [sys.executable, os.path.join(main_folder, 'parameters.py')] + ([spec] if spec != 'default' else []) + ['--no-log']
+
+        self.process = subprocess.Popen(command, cwd=main_folder, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self.lines = queue.Queue()
+        threading.Thread(target=self.read_lines, daemon=True).start()
+
+        self.send('uci')
+        if not self.wait_for('uciok', 30):
+            raise RuntimeError(f'engine "{spec}" did not answer uci')
+
+    def read_lines(self):
+
+        for line in self.process.stdout:
+            self.lines.put(line.strip())
+        self.lines.put(None)
+
+    def send(self, command):
+
+        self.process.stdin.write(command + '\n')
+        self.process.stdin.flush()
+
+    # Wait for a line starting with the prefix, returns None if the engine doesn't send it in time or quits.
+    # The latest score (centipawns from the engine perspective, mate as +-mate_value) is kept from the info lines.
+    def wait_for(self, prefix, timeout):
+
+        end_time = time.time() + timeout
+        while True:
+            try:
+                line = self.lines.get(timeout=max(0.001, end_time - time.time()))
+            except queue.Empty:
+                return None
+            if line is None:
+                return None
+            if line.startswith(prefix):
+                return line
+
+            tokens = line.split() or ['']
+            if tokens[0] == 'info' and 'score' in tokens and ('multipv' not in tokens or tokens[tokens.index('multipv') + 1] == '1'):
+                score_type, value = tokens[tokens.index('score') + 1:tokens.index('score') + 3]
+                if score_type == 'cp':
+                    self.score = int(value)
+                elif score_type == 'mate':
+                    self.score = s.mate_value if int(value) > 0 else -s.mate_value
+
+    def new_game(self):
+
+        self.send('ucinewgame')
+        self.send('isready')
+        if not self.wait_for('readyok', 30):
+            raise RuntimeError('engine did not answer isready')
+
+    # Search a position, returns the best move and the latest score, or None if the engine didn't answer in time
+    def go(self, position, go_command, timeout):
+
+        self.score = None
+        self.send(position)
+        self.send(go_command)
+        line = self.wait_for('bestmove', timeout)
+        if not line or len(line.split()) < 2:
+            return None
+
+        return line.split()[1], self.score
+
+    # Stop a search that didn't finish in time and read its best move, so that it isn't taken as the reply to the next
+    # go command. The engine is restarted if it doesn't answer.
+    def stop(self):
+
+        try:
+            self.send('stop')
+            if self.wait_for('bestmove', 10):
+                return
+        except OSError:
+            pass
+
+        self.quit()
+        self.start()
+
+    def quit(self):
+
+        try:
+            self.send('quit')
+            self.process.wait(5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                          Play games
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# The engines and match options in each worker process
+engines = []
+options = {}
+
+
+def init_worker(engine_specs, match_options):
+
+    engines[:] = [Engine(spec) for spec in engine_specs]
+    options.update(match_options)
+
+    # Quit the engines when the worker exits after the last game
+    multiprocessing.util.Finalize(None, quit_engines, exitpriority=10)
+
+
+def quit_engines():
+
+    for engine in engines:
+        engine.quit()
+
+
+# The go command for the side to move
+def get_go_command(clocks):
+
+    if options['nodes']:
+        return f'go nodes {options["nodes"]}'
+    if options['depth']:
+        return f'go depth {options["depth"]}'
+    if options['movetime']:
+        return f'go movetime {round(options["movetime"] * 1000)}'
+
+    inc = round(options['inc'] * 1000)
+    return f'go wtime {max(1, round(clocks[0] * 1000))} btime {max(1, round(clocks[1] * 1000))} winc {inc} binc {inc}'
+
+
+# Find if the game is over in the current position. Returns the result from white perspective and the reason, or None.
+def get_game_result(gamestate, valid_moves, repetitions, plies):
+
+    if not valid_moves:
+        if gamestate.check_for_checks(gamestate.king_location[not gamestate.is_white_turn]):
+            return (0 if gamestate.is_white_turn else 1), 'checkmate'
+        return 0.5, 'stalemate'
+    if gamestate.is_material_draw:
+        return 0.5, 'insufficient material'
+    if gamestate.halfmove_counter >= 100:
+        return 0.5, '50 move rule'
+    if repetitions[gamestate.zobrist_key] >= 3:
+        return 0.5, '3 fold repetition'
+    if plies >= 2 * options['max_moves']:
+        return 0.5, 'adjudication, max moves'
+
+    # Tablebase adjudication, the result for the side to move
+    if gamestate.material_key in tb.tables:
+        wdl = tb.probe_wdl(gamestate)
+        if wdl is not None:
+            result = 0.5 if wdl == 0 else float(wdl > 0) if gamestate.is_white_turn else float(wdl < 0)
+            return result, 'adjudication, tablebase'
+
+    return None
+
+
+# Play one game between the two engines in the worker. Returns the game number, the result for the first engine
+# (1, 0.5 or 0), the reason the game ended and the number of plies.
+def play_game(task):
+
+    game_number, fen, is_first_engine_white = task
+
+    white, black = engines if is_first_engine_white else engines[::-1]
+    for engine in engines:
+        engine.new_game()
+
+    gamestate = GameState(fen)
+    moves = []
+    repetitions = {gamestate.zobrist_key: 1}
+    clocks = [options['time'], options['time']]
+    draw_plies = 0  # Plies in a row both engines have scored the position as a draw
+    win_plies = 0  # Plies in a row both engines have scored the position as won for the same side
+    win_side = 0
+    result = None
+
+    while not result:
+
+        valid_moves = {mn.move_to_uci(move): move for move in gamestate.get_valid_moves()}
+        result = get_game_result(gamestate, valid_moves, repetitions, len(moves))
+        if result:
+            break
+
+        side = 0 if gamestate.is_white_turn else 1
+        engine = white if gamestate.is_white_turn else black
+        loss = 0 if gamestate.is_white_turn else 1  # Result from white perspective if the engine to move loses
+
+        # Let the engine search, it loses if it uses more than its time (with a margin for the communication)
+        position = f'position fen {fen} moves {" ".join(moves)}' if moves else f'position fen {fen}'
+        timeout = clocks[side] + options['time_margin'] if options['time'] else options['move_timeout']
+        start_time = time.time()
+        reply = engine.go(position, get_go_command(clocks), timeout)
+        if not reply:
+            engine.stop()
+        if options['time']:
+            clocks[side] -= time.time() - start_time
+            if clocks[side] < -options['time_margin']:
+                result = loss, 'time forfeit'
+                break
+            clocks[side] += options['inc']
+
+        if not reply:
+            result = loss, 'engine did not answer'
+            break
+        move, score = reply
+        if move not in valid_moves:
+            result = loss, f'illegal move {move}'
+            break
+
+        gamestate.make_move(valid_moves[move])
+        moves.append(move)
+        repetitions[gamestate.zobrist_key] = repetitions.get(gamestate.zobrist_key, 0) + 1
+
+        # Adjudication. The score is from the perspective of the engine that moved, both engines have to agree.
+        if score is None:
+            draw_plies = win_plies = 0
+            continue
+        white_score = score if side == 0 else -score
+
+        if len(moves) >= 2 * options['draw_start'] and abs(white_score) <= options['draw_score']:
+            draw_plies += 1
+        else:
+            draw_plies = 0
+
+        if abs(white_score) >= options['resign_score']:
+            win_plies = win_plies + 1 if (white_score > 0) == (win_side > 0) else 1
+            win_side = white_score
+        else:
+            win_plies = 0
+
+        if draw_plies >= 2 * options['draw_moves']:
+            result = 0.5, 'adjudication, draw'
+        elif win_plies >= 2 * options['resign_moves']:
+            result = float(win_side > 0), 'adjudication, win'
+
+    white_result, reason = result
+    return game_number, white_result if is_first_engine_white else 1 - white_result, reason, len(moves)
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                     Openings and statistics
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Random openings, a few random moves from the start position that don't end the game
+def get_random_openings(count, plies, seed):
+
+    rng = random.Random(seed)
+    openings = []
+    while len(openings) < count:
+        gamestate = GameState(s.start_fen)
+        for _ in range(plies):
+            valid_moves = gamestate.get_valid_moves()
+            if not valid_moves:
+                break
+            gamestate.make_move(rng.choice(valid_moves))
+        if gamestate.get_valid_moves():
+            openings.append(fh.gamestate_to_fen(gamestate))
+
+    return openings
+
+
+# Elo difference from the score, with the 95 % confidence interval
+def get_elo(wins, losses, draws):
+
+    games = wins + losses + draws
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + losses * score ** 2 + draws * (0.5 - score) ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+
+    def score_to_elo(x):
+        return -400 * math.log10(1 / x - 1) if 0 < x < 1 else math.copysign(math.inf, x - 0.5)
+
+    # With only wins or only losses the Elo difference is infinite, and so is the uncertainty
+    if not 0 < score < 1:
+        return score_to_elo(score), math.inf
+
+    return score_to_elo(score), (score_to_elo(min(1.0, score + margin)) - score_to_elo(max(0.0, score - margin))) / 2
+
+
+# Log likelihood ratio of the SPRT (https://www.chessprogramming.org/Sequential_Probability_Ratio_Test) for the
+# hypotheses that the Elo difference is elo0 (H0) or elo1 (H1), with the normal approximation of the game results
+def get_llr(wins, losses, draws, elo0, elo1):
+
+    games = wins + losses + draws
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + losses * score ** 2 + draws * (0.5 - score) ** 2) / games
+    if not variance:
+        return 0.0
+
+    score0, score1 = (1 / (1 + 10 ** (-elo / 400)) for elo in (elo0, elo1))
+    return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                            Main
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Play an engine vs engine match')
+    parser.add_argument('engine1', help='"default", a parameter set (.json or .py) or "uci:<command>"')
+    parser.add_argument('engine2', help='"default", a parameter set (.json or .py) or "uci:<command>"')
+    parser.add_argument('--games', type=int, default=100, help='number of games (rounded up to an even number)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of games played at the same time')
+    parser.add_argument('--tc', default='10+0.1', help='time control, seconds per game + increment per move')
+    parser.add_argument('--nodes', type=int, default=0, help='nodes per move instead of a time control')
+    parser.add_argument('--depth', type=int, default=0, help='depth per move instead of a time control')
+    parser.add_argument('--movetime', type=float, default=0, help='seconds per move instead of a time control')
+    parser.add_argument('--openings', help='file with one opening FEN/EPD per line, played in order')
+    parser.add_argument('--random-plies', type=int, default=6, help='random moves in each opening when no openings file is given')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the random openings')
+    parser.add_argument('--elo0', type=float, help='SPRT, Elo difference of H0')
+    parser.add_argument('--elo1', type=float, help='SPRT, Elo difference of H1, the match stops when H0 or H1 is accepted')
+    parser.add_argument('--alpha', type=float, default=0.05, help='SPRT, false positive rate')
+    parser.add_argument('--beta', type=float, default=0.05, help='SPRT, false negative rate')
+    parser.add_argument('--draw-start', type=int, default=40, help='draw adjudication, first move it can happen')
+    parser.add_argument('--draw-moves', type=int, default=8, help='draw adjudication, moves in a row with a score within draw-score')
+    parser.add_argument('--draw-score', type=int, default=10, help='draw adjudication, max score (centipawns)')
+    parser.add_argument('--resign-moves', type=int, default=4, help='win adjudication, moves in a row with a score above resign-score')
+    parser.add_argument('--resign-score', type=int, default=800, help='win adjudication, min score (centipawns)')
+    parser.add_argument('--max-moves', type=int, default=200, help='the game is a draw after this many moves')
+    parser.add_argument('--time-margin', type=float, default=0.1, help='seconds an engine can go over its time without losing')
+    parser.add_argument('--move-timeout', type=float, default=300, help='max seconds per move without a time control')
+    args = parser.parse_args()
+
+    if args.games < 1:
+        parser.error('--games has to be at least 1')
+
+    sprt = args.elo0 is not None and args.elo1 is not None
+    base_time, inc = (0, 0) if args.nodes or args.depth or args.movetime else map(float, args.tc.split('+')) if '+' in args.tc else (float(args.tc), 0)
+    match_options = {'time': base_time, 'inc': inc, 'nodes': args.nodes, 'depth': args.depth, 'movetime': args.movetime,
+                     'draw_start': args.draw_start, 'draw_moves': args.draw_moves, 'draw_score': args.draw_score,
+                     'resign_moves': args.resign_moves, 'resign_score': args.resign_score, 'max_moves': args.max_moves,
+                     'time_margin': args.time_margin, 'move_timeout': args.move_timeout}
+
+    # Each opening is played with both colors
+    pairs = (args.games + 1) // 2
+    if args.openings:
+        openings = [fen for _, fen in read_positions(args.openings)]
+    else:
+        openings = get_random_openings(pairs, args.random_plies, args.seed)
+    tasks = [(2 * pair + color, openings[pair % len(openings)], color == 0) for pair in range(pairs) for color in range(2)]
+
+    if sprt:
+        lower_bound, upper_bound = math.log(args.beta / (1 - args.alpha)), math.log((1 - args.beta) / args.alpha)
+
+    wins = losses = draws = 0
+    elo, margin, llr, verdict = 0.0, math.inf, 0.0, None
+    start_time = time.time()
+    print(f'{args.engine1} vs {args.engine2}, {len(tasks)} games with {args.workers} workers')
+
+    with Pool(args.workers, initializer=init_worker, initargs=((args.engine1, args.engine2), match_options)) as pool:
+        for finished, (game_number, result, reason, plies) in enumerate(pool.imap_unordered(play_game, tasks), start=1):
+
+            wins, losses, draws = wins + (result == 1), losses + (result == 0), draws + (result == 0.5)
+            elo, margin = get_elo(wins, losses, draws)
+
+            line = f'Game {finished}/{len(tasks)} (#{game_number + 1}): {"1-0" if result == 1 else "0-1" if result == 0 else "1/2-1/2"} ' \
+                   f'{reason}, {plies} plies | +{wins} -{losses} ={draws} | Elo {elo:.1f} +- {margin:.1f}'
+
+            # Stop the match as soon as the SPRT accepts one of the hypotheses
+            verdict = None
+            if sprt:
+                llr = get_llr(wins, losses, draws, args.elo0, args.elo1)
+                line += f' | LLR {llr:.2f} ({lower_bound:.2f}, {upper_bound:.2f})'
+                if llr >= upper_bound:
+                    verdict = f'H1 accepted, {args.engine1} is stronger by at least {args.elo1} Elo'
+                elif llr <= lower_bound:
+                    verdict = f'H0 accepted, {args.engine1} is not stronger by {args.elo1} Elo'
+
+            print(line, flush=True)
+            if verdict:
+                print(f'SPRT: {verdict}')
+                break
+
+        # Let the workers exit normally after the last game, so that they quit their engines. When the SPRT stops the match
+        # early the workers are terminated, and the engines quit when their input is closed.
+        if not verdict:
+            pool.close()
+            pool.join()
+
+    games = wins + losses + draws
+    print(f'Finished {games} games in {time.time() - start_time:.1f} s ({games / (time.time() - start_time) * 60:.1f} games/min)')
+    if not games:
+        return
+    print(f'Score of {args.engine1} vs {args.engine2}: +{wins} -{losses} ={draws} ({(wins + draws / 2) / games:.3f}), Elo {elo:.1f} +- {margin:.1f}')
+    if sprt and not verdict:
+        print(f'SPRT: no verdict yet, LLR {llr:.2f} ({lower_bound:.2f}, {upper_bound:.2f})')
+
+
+if __name__ == '__main__':
+    main()
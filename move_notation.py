@@ -0,0 +1,331 @@
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                        move_notation.py
+#
+#                   - Converts moves to SAN (Nf3, exd6, O-O, e8=Q+) and UCI long algebraic (g1f3, e7e8q), and back from UCI
+#                   - Formats PV-lines and complete games (PGN)
+#                   - Disambiguation and check detection without generating all legal moves
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+import settings as s
+
+#  --------------------------------------------------------------------------------
+#                                 Helper tables
+#  --------------------------------------------------------------------------------
+
+# Direction to go from one square to another if they are on the same line, else 0. [from square][to square]
+line_direction = [[0] * 120 for _ in range(120)]
+for square in s.real_board_squares:
+    for d in s.directions:
+        end_square = square + d
+        while end_square in s.square_to_board:
+            line_direction[square][end_square] = d
+            end_square += d
+
+orthogonal_directions = s.directions[0:4]
+diagonal_directions = s.directions[4:8]
+knight_moves = set(s.knight_moves)
+
+# Squares a pawn of each color attacks from a square
+pawn_attacks = {'w': (-11, -9), 'b': (9, 11)}
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                        UCI notation
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Get a move on UCI format, e.g. 'g1f3' or 'e7e8q'
+def move_to_uci(move):
+
+    text = s.square_to_board[move[0]] + s.square_to_board[move[1]]
+
+    # Promotion piece in lower case
+    if move[2] in 'pQpRpBpN':
+        text += move[2][-1].lower()
+
+    return text
+
+
+# Get a move on the gamestate format from a move on UCI format (e.g. e2e4, e7e8q) without generating the legal moves.
+# The move type is found from the piece that moves. The move is not checked for legality (see GameState.make_legal_move),
+# returns 0 if there is no piece of the side to move on the start square.
+def uci_to_move(gamestate, move_string):
+
+    start_square, end_square = s.board_to_square[move_string[0:2]], s.board_to_square[move_string[2:4]]
+    piece = gamestate.board[start_square]
+    if piece[0] != ('w' if gamestate.is_white_turn else 'b'):
+        return 0
+
+    move_type = 'no'
+    if len(move_string) > 4:
+        move_type = f'p{move_string[4].upper()}'
+    elif piece[1] == 'K' and abs(end_square - start_square) == 2:
+        move_type = 'castling'
+    elif piece[1] == 'p' and abs(end_square - start_square) == 20:
+        move_type = 'ts'
+    elif piece[1] == 'p' and end_square == gamestate.enpassant_square:
+        move_type = 'ep'
+
+    return [start_square, end_square, move_type, piece, 0]
+
+
+# Get a PV-line on UCI format, moves separated by a space
+def get_uci_line(pv_line):
+
+    return ' '.join(move_to_uci(move) for move in pv_line)
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                        SAN notation
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Get a move on SAN format without the check/mate suffix. The move needs to be legal in the current gamestate.
+# If the legal moves in the position are already generated they can be given to find ambiguous moves, otherwise
+# the board is scanned from the target square for other pieces of the same type.
+def move_to_san_body(gamestate, move, legal_moves=None):
+
+    start_square, end_square, move_type, piece = move[0], move[1], move[2], move[3]
+
+    # Castling
+    if move_type == 'castling':
+        return 'O-O' if end_square > start_square else 'O-O-O'
+
+    is_capture = gamestate.board[end_square] != '--' or move_type == 'ep'
+    to_sq = s.square_to_board[end_square]
+
+    # Pawn moves, captures always include the file the pawn moved from
+    if piece[1] == 'p':
+        text = f'{s.square_to_board[start_square][0]}x{to_sq}' if is_capture else to_sq
+
+        if move_type in 'pQpRpBpN':
+            text += f'={move_type[-1]}'
+
+        return text
+
+    # Find if there are any other pieces of the same type that can move to the same square
+    text = piece[1]
+    if piece[1] != 'K':
+        if legal_moves is not None:
+            others = [other[0] for other in legal_moves if other[1] == end_square and other[3] == piece and other[0] != start_square]
+        else:
+            others = get_other_attackers(gamestate, start_square, end_square, piece)
+
+        # Disambiguate by file if possible, else by rank, else both
+        if others:
+            from_sq = s.square_to_board[start_square]
+            if all(start_square % 10 != other % 10 for other in others):
+                text += from_sq[0]
+            elif all(start_square // 10 != other // 10 for other in others):
+                text += from_sq[1]
+            else:
+                text += from_sq
+
+    if is_capture:
+        text += 'x'
+
+    return text + to_sq
+
+
+# Get a move on SAN format including '+' or '#', e.g. 'Nbd7', 'exd6', 'e8=Q+'
+def move_to_san(gamestate, move, legal_moves=None):
+
+    text = move_to_san_body(gamestate, move, legal_moves)
+
+    gamestate.make_move(move)
+    text += get_check_suffix(gamestate, move, True)
+    gamestate.unmake_move()
+
+    return text
+
+
+# Get a list of moves on SAN format. The moves are made on the gamestate and then taken back.
+def get_san_moves(gamestate, moves, legal_moves=None):
+
+    san_moves = []
+    for i, move in enumerate(moves):
+
+        # Legal moves are only known for the first move
+        text = move_to_san_body(gamestate, move, legal_moves if i == 0 else None)
+        gamestate.make_move(move)
+
+        # Only the last move can be mate, the opponent has a legal reply (the next move) for all other moves
+        san_moves.append(text + get_check_suffix(gamestate, move, i == len(moves) - 1))
+
+    # Take back the moves to get the original gamestate
+    for _ in moves:
+        gamestate.unmake_move()
+
+    return san_moves
+
+
+# Get a PV-line on SAN format, moves separated by a space
+def get_san_line(gamestate, pv_line, legal_moves=None):
+
+    return ' '.join(get_san_moves(gamestate, pv_line, legal_moves))
+
+
+# Get '+' if the move just made gives check, '#' if it is checkmate (only looked for if can_be_mate)
+def get_check_suffix(gamestate, move, can_be_mate):
+
+    if not gives_check(gamestate, move):
+        return ''
+
+    if can_be_mate and not gamestate.get_valid_moves():
+        return '#'
+
+    return '+'
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                        PGN notation
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Get a complete game on PGN format from the start position and the moves made
+def get_pgn(start_fen, moves, result='*', white='?', black='?'):
+
+    import time
+    from gamestate import GameState
+
+    gamestate = GameState(start_fen)
+    san_moves = get_san_moves(gamestate, moves)
+
+    # Tag pairs, the FEN is only needed if the game didn't start from the normal start position
+    tags = [('Event', '?'), ('Site', '?'), ('Date', time.strftime('%Y.%m.%d')), ('Round', '?'),
+            ('White', white), ('Black', black), ('Result', result)]
+    if start_fen.split()[:4] != s.start_fen.split()[:4]:
+        tags += [('SetUp', '1'), ('FEN', start_fen)]
+
+    # Add move numbers before white moves (and before the first move if black starts)
+    move_number, is_white_turn = max(1, int(gamestate.move_counter)), gamestate.is_white_turn
+    text = ''
+    for i, san in enumerate(san_moves):
+        if is_white_turn:
+            text += f'{move_number}. '
+        elif i == 0:
+            text += f'{move_number}... '
+        text += f'{san} '
+
+        if not is_white_turn:
+            move_number += 1
+        is_white_turn = not is_white_turn
+
+    text += result
+
+    return '\n'.join(f'[{tag} "{value}"]' for tag, value in tags) + '\n\n' + text + '\n'
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                       Helper functions
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Find other pieces of the same type and color that can legally move to end_square (used for disambiguation)
+def get_other_attackers(gamestate, start_square, end_square, piece):
+
+    board = gamestate.board
+    others = []
+
+    # Knights
+    if piece[1] == 'N':
+        for d in s.knight_moves:
+            if board[end_square + d] == piece and end_square + d != start_square:
+                others.append(end_square + d)
+
+    # Sliding pieces, go out from the end square until we hit a piece
+    else:
+        directions = s.directions if piece[1] == 'Q' else orthogonal_directions if piece[1] == 'R' else diagonal_directions
+        for d in directions:
+            square = end_square + d
+            while board[square] == '--':
+                square += d
+            if board[square] == piece and square != start_square:
+                others.append(square)
+
+    # Remove pieces that are pinned and can't move along the pin line to the end square
+    if others:
+        pins = dict(gamestate.check_for_pins(gamestate.king_location[not gamestate.is_white_turn]))
+        others = [other for other in others if other not in pins or (piece[1] != 'N' and line_direction[other][end_square] in (pins[other], -pins[other]))]
+
+    return others
+
+
+# Find if a piece on a square attacks the given target square
+def attacks_square(board, square, target):
+
+    piece = board[square]
+
+    # Knights and pawns
+    if piece[1] == 'N':
+        return target - square in knight_moves
+    if piece[1] == 'p':
+        return target - square in pawn_attacks[piece[0]]
+
+    # Sliding pieces, need to be on the same line with the right direction type and nothing in between
+    d = line_direction[square][target]
+    if not d or piece[1] == 'K' or (piece[1] == 'R' and d not in orthogonal_directions) or (piece[1] == 'B' and d not in diagonal_directions):
+        return False
+
+    square += d
+    while square != target:
+        if board[square] != '--':
+            return False
+        square += d
+
+    return True
+
+
+# Find if a sliding piece attacks the king through an emptied square (discovered check)
+def discovers_check(board, king_square, emptied_square, color):
+
+    d = line_direction[king_square][emptied_square]
+    if not d:
+        return False
+
+    # Go out from the king through the emptied square until we hit a piece
+    square = king_square + d
+    while board[square] == '--':
+        square += d
+
+    piece = board[square]
+    return piece[0] == color and (piece[1] == 'Q' or (piece[1] == 'R' and d in orthogonal_directions) or (piece[1] == 'B' and d in diagonal_directions))
+
+
+# Find if the move just made gives check, only looking at the moved piece and pieces behind the emptied squares
+def gives_check(gamestate, move):
+
+    board = gamestate.board
+    king_square = gamestate.king_location[not gamestate.is_white_turn]
+    start_square, end_square, move_type = move[0], move[1], move[2]
+    color = move[3][0]
+
+    # Direct check by the moved (or promoted) piece, or the rook after castling
+    if attacks_square(board, end_square, king_square):
+        return True
+    if move_type == 'castling' and attacks_square(board, s.rook_castling[end_square][0], king_square):
+        return True
+
+    # Discovered check from the square the piece moved from, or the square of the pawn captured en passant
+    if discovers_check(board, king_square, start_square, color):
+        return True
+    if move_type == 'ep':
+        return discovers_check(board, king_square, end_square + (10 if color == 'w' else -10), color)
+
+    return False
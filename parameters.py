@@ -0,0 +1,112 @@
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                        parameters.py
+#
+#                   - Runs the UCI engine with another parameter set, used by the match runner and to try
+#                     a parameter set in an external GUI
+#                   - A parameter set is either a .py file that replaces evaluation_settings.py (e.g. written by
+#                     the texel tuner), or a .json file with new values for variables in settings.py and/or
+#                     evaluation_settings.py:
+#                         {"settings": {"R": 3}, "evaluation_settings": {"double_pawn": -20}}
+#                   - The new values replace the assignments in the module source before the module is imported,
+#                     so all tables that are built from them get the new values too
+#
+#  Run from the main folder (without a parameter set the engine runs with the normal settings):
+#      python parameters.py params.json
+#      python parameters.py evaluation_settings_tuned.py --no-log
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+import argparse
+import ast
+import json
+import logging
+import os
+import sys
+import types
+
+main_folder = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that can get new values, in the order they have to be imported
+parameter_modules = ('settings', 'evaluation_settings')
+
+
+# Replace the top level assignments of the given variables in a module source
+def replace_assignments(source, values):
+
+    lines = source.split('\n')
+    assignments = {node.targets[0].id: node for node in ast.parse(source).body if isinstance(node, ast.Assign) and len(node.targets) == 1
+                   and isinstance(node.targets[0], ast.Name)}
+
+    unknown = [name for name in values if name not in assignments]
+    if unknown:
+        raise ValueError(f'unknown parameters: {", ".join(unknown)}')
+
+    # Replace from the bottom up so that the line numbers stay valid
+    for node in sorted((assignments[name] for name in values), key=lambda node: node.lineno, reverse=True):
+        first, last = node.lineno - 1, node.end_lineno - 1
+        rest = lines[last][node.end_col_offset:]
+        lines[first:last + 1] = [f'{node.targets[0].id} = {values[node.targets[0].id]!r}{rest}']
+
+    return '\n'.join(lines)
+
+
+# Import a module from a source file (with some assignments replaced) under the given module name
+def load_module(name, path, values):
+
+    with open(path) as f:
+        source = replace_assignments(f.read(), values)
+
+    module = types.ModuleType(name)
+    module.__file__ = path
+    sys.modules[name] = module
+    exec(compile(source, path, 'exec'), module.__dict__)
+
+
+# Load a parameter set. Has to be done before any of the engine modules are imported.
+def load_parameters(path):
+
+    if any(name in sys.modules for name in parameter_modules):
+        raise RuntimeError('the parameters have to be loaded before the engine modules are imported')
+
+    sys.path.insert(0, main_folder)
+
+    modules = {name: (os.path.join(main_folder, f'{name}.py'), {}) for name in parameter_modules}
+    if path.endswith('.py'):
+        modules['evaluation_settings'] = (os.path.abspath(path), {})
+    else:
+        with open(path) as f:
+            parameters = json.load(f)
+        for name, values in parameters.items():
+            if name not in modules:
+                raise ValueError(f'unknown module "{name}", parameters can be given for {" and ".join(parameter_modules)}')
+            modules[name] = (modules[name][0], values)
+
+    for name in parameter_modules:
+        load_module(name, *modules[name])
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Run the UCI engine with another parameter set')
+    parser.add_argument('parameters', nargs='?', help='.py file replacing evaluation_settings.py, or .json file with new values')
+    parser.add_argument('--no-log', action='store_true', help="don't write the UCI log file (e.g. when many engines run at the same time)")
+    args = parser.parse_args()
+
+    if args.parameters:
+        load_parameters(args.parameters)
+    else:
+        sys.path.insert(0, main_folder)
+
+    # The UCI log is only set up if logging isn't configured already
+    if args.no_log:
+        logging.basicConfig(handlers=[logging.NullHandler()])
+
+    import uci
+    uci.UCI().main()
+
+
+if __name__ == '__main__':
+    main()
@@ -82,6 +82,9 @@ start_row_black = [x for x in range(31, 39)]
 end_row_white = [x for x in range(21, 29)]
 end_row_black = [x for x in range(91, 99)]
 
+# Normal start position
+start_fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
 # Numbers and letters
 numbers = ['1', '2', '3', '4', '5', '6', '7', '8']
 letters = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
@@ -110,9 +113,66 @@ full_depth_moves = 4  # How many moves we need to make before starting with LMR
 reduction_limit = 2  # How much the depth needs to be to start searching for LMR
 R = 2  # Null move reduction of depth
 aspiration_window = 50  # Aspiration window for PVS search
+max_multi_pv = 10  # Max number of lines in a MultiPV search (UCI option MultiPV)
+
+# Search extensions (in plies). The total extension along one path from the root is limited to max_extensions
+# to not blow up the tree in long checking sequences.
+max_extensions = 8
+check_extension = 1  # Extend when in check
+one_reply_extension = 1  # Extend when there is only one legal move (forced line)
+recapture_extension = 1  # Extend when recapturing on the same square with an equal trade
+
+# Mate scores. A mate found at a given ply is scored as mate_value - ply, everything above mate_score is a mate.
+mate_value = 99000
+mate_score = 98000
+
+# Folder with the generated endgame tablebases (see tablebase.py)
+tablebase_folder = 'tablebases'
+
+# Evaluation hash tables, max number of entries before the table is cleared
+pawn_hash_size = 16384
+
+# Evaluation cache size in MB (can be changed with the UCI option "Eval Hash"), and approximate size of one entry in bytes
+eval_hash_mb = 16
+eval_hash_entry_bytes = 64
+
+# Lazy evaluation margin, the positional terms are skipped if material and PST alone is this far outside the alpha/beta window
+lazy_eval_margin = 300
 
 # Bonus values depending on type of sorted move
 pv_score = 20000
 mvv_lva = 10000
 first_killer_move = 9000
 second_killer_move = 8000
+
+#  --------------------------------------------------------------------------------
+#                             Time management
+#  --------------------------------------------------------------------------------
+
+# Time (ms) reserved for communication lag on each move, can be changed with the UCI option "Move Overhead"
+move_overhead = 50
+
+# Moves to divide the remaining time over if the number of moves to the next time control isn't known
+default_movestogo = 30
+
+# The hard limit (when the search is stopped) is at most this many times the planned time for the move,
+# and at most this share of the remaining time
+hard_limit_factor = 4
+max_time_share = 0.5
+
+# The soft limit (no new iteration is started after it) is scaled down for each iteration the best move
+# hasn't changed, down to a minimum, and scaled up if the best move just changed or the score dropped
+stability_scale_step = 0.1
+min_stability_scale = 0.5
+best_move_change_scale = 1.4
+score_drop_margin = 30
+score_drop_scale = 1.5
+
+# Longest time (seconds) the stop timer in the search sleeps before checking if the stop time has changed
+timer_interval = 0.1
+
+# Thread switch interval (seconds) during the search, see sys.setswitchinterval
+switch_interval = 0.001
+
+# Time (seconds) between the UCI info lines (nodes, nps, current move, ...) sent during the search
+info_interval = 1
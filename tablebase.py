@@ -0,0 +1,679 @@
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                        tablebase.py
+#
+#                   - Generates endgame tablebases for all endings with up to 4 pieces (kings included)
+#                     with a retrograde analysis in NumPy
+#                   - Each table stores the distance to mate (DTM) for all positions, the win/draw/loss
+#                     result (WDL) is the sign of the stored value
+#                   - The tables are memory mapped and probed in O(1) from the search
+#
+#  Generate the tables from the main folder (takes a while, the tables are stored in the tablebases folder):
+#      python tablebase.py
+#      python tablebase.py --max-men 3
+#      python tablebase.py --tables KQK KRK KQKR
+#
+#  Tables are named after the material with the stronger side first, e.g. KQKR is king and queen against
+#  king and rook. The same table is used with the colors flipped (KRKQ).
+#
+#  The tables don't know about castling, en passant or the 50 move rule. Positions with castling rights
+#  or a possible en passant capture are not probed, and double pawn pushes in the tables don't give the
+#  opponent an en passant capture.
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+
+import settings as s
+import evaluation_settings as es
+
+# Pieces other than the kings, strongest first. The pieces of each side in a table are stored in this order.
+piece_order = 'QRBNP'
+
+# Stored values. A win in n plies is stored as n, a loss in n plies as -(n + 1) and a draw as 0.
+invalid = -128
+
+# Folder with the generated tables
+tablebase_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), s.tablebase_folder)
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                            Tables
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Squares are numbered 0-63 with a8 = 0, the same as in the piece bitboards.
+#
+# To make the tables smaller the board is mirrored so that the white king is always in one part of the board.
+# Tables without pawns are mirrored both horizontally and vertically (white king on a8-d5), tables with pawns
+# only horizontally (white king on the a-d files). None of these mirrorings leaves a square in place, so each
+# position is stored exactly once. The mirroring is a xor of all squares: 7 flips the files and 56 the ranks.
+region_xor = [[(7 if square % 8 >= 4 else 0) | (56 if square // 8 >= 4 else 0) for square in range(64)],
+              [7 if square % 8 >= 4 else 0 for square in range(64)]]  # [has pawns][white king square]
+
+# Index of the white king square in the mirrored part of the board
+region_slot = [square // 8 * 4 + square % 8 if square % 8 < 4 else -1 for square in range(64)]
+
+
+class Table:
+
+    def __init__(self, name):
+
+        self.name = name
+        self.white, self.black = name[1:].split('K')
+        self.has_pawns = 'P' in name
+
+        # Color (0 white, 1 black) and type of each piece in the order they are stored in the index
+        self.pieces = [(0, 'K'), (1, 'K')] + [(0, piece) for piece in self.white] + [(1, piece) for piece in self.black]
+
+        # Number of positions for each side to move
+        self.size = (32 if self.has_pawns else 16) * 64 ** (len(self.pieces) - 1)
+
+        # Material key for the table and for the table with flipped colors
+        self.material_keys = [get_material_key(self.white, self.black), get_material_key(self.black, self.white)]
+
+        # Piece number (as in the piece bitboards) of each piece in the index, normal and with flipped colors
+        self.piece_numbers = [[es.piece_to_number[f'{"wb"[color ^ flipped]}{piece_type if piece_type != "P" else "p"}'] for color, piece_type in self.pieces]
+                              for flipped in (0, 1)]
+
+        # Stored values [side to move][index]
+        self.values = None
+
+
+# Material key of a table with the given white and black pieces (kings not included)
+def get_material_key(white_pieces, black_pieces):
+
+    return sum(es.material_key_bits[f'w{piece.replace("P", "p")}'] for piece in white_pieces) + \
+        sum(es.material_key_bits[f'b{piece.replace("P", "p")}'] for piece in black_pieces)
+
+
+# Find the table name for the given white and black pieces, and if the colors are flipped in the table
+def get_table_name(white_pieces, black_pieces):
+
+    white_pieces = ''.join(sorted(white_pieces, key=piece_order.index))
+    black_pieces = ''.join(sorted(black_pieces, key=piece_order.index))
+
+    # The side with most pieces, or with the strongest pieces, is stored as white
+    white_strength = (len(white_pieces), [-piece_order.index(piece) for piece in white_pieces])
+    black_strength = (len(black_pieces), [-piece_order.index(piece) for piece in black_pieces])
+    if black_strength > white_strength:
+        return f'K{black_pieces}K{white_pieces}', True
+
+    return f'K{white_pieces}K{black_pieces}', False
+
+
+# If the name is a table name with the stronger side first, e.g. KQKR
+def is_table_name(name):
+
+    parts = name[1:].split('K')
+    return name[:1] == 'K' and len(parts) == 2 and not set(name) - set('K' + piece_order) and get_table_name(*parts)[0] == name
+
+
+# Index of a position in a table from the squares of the pieces (in table order, colors already flipped)
+def get_index(table, squares):
+
+    xor = region_xor[table.has_pawns][squares[0]]
+    index = region_slot[squares[0] ^ xor]
+    for square in squares[1:]:
+        index = index * 64 + (square ^ xor)
+
+    return index
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                            Probing
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Loaded tables, {material key: (table, colors flipped)}
+tables = {}
+
+
+# Memory map all generated tables in the tablebase folder
+def load_tables(path=tablebase_path):
+
+    tables.clear()
+    if not os.path.isdir(path):
+        return
+
+    for file in sorted(os.listdir(path)):
+        name, extension = os.path.splitext(file)
+        if extension != '.npy' or not is_table_name(name):
+            continue
+
+        table = Table(name)
+        table.values = np.load(os.path.join(path, file), mmap_mode='r')
+
+        tables[table.material_keys[0]] = (table, False)
+        tables.setdefault(table.material_keys[1], (table, True))
+
+
+load_tables()
+
+
+# Stored value for the position, None if the position is not in the tablebases
+def probe_dtm(gamestate):
+
+    entry = tables.get(gamestate.material_key)
+    if entry is None or gamestate.castling_rights:
+        return None
+
+    # The en passant square is set after all double pawn pushes, only skip the position if a pawn can capture
+    if gamestate.enpassant_square:
+        square, pawn = (gamestate.enpassant_square + 10, 'wp') if gamestate.is_white_turn else (gamestate.enpassant_square - 10, 'bp')
+        if pawn in (gamestate.board[square - 1], gamestate.board[square + 1]):
+            return None
+
+    table, flipped = entry
+
+    # Find the square of each piece in table order. Flipped colors also flip the board vertically.
+    bitboards = gamestate.piece_bitboards[:]
+    squares = []
+    for piece_number in table.piece_numbers[flipped]:
+        bits = bitboards[piece_number]
+        bitboards[piece_number] = bits & (bits - 1)
+        squares.append(((bits & -bits).bit_length() - 1) ^ (56 if flipped else 0))
+
+    value = int(table.values[int(not gamestate.is_white_turn) ^ flipped, get_index(table, squares)])
+
+    return value if value != invalid else None
+
+
+# Win (1), draw (0) or loss (-1) for the side to move, None if the position is not in the tablebases
+def probe_wdl(gamestate):
+
+    value = probe_dtm(gamestate)
+
+    return None if value is None else (value > 0) - (value < 0)
+
+
+# Search score for the position at the given ply (mate scores as in the search), None if not in the tablebases
+def probe(gamestate, ply=0):
+
+    value = probe_dtm(gamestate)
+    if value is None:
+        return None
+
+    # Win in value plies
+    if value > 0:
+        return s.mate_value - ply - value
+
+    # Loss in -value - 1 plies
+    if value < 0:
+        return -s.mate_value + ply - value - 1
+
+    return 0
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                          Generation
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Moves as (rank, file) steps
+king_steps = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+knight_steps = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+piece_directions = {'Q': king_steps, 'R': [(-1, 0), (0, -1), (0, 1), (1, 0)], 'B': [(-1, -1), (-1, 1), (1, -1), (1, 1)]}
+pawn_direction = [-1, 1]  # [color], white pawns move towards rank 8 (square 0)
+
+
+# Target square for one step from each square, -1 if outside the board
+def get_step_targets(step):
+
+    targets = np.full(64, -1, dtype=np.int16)
+    for square in range(64):
+        rank, file = square // 8 + step[0], square % 8 + step[1]
+        if 0 <= rank < 8 and 0 <= file < 8:
+            targets[square] = rank * 8 + file
+
+    return targets
+
+
+# Targets [step][square] for the king and knight, and [direction][distance][square] along each slider direction
+jump_targets = {'K': [get_step_targets(step) for step in king_steps], 'N': [get_step_targets(step) for step in knight_steps]}
+ray_targets = {piece: [[get_step_targets((step[0] * distance, step[1] * distance)) for distance in range(1, 8)] for step in directions]
+               for piece, directions in piece_directions.items()}
+pawn_capture_targets = [[get_step_targets((pawn_direction[color], file_step)) for file_step in (-1, 1)] for color in (0, 1)]
+
+# Attacks [from square * 64 + to square]. Sliders attack along the line if the squares between are empty.
+attack_tables = {piece: np.zeros(64 * 64, dtype=bool) for piece in 'KNQRBwb'}
+between_table = np.zeros(64 * 64, dtype=np.uint64)
+for from_square in range(64):
+    for piece in 'KN':
+        for targets in jump_targets[piece]:
+            if targets[from_square] >= 0:
+                attack_tables[piece][from_square * 64 + targets[from_square]] = True
+    for color, pawn in enumerate('wb'):
+        for targets in pawn_capture_targets[color]:
+            if targets[from_square] >= 0:
+                attack_tables[pawn][from_square * 64 + targets[from_square]] = True
+    for piece, rays in ray_targets.items():
+        for ray in rays:
+            between = 0
+            for targets in ray:
+                if targets[from_square] < 0:
+                    break
+                attack_tables[piece][from_square * 64 + targets[from_square]] = True
+                between_table[from_square * 64 + targets[from_square]] = between
+                between |= 1 << int(targets[from_square])
+
+
+# Index of positions from the squares of the pieces, for arrays of positions
+def get_index_array(table, squares):
+
+    king = squares[0].astype(np.int64)
+    xor = np.array(region_xor[table.has_pawns], dtype=np.int64)[king]
+    index = np.array(region_slot, dtype=np.int64)[king ^ xor]
+    for square in squares[1:]:
+        index = index * 64 + (square.astype(np.int64) ^ xor)
+
+    return index
+
+
+# Squares of the pieces for all positions in a table
+def get_squares(table):
+
+    index = np.arange(table.size, dtype=np.int64)
+    squares = []
+    for _ in table.pieces[1:]:
+        squares.insert(0, (index % 64).astype(np.int16))
+        index //= 64
+    squares.insert(0, (index // 4 * 8 + index % 4).astype(np.int16))
+
+    return squares
+
+
+# If the king of the given color is attacked, for arrays of positions
+def get_in_check(table, squares, occupied, color):
+
+    king = squares[color].astype(np.int64)
+    in_check = np.zeros(len(king), dtype=bool)
+    for square, (piece_color, piece_type) in zip(squares, table.pieces):
+        if piece_color == color:
+            continue
+        pair = square.astype(np.int64) * 64 + king
+        if piece_type in 'QRB':
+            in_check |= attack_tables[piece_type][pair] & (between_table[pair] & occupied == 0)
+        else:
+            in_check |= attack_tables[piece_type if piece_type != 'P' else 'wb'[piece_color]][pair]
+
+    return in_check
+
+
+# Values from a smaller table for positions after a capture or promotion, for arrays of positions.
+# pieces and squares are the pieces left after the move and side is the side to move after the move.
+def get_exit_values(pieces, squares, side, generated):
+
+    name, flipped = get_table_name([piece_type for color, piece_type in pieces[2:] if color == 0],
+                                   [piece_type for color, piece_type in pieces[2:] if color == 1])
+    table = generated[name]
+
+    # Put the pieces in table order
+    left = list(zip(pieces, squares))
+    table_squares = []
+    for color, piece_type in table.pieces:
+        for i, ((piece_color, left_type), square) in enumerate(left):
+            if piece_color ^ flipped == color and left_type == piece_type:
+                table_squares.append(square ^ 56 if flipped else square)
+                del left[i]
+                break
+
+    return np.asarray(table.values[side ^ flipped])[get_index_array(table, table_squares)]
+
+
+# Count the legal moves for all legal positions with the given side to move. Captures and promotions lead to
+# smaller tables where the result is already known. These moves are returned as events at the ply where they are
+# used in the retrograde analysis: win events for moves to a lost position for the opponent and loss events for
+# moves to a won position for the opponent (counted off like the moves in the table).
+def get_moves(table, squares, valid, side, generated):
+
+    positions = np.nonzero(valid[side])[0]
+    position_squares = [square[positions] for square in squares]
+    move_count = np.zeros(len(positions), dtype=np.int16)
+    win_events, loss_events = [], []
+
+    # Count a move to a position in the same table
+    def add_move(selected, piece, target):
+        new_squares = [square[selected] for square in position_squares]
+        new_squares[piece] = target[selected]
+        move_count[selected] += valid[1 - side][get_index_array(table, new_squares)]
+
+    # Count a capture and/or promotion, and add the events from the smaller table
+    def add_exit(selected, piece, target, captured=None, promotion=None):
+        pieces = list(table.pieces)
+        new_squares = [square[selected] for square in position_squares]
+        new_squares[piece] = target[selected]
+        if promotion:
+            pieces[piece] = (side, promotion)
+        if captured is not None:
+            del pieces[captured], new_squares[captured]
+        values = get_exit_values(pieces, new_squares, 1 - side, generated).astype(np.int16)
+        legal = values != invalid
+        move_count[selected] += legal
+        win_events.append((-values[legal & (values < 0)], positions[selected[legal & (values < 0)]]))
+        loss_events.append((values[values > 0] + 1, positions[selected[values > 0]]))
+
+    # Moves to the target squares for the given piece (not pawns), returns the targets that were empty
+    def add_targets(piece, target, on_board):
+        empty = on_board.copy()
+        for other, (color, _) in enumerate(table.pieces):
+            if other == piece:
+                continue
+            occupied = on_board & (position_squares[other] == target)
+            empty &= ~occupied
+            if color != side and occupied.any():
+                add_exit(np.nonzero(occupied)[0], piece, target, captured=other)
+
+        if empty.any():
+            add_move(np.nonzero(empty)[0], piece, target)
+
+        return empty
+
+    # If the square is empty in the positions
+    def is_empty(target):
+        empty = np.ones(len(positions), dtype=bool)
+        for square in position_squares:
+            empty &= square != target
+        return empty
+
+    for piece, (color, piece_type) in enumerate(table.pieces):
+        if color != side:
+            continue
+        square = position_squares[piece]
+
+        if piece_type in 'KN':
+            for targets in jump_targets[piece_type]:
+                target = targets[square]
+                add_targets(piece, target, target >= 0)
+
+        elif piece_type in 'QRB':
+            for ray in ray_targets[piece_type]:
+                on_board = np.ones(len(positions), dtype=bool)
+                for targets in ray:
+                    target = targets[square]
+                    on_board &= target >= 0
+                    if not on_board.any():
+                        break
+                    on_board = add_targets(piece, target, on_board)
+
+        else:
+            promotion_rank = 7 * side
+            direction = 8 * pawn_direction[side]
+
+            # Pushes and promotions
+            target = square + direction
+            empty = is_empty(target)
+            promotes = empty & (target // 8 == promotion_rank)
+            for promotion in 'QRBN':
+                if promotes.any():
+                    add_exit(np.nonzero(promotes)[0], piece, target, promotion=promotion)
+            if (empty & ~promotes).any():
+                add_move(np.nonzero(empty & ~promotes)[0], piece, target)
+
+            # Double pushes from the start rank
+            target = square + 2 * direction
+            double = empty & (square // 8 == 6 - 5 * side) & is_empty(target)
+            if double.any():
+                add_move(np.nonzero(double)[0], piece, target)
+
+            # Captures, with promotion on the last rank
+            for targets in pawn_capture_targets[side]:
+                target = targets[square]
+                for other, (other_color, _) in enumerate(table.pieces):
+                    captures = (target >= 0) & (position_squares[other] == target)
+                    if other_color == side or not captures.any():
+                        continue
+                    promotes = captures & (target // 8 == promotion_rank)
+                    for promotion in 'QRBN':
+                        if promotes.any():
+                            add_exit(np.nonzero(promotes)[0], piece, target, captured=other, promotion=promotion)
+                    if (captures & ~promotes).any():
+                        add_exit(np.nonzero(captures & ~promotes)[0], piece, target, captured=other)
+
+    # Move counts for all positions
+    counts = np.zeros(table.size, dtype=np.int16)
+    counts[positions] = move_count
+
+    return counts, win_events, loss_events
+
+
+# Positions before the given positions with a non capturing move by the given side (the side not to move in
+# the given positions). Returns the index of the legal positions before, one for each move.
+def get_unmoves(table, squares, valid, positions, side):
+
+    position_squares = [square[positions] for square in squares]
+    before = []
+
+    # Add the positions where the piece came from the given square
+    def add_unmove(selected, piece, from_square):
+        new_squares = [square[selected] for square in position_squares]
+        new_squares[piece] = from_square[selected]
+        index = get_index_array(table, new_squares)
+        before.append(index[valid[side][index]])
+
+    # If the square is empty in the positions
+    def is_empty(from_square):
+        empty = from_square >= 0
+        for square in position_squares:
+            empty &= square != from_square
+        return empty
+
+    for piece, (color, piece_type) in enumerate(table.pieces):
+        if color != side:
+            continue
+        square = position_squares[piece]
+
+        # Pieces move the same way back and forth
+        if piece_type in 'KN':
+            for targets in jump_targets[piece_type]:
+                from_square = targets[square]
+                empty = is_empty(from_square)
+                if empty.any():
+                    add_unmove(np.nonzero(empty)[0], piece, from_square)
+
+        elif piece_type in 'QRB':
+            for ray in ray_targets[piece_type]:
+                empty = np.ones(len(positions), dtype=bool)
+                for targets in ray:
+                    from_square = targets[square]
+                    empty &= is_empty(from_square)
+                    if not empty.any():
+                        break
+                    add_unmove(np.nonzero(empty)[0], piece, from_square)
+
+        # Pawns came from one rank back, or two from the start rank
+        else:
+            direction = 8 * pawn_direction[side]
+            from_square = square - direction
+            empty = is_empty(from_square) & (from_square // 8 != 7 - 7 * side)
+            if empty.any():
+                add_unmove(np.nonzero(empty)[0], piece, from_square)
+
+            from_square = square - 2 * direction
+            double = empty & (square // 8 == 4 - side) & is_empty(from_square)
+            if double.any():
+                add_unmove(np.nonzero(double)[0], piece, from_square)
+
+    return np.concatenate(before) if before else np.zeros(0, dtype=np.int64)
+
+
+# Events (plies, positions) for the given ply
+def get_events(events, ply):
+
+    return np.concatenate([positions[plies == ply] for plies, positions in events] + [np.zeros(0, dtype=np.int64)])
+
+
+# Generate a table with a retrograde analysis. The smaller tables it leads to after captures and promotions
+# have to be in generated.
+#
+# Checkmates are lost in 0 plies. From the lost positions in n plies all moves are taken back, which gives
+# the won positions in n + 1 plies. From the won positions in n plies all moves are taken back and counted,
+# and when all moves from a position lead to won positions for the opponent it is lost in n + 1 plies.
+# Positions that are never reached are draws.
+def generate_table(name, generated):
+
+    table = Table(name)
+    squares = get_squares(table)
+
+    # Legal positions for each side to move: all pieces on different squares, no pawns on the first or last
+    # rank and the side that just moved is not in check.
+    occupied = np.zeros(table.size, dtype=np.uint64)
+    for square in squares:
+        occupied |= np.left_shift(np.uint64(1), square.astype(np.uint64))
+    legal = np.ones(table.size, dtype=bool)
+    for first, second in itertools.combinations(squares, 2):
+        legal &= first != second
+    for square, (_, piece_type) in zip(squares, table.pieces):
+        if piece_type == 'P':
+            legal &= (square // 8 != 0) & (square // 8 != 7)
+    in_check = [get_in_check(table, squares, occupied, color) for color in (0, 1)]
+    valid = [legal & ~in_check[1 - side] for side in (0, 1)]
+    del occupied, legal
+
+    counts, win_events, loss_events = [], [], []
+    for side in (0, 1):
+        side_counts, side_wins, side_losses = get_moves(table, squares, valid, side, generated)
+        counts.append(side_counts)
+        win_events.append(side_wins)
+        loss_events.append(side_losses)
+    last_event = max([int(plies.max()) for events in win_events + loss_events for plies, _ in events if len(plies)] + [0])
+
+    # Checkmates
+    values = [np.zeros(table.size, dtype=np.int16) for _ in (0, 1)]
+    frontier = []
+    for side in (0, 1):
+        mated = np.nonzero(valid[side] & in_check[side] & (counts[side] == 0))[0]
+        values[side][mated] = -1
+        frontier.append(mated)
+    del in_check
+
+    ply = 0
+    while any(len(positions) for positions in frontier) or ply < last_event:
+        ply += 1
+        new_frontier = []
+        for side in (0, 1):
+            before = get_unmoves(table, squares, valid, frontier[1 - side], side)
+
+            # Won positions, a move leads to a lost position
+            if ply % 2:
+                positions = np.unique(np.concatenate((before, get_events(win_events[side], ply))))
+                positions = positions[values[side][positions] == 0]
+                values[side][positions] = ply
+
+            # Lost positions, all moves lead to won positions
+            else:
+                positions, moves = np.unique(np.concatenate((before, get_events(loss_events[side], ply))), return_counts=True)
+                counts[side][positions] -= moves.astype(np.int16)
+                positions = positions[(counts[side][positions] == 0) & (values[side][positions] == 0)]
+                values[side][positions] = -ply - 1
+
+            new_frontier.append(positions)
+        frontier = new_frontier
+
+    # Longest mate, the last ply found no new positions
+    plies = max(ply - 1, 0)
+    if plies > -invalid - 2:
+        raise ValueError(f'{name}: mate in {plies} plies does not fit in the table')
+
+    table.values = np.array(values, dtype=np.int8)
+    for side in (0, 1):
+        table.values[side][~valid[side]] = invalid
+
+    return table, plies
+
+
+# All tables with up to the given number of pieces, in the order they need to be generated
+def get_table_names(max_men=4):
+
+    names = set()
+    for men in range(2, max_men + 1):
+        for pieces in itertools.combinations_with_replacement(piece_order, men - 2):
+            for white_count in range(len(pieces) + 1):
+                for white_pieces in itertools.combinations(pieces, white_count):
+                    black_pieces = list(pieces)
+                    for piece in white_pieces:
+                        black_pieces.remove(piece)
+                    names.add(get_table_name(white_pieces, black_pieces)[0])
+
+    # Fewer pieces first, then fewer pawns since promotions lead to tables with one pawn less
+    return sorted(names, key=lambda name: (len(name), name.count('P'), name))
+
+
+# Tables that a table leads to after a capture or promotion
+def get_sub_tables(name):
+
+    white, black = name[1:].split('K')
+    sub_tables = set()
+    for pieces, other in ((white, black), (black, white)):
+        for i, piece in enumerate(pieces):
+            sub_tables.add(get_table_name(pieces[:i] + pieces[i + 1:], other)[0])
+            if piece == 'P':
+                for promotion in 'QRBN':
+                    sub_tables.add(get_table_name(pieces[:i] + promotion + pieces[i + 1:], other)[0])
+
+    return sub_tables
+
+
+# Generate the given tables, and the tables they lead to, and save them in the tablebase folder.
+# Tables that already exist are loaded instead.
+def generate(names, path=tablebase_path):
+
+    names, needed = list(names), set()
+    while names:
+        name = names.pop()
+        if name not in needed:
+            needed.add(name)
+            names.extend(get_sub_tables(name))
+
+    os.makedirs(path, exist_ok=True)
+    generated = {}
+    for name in sorted(needed, key=lambda name: (len(name), name.count('P'), name)):
+        file = os.path.join(path, f'{name}.npy')
+        if os.path.isfile(file):
+            table = Table(name)
+            table.values = np.load(file, mmap_mode='r')
+        else:
+            start = time.time()
+            table, plies = generate_table(name, generated)
+            np.save(file, table.values)
+            print(f'{name:<6} longest mate {plies:>3} plies, {time.time() - start:.1f} s', flush=True)
+        generated[name] = table
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Generate endgame tablebases')
+    parser.add_argument('--max-men', type=int, default=4, choices=(2, 3, 4), help='generate all tables with up to this many pieces')
+    parser.add_argument('--tables', nargs='+', help='only generate these tables (and the smaller tables they need), e.g. KQKR')
+    parser.add_argument('--path', default=tablebase_path, help='folder to store the tables in')
+    args = parser.parse_args()
+
+    if args.tables:
+        names = []
+        for name in args.tables:
+            white, black = name.upper()[1:].split('K')
+            names.append(get_table_name(white, black)[0])
+    else:
+        names = get_table_names(args.max_men)
+
+    generate(names, args.path)
+
+
+if __name__ == '__main__':
+    main()
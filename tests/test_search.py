@@ -0,0 +1,52 @@
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                        test_search.py
+#
+#              - Tests that the search finds mates also when the extension budget is used up
+#
+#  Run from the main folder:
+#      python -m pytest tests/test_search.py
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import move_notation as mn
+import settings as s
+from ai import Ai
+from gamestate import GameState
+
+# Back rank mate in 1 with Ra8#
+mate_in_1_fen = '6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1'
+
+
+class TestSearch(unittest.TestCase):
+
+    def test_mate_found_without_extension_budget(self):
+
+        # Checkmated at depth 0 with the whole budget used on the path, the node must not be scored by the quiescence search
+        gamestate = GameState(mate_in_1_fen)
+        ai = Ai(gamestate, search_depth=1)
+        gamestate.make_move(next(move for move in gamestate.get_valid_moves() if mn.move_to_uci(move) == 'a1a8'))
+        self.assertFalse(gamestate.get_valid_moves())
+        self.assertEqual(ai.negamax(0, 1, -s.mate_value, s.mate_value, True, extensions=s.max_extensions), -s.mate_value + 1)
+
+    def test_mate_in_1_without_extensions(self):
+
+        with mock.patch.object(s, 'max_extensions', 0):
+            ai = Ai(GameState(mate_in_1_fen), search_depth=1)
+            move, score = ai.ai_make_move(current_depth=1, best_move=None, best_score=0)
+
+        self.assertEqual(mn.move_to_uci(move), 'a1a8')
+        self.assertEqual(score, s.mate_value - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                      test_time_manager.py
+#
+#              - Tests the time limits of the time manager with a fake clock
+#
+#  Run from the main folder:
+#      python -m pytest tests/test_time_manager.py
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time_manager
+from time_manager import TimeManager
+
+move_1 = [35, 55, 'ss', 'wp', 0]
+move_2 = [32, 52, 'ss', 'wp', 0]
+
+
+class TestTimeManager(unittest.TestCase):
+
+    def setUp(self):
+
+        self.now = 1000.0
+        patcher = mock.patch.object(time_manager.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Complete iterations that took the given times, with the given best moves
+    def play_iterations(self, tm, iterations):
+
+        for duration, move in iterations:
+            self.now += duration
+            tm.update(move, 0)
+
+    def test_no_time_limit(self):
+
+        tm = TimeManager(move_overhead=0)
+        self.now += 1000
+        self.assertEqual(tm.stoptime, 0)
+        self.assertFalse(tm.is_done())
+
+    def test_fixed_time_uses_all_of_the_time(self):
+
+        tm = TimeManager(movetime=2, move_overhead=0)
+        self.assertAlmostEqual(tm.stoptime, 1002)
+
+        # The next iteration is expected to take much longer than the time left, but a new one is started anyway
+        self.play_iterations(tm, [(0.1, move_1), (0.5, move_2)])
+        self.assertFalse(tm.is_done())
+
+        self.now = 1002
+        self.assertTrue(tm.is_done())
+
+    def test_fixed_time_with_overhead(self):
+
+        tm = TimeManager(movetime=2, move_overhead=100)
+        self.assertAlmostEqual(tm.stoptime, 1001.9)
+
+    def test_clock_limits(self):
+
+        # 30 s left with 30 moves to go: 1 s planned for the move, up to 4 s for difficult moves
+        tm = TimeManager(time_left=30, move_overhead=0)
+        self.assertAlmostEqual(tm.hard_limit, 4)
+        self.assertAlmostEqual(tm.soft_limit, 1)
+        self.assertAlmostEqual(tm.stoptime, 1004)
+
+    def test_clock_hard_limit_share(self):
+
+        # The hard limit is at most half of the time left (plus the increment)
+        tm = TimeManager(time_left=2, inc=0.5, movestogo=1, move_overhead=0)
+        self.assertAlmostEqual(tm.hard_limit, 1.5)
+
+    def test_clock_skips_iteration_that_will_not_finish(self):
+
+        tm = TimeManager(time_left=30, move_overhead=0)
+
+        # Elapsed 0.6 s, the next iteration is expected to take 2.5 s and finish before the 4 s hard limit
+        self.play_iterations(tm, [(0.1, move_1), (0.5, move_2)])
+        self.assertFalse(tm.is_done())
+
+        # Elapsed 1.2 s, the next iteration is expected to take 5 s and finish after the hard limit
+        tm = TimeManager(time_left=30, move_overhead=0)
+        self.play_iterations(tm, [(0.2, move_1), (1.0, move_2)])
+        self.assertTrue(tm.is_done())
+
+    def test_clock_soft_limit_depends_on_stability(self):
+
+        # A stable best move stops the search before the planned time
+        tm = TimeManager(time_left=30, move_overhead=0)
+        self.play_iterations(tm, [(0.3, move_1), (0.3, move_1), (0.3, move_1)])
+        self.assertTrue(tm.is_done())
+
+        # A changing best move gives more than the planned time
+        tm = TimeManager(time_left=30, move_overhead=0)
+        self.play_iterations(tm, [(0.3, move_1), (0.3, move_2), (0.3, move_1), (0.2, move_2)])
+        self.assertFalse(tm.is_done())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                        time_manager.py
+#
+#                   - Decides how long the AI can think on a move, used both in UCI and the own GUI
+#                   - Hard limit: the search is stopped when it is reached
+#                   - Soft limit: no new iteration is started after it. It gets shorter when the best move
+#                     is stable over iterations and longer when the best move changes or the score drops
+#                   - An iteration that is not expected to finish before the hard limit is not started
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+import time
+
+import settings as s
+
+
+class TimeManager:
+
+    # time_left, inc and movetime in seconds, move_overhead in ms. Without time_left and movetime there is no time limit.
+    def __init__(self, time_left=0, inc=0, movestogo=0, movetime=0, move_overhead=None):
+
+        self.start = time.time()
+        self.timeset = 1 if time_left > 0 or movetime > 0 else 0
+        self.fixed_time = movetime > 0
+
+        overhead = (s.move_overhead if move_overhead is None else move_overhead) / 1000
+
+        # Use all of the given time for the move
+        if self.fixed_time:
+            self.soft_limit = self.hard_limit = max(0.01, movetime - overhead)
+
+        # Plan an equal share of the remaining time (plus increment) for each move left, and allow up to a few
+        # times that for difficult moves. The increment is only added after the move, so it can't be used for the hard limit.
+        elif self.timeset:
+            available = max(0.01, time_left - overhead)
+            planned = available / (movestogo if movestogo else s.default_movestogo) + inc
+            self.hard_limit = min(planned * s.hard_limit_factor, available * s.max_time_share + inc, available)
+            self.soft_limit = min(planned, self.hard_limit)
+
+        else:
+            self.soft_limit = self.hard_limit = 0
+
+        # Results from the completed iterations
+        self.best_move = None
+        self.best_score = None
+        self.stable_iterations = 0  # Number of iterations in a row the best move has been the same
+        self.score_dropped = False
+        self.iteration_times = []
+        self.iteration_start = self.start
+
+    # Time when the search has to be stopped
+    @property
+    def stoptime(self):
+        return self.start + self.hard_limit if self.timeset else 0
+
+    # Start counting the time from now, e.g. at ponderhit. The iteration times are kept to estimate the next iteration.
+    def restart(self):
+        self.start = time.time()
+
+    # Update with the best move and score from a completed iteration
+    def update(self, move, score):
+
+        now = time.time()
+        self.iteration_times.append(now - self.iteration_start)
+        self.iteration_start = now
+
+        if self.best_move and move[:4] == self.best_move[:4]:
+            self.stable_iterations += 1
+        else:
+            self.stable_iterations = 0
+
+        self.score_dropped = self.best_score is not None and score < self.best_score - s.score_drop_margin
+        self.best_move, self.best_score = move, score
+
+    # If a new iteration should not be started
+    def is_done(self):
+
+        if not self.timeset:
+            return False
+
+        elapsed = time.time() - self.start
+
+        # Scale the soft limit depending on how stable the best move and score are
+        if self.fixed_time:
+            scale = 1
+        elif self.stable_iterations:
+            scale = max(s.min_stability_scale, 1 - s.stability_scale_step * self.stable_iterations)
+        else:
+            scale = s.best_move_change_scale if len(self.iteration_times) > 1 else 1
+        if self.score_dropped:
+            scale *= s.score_drop_scale
+
+        if elapsed >= min(self.hard_limit, self.soft_limit * scale):
+            return True
+
+        # Don't start an iteration that won't finish before the hard limit. The time for the next iteration is
+        # estimated from how much longer the latest iteration took than the one before (the effective branching factor).
+        # With a fixed time (movetime) all of the time is used, the search is stopped at the hard limit instead.
+        if not self.fixed_time and len(self.iteration_times) > 1 and self.iteration_times[-2] > 0:
+            branching_factor = min(8, max(1.5, self.iteration_times[-1] / self.iteration_times[-2]))
+            return elapsed + self.iteration_times[-1] * branching_factor > self.hard_limit
+
+        return False
@@ -0,0 +1,422 @@
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                         texel_tuner.py
+#
+#              - Tunes the evaluation parameters with Texel's tuning method (https://www.chessprogramming.org/Texel%27s_Tuning_Method)
+#              - Loads positions (FEN/EPD) with game results and resolves them to quiet positions with a quiescence search
+#              - Minimizes the squared error between the game result and a sigmoid of the evaluation with a local search
+#              - The positions are evaluated with evaluation.evaluate_batch, split over several processes
+#              - Saves a checkpoint after each pass so that a stopped run can be resumed
+#              - Writes the tuned values to a new evaluation settings module
+#
+#  Run from the main folder:
+#      python tuning/texel_tuner.py positions.epd --output evaluation_settings_tuned.py
+#
+#  Each line in the positions file is a FEN followed by the game result, e.g.
+#      rnbqkb1r/pp1p1ppp/2p2n2/4p3/2P5/2N2N2/PP1PPPPP/R1BQKB1R w KQkq - 0 4 "1/2-1/2";
+#  The result can be given as 1-0, 0-1, 1/2-1/2 or [1.0], [0.0], [0.5] from white perspective.
+#
+#  Positions with no pawns left in the endgame are skipped since they are scored with the mop-up evaluation.
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Import from one step above in case of running from the tuning folder
+import os
+import sys
+up1 = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, up1)
+
+import argparse
+import ast
+import json
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import settings as s
+import evaluation as e
+import evaluation_settings as es
+from gamestate import GameState
+from ai import Ai
+
+# Results given in the positions file and their score from white perspective
+results = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5, '[1.0]': 1.0, '[0.0]': 0.0, '[0.5]': 0.5, '[1]': 1.0, '[0]': 0.0}
+
+# Name of the PST in evaluation_settings for each piece type
+pst_names = {'p': 'pawn', 'N': 'knight', 'B': 'bishop', 'R': 'rook', 'Q': 'queen', 'K': 'king'}
+
+# Max depth of the quiescence search when resolving positions
+max_quiescence_depth = 16
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                          Parameters
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# All tuned parameters as (variable name in evaluation_settings, index or key, None if a single value).
+# PST values are only tuned on the real board squares, and not on the first and last rank for pawns.
+parameters = [('base_mid_game', piece) for piece in 'pNBRQ'] + [('base_end_game', piece) for piece in 'pNBRQ']
+for piece, name in pst_names.items():
+    for phase in ('mid', 'end'):
+        parameters += [(f'{name}_{phase}', square) for square in s.real_board_squares if piece != 'p' or square // 10 not in (2, 9)]
+parameters += [('passed_pawn', rank - 1) for rank in range(2, 8)]
+parameters += [('double_pawn', None), ('isolated_pawn', None), ('open_file', None), ('semi_open_file', None)]
+parameters += [('mobility_factor', es.piece_to_number[f'w{piece}']) for piece in 'NBRQ']
+parameters += [('king_attack_bonus_factor', None), ('center_attack_bonus_factor', None)]
+
+# Variables that are rewritten in the output module
+tuned_variables = list(dict.fromkeys(name for name, _ in parameters))
+
+
+def get_parameters():
+
+    return [getattr(es, name)[key] if key is not None else getattr(es, name) for name, key in parameters]
+
+
+# Set the parameters in evaluation_settings and update the tables built from them
+def set_parameters(values):
+
+    for (name, key), value in zip(parameters, values):
+        if key is not None:
+            getattr(es, name)[key] = value
+        else:
+            setattr(es, name, value)
+
+    # PST with base values, and PST without base values used in make/unmake move. White and black use the same tables.
+    for i, (piece, name) in enumerate(pst_names.items()):
+        mid, end = getattr(es, f'{name}_mid'), getattr(es, f'{name}_end')
+        es.pst_mid[i][:] = [value + es.base_mid_game[piece] for value in mid]
+        es.pst_end[i][:] = [value + es.base_end_game[piece] for value in end]
+        es.pst_mid_squares[i][:] = mid
+        es.pst_end_square[i][:] = end
+
+    # Black mobility factors are the negated white ones
+    for piece in 'NBRQ':
+        es.mobility_factor[es.piece_to_number[f'b{piece}']] = -es.mobility_factor[es.piece_to_number[f'w{piece}']]
+
+    e.init_batch_tables()
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                        Load positions
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Read FENs and results from the positions file
+def load_positions(path):
+
+    positions = []
+    with open(path) as f:
+        for line in f:
+            tokens = line.replace(';', ' ').replace('"', ' ').split()
+            result = next((results[token] for token in tokens if token in results), None)
+            if result is None or len(tokens) < 4:
+                continue
+            fen = ' '.join(tokens[:6]) if len(tokens) > 6 and tokens[4].isdigit() and tokens[5].isdigit() else ' '.join(tokens[:4])
+            positions.append((fen, result))
+
+    return positions
+
+
+# Quiescence search that also returns the line of captures leading to the quiet position
+def quiescence(gamestate, ai, depth, alpha, beta):
+
+    score = e.evaluate(gamestate)
+    if score >= beta:
+        return beta, []
+
+    # Delta pruning, same margin as in the search
+    if score < alpha - 975:
+        return alpha, []
+
+    if score > alpha:
+        alpha = score
+    if depth >= max_quiescence_depth:
+        return alpha, []
+
+    line = []
+    for child in ai.sort_capture_moves(gamestate.get_capture_moves()):
+        gamestate.make_move(child)
+        score, child_line = quiescence(gamestate, ai, depth + 1, -beta, -alpha)
+        score = -score
+        gamestate.unmake_move()
+
+        if score > alpha:
+            alpha, line = score, [child] + child_line
+            if score >= beta:
+                return beta, line
+
+    return alpha, line
+
+
+# Resolve a position to the quiet position at the end of the quiescence search line. Returns the packed position,
+# or None if the position is in check or has no pawns left in the endgame (mop-up evaluation).
+def resolve_position(fen):
+
+    gamestate = GameState(fen)
+    if gamestate.check_for_pins_and_checks(gamestate.king_location[not gamestate.is_white_turn])[0]:
+        return None
+
+    ai = Ai(gamestate)
+    _, line = quiescence(gamestate, ai, 0, -100000, 100000)
+    for move in line:
+        gamestate.make_move(move)
+
+    if gamestate.game_phase_score <= es.endgame_phase_score*2 and gamestate.piece_dict[0]['p'] == gamestate.piece_dict[1]['p'] == 0:
+        return None
+
+    boards, is_white_turn, game_phase = e.pack_positions([gamestate])
+    return boards[0], is_white_turn[0], game_phase[0]
+
+
+def resolve_positions(positions, pool):
+
+    boards, is_white_turn, game_phase, game_results = [], [], [], []
+    for (fen, result), packed in zip(positions, pool.imap(resolve_position, [fen for fen, _ in positions], chunksize=256)):
+        if packed is not None:
+            boards.append(packed[0])
+            is_white_turn.append(packed[1])
+            game_phase.append(packed[2])
+            game_results.append(result)
+
+    return (np.array(boards, dtype=np.int8), np.array(is_white_turn, dtype=np.int8), np.array(game_phase, dtype=np.int64)), np.array(game_results)
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                             Loss
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Positions and results in each worker process, given once when the pool is created
+worker_positions = None
+worker_results = None
+
+
+def init_worker(positions, game_results):
+
+    global worker_positions, worker_results
+    worker_positions, worker_results = positions, game_results
+
+
+# Sum of squared errors between the result and the sigmoid of the evaluation (white perspective) for a part of the positions
+def get_error(positions, game_results, k):
+
+    scores = e.evaluate_batch(positions)
+    scores = np.where(positions[1], scores, -scores)
+
+    return np.sum((game_results - 1 / (1 + 10 ** (-k * scores / 400))) ** 2)
+
+
+def get_worker_error(task):
+
+    values, k, start, end = task
+    set_parameters(values)
+
+    return get_error(tuple(array[start:end] for array in worker_positions), worker_results[start:end], k)
+
+
+# Mean squared error over all positions, each process evaluates its own part of the positions
+def get_loss(values, k, pool, processes, n):
+
+    bounds = np.linspace(0, n, processes + 1).astype(int)
+    tasks = [(values, k, bounds[i], bounds[i + 1]) for i in range(processes)]
+
+    return sum(pool.map(get_worker_error, tasks)) / n
+
+
+# Find the scaling constant K that minimizes the loss with the current parameters
+def find_k(values, pool, processes, n):
+
+    best_k, best_loss = 1.0, get_loss(values, 1.0, pool, processes, n)
+    step = 0.1
+    while step > 0.001:
+        for k in (best_k - step, best_k + step):
+            loss = get_loss(values, k, pool, processes, n)
+            if loss < best_loss:
+                best_k, best_loss = k, loss
+                break
+        else:
+            step /= 2
+
+    return best_k
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                          Local search
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Try to change each parameter by +-step and keep the change if the loss decreases. Repeat until no parameter changes
+# or max passes are reached. The progress is saved to the checkpoint file after each pass.
+def local_search(values, k, pool, processes, n, checkpoint, output, max_passes, step, start_pass=0, best_loss=None):
+
+    best_loss = best_loss if best_loss is not None else get_loss(values, k, pool, processes, n)
+    print(f'Start loss: {best_loss:.6f}, K: {k:.3f}, parameters: {len(values)}, positions: {n}')
+
+    for current_pass in range(start_pass, max_passes):
+        start_time = time.time()
+        improved = 0
+
+        for i in range(len(values)):
+            for change in (step, -step):
+                values[i] += change
+                loss = get_loss(values, k, pool, processes, n)
+                if loss < best_loss:
+                    best_loss = loss
+                    improved += 1
+                    break
+                values[i] -= change
+
+        print(f'Pass {current_pass + 1}: loss {best_loss:.6f}, {improved} parameters changed, {time.time() - start_time:.1f} s')
+
+        save_checkpoint(checkpoint, values, k, current_pass + 1, best_loss)
+        set_parameters(values)
+        write_settings(output)
+
+        if not improved:
+            break
+
+    return values
+
+
+def save_checkpoint(path, values, k, finished_passes, loss):
+
+    with open(path, 'w') as f:
+        json.dump({'parameters': [list(parameter) for parameter in parameters], 'values': values, 'k': k, 'passes': finished_passes, 'loss': loss}, f)
+
+
+def load_checkpoint(path):
+
+    with open(path) as f:
+        checkpoint = json.load(f)
+
+    # Only use the checkpoint if it was made with the same parameters
+    if checkpoint['parameters'] != [list(parameter) for parameter in parameters]:
+        print('Checkpoint was made with other parameters, starting from the current evaluation settings')
+        return None
+
+    return checkpoint
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                     Write evaluation settings
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+# Format a value as Python code, 120 square tables as 10 values per row
+def format_value(name, value):
+
+    if isinstance(value, list) and len(value) == 120:
+        indent = ' ' * (len(name) + 4)
+        rows = [', '.join(str(v) for v in value[row * 10:row * 10 + 10]) for row in range(12)]
+        return '[' + (',\n' + indent).join(rows) + ']'
+
+    # Piece number tables, one row for the white pieces and one for the black pieces
+    if isinstance(value, list) and len(value) == 12:
+        indent = ' ' * (len(name) + 4)
+        return '[' + (',\n' + indent).join(', '.join(str(v) for v in value[row * 6:row * 6 + 6]) for row in range(2)) + ']'
+
+    if isinstance(value, dict):
+        indent = ' ' * (len(name) + 4)
+        return '{' + (',\n' + indent).join(f'{key!r}: {v}' for key, v in value.items()) + '}'
+
+    return repr(value)
+
+
+# Write a copy of evaluation_settings.py with the tuned variables replaced by their current values. The game phase
+# values are written as numbers so that the game phase stays the same as during tuning.
+def write_settings(path):
+
+    # Keep the line endings of the original file, so that the tuned file only differs in the tuned values
+    source_path = os.path.join(up1, 'evaluation_settings.py')
+    with open(source_path, newline='') as f:
+        source = f.read()
+    newline = '\r\n' if '\r\n' in source else '\n'
+    lines = source.split(newline)
+
+    replacements = {name: getattr(es, name) for name in tuned_variables}
+    replacements['piece_phase_calc'] = es.piece_phase_calc
+
+    # Replace the assignments from the bottom up so that the line numbers stay valid
+    assignments = [node for node in ast.parse(source).body if isinstance(node, ast.Assign) and len(node.targets) == 1
+                   and isinstance(node.targets[0], ast.Name) and node.targets[0].id in replacements]
+    for node in reversed(assignments):
+        name = node.targets[0].id
+        first, last = node.lineno - 1, node.end_lineno - 1
+        rest = lines[last][node.end_col_offset:]
+        lines[first:last + 1] = (f'{name} = {format_value(name, replacements[name])}{rest}').split('\n')
+
+    with open(path, 'w', newline='') as f:
+        f.write(newline.join(lines))
+
+
+# ---------------------------------------------------------------------------------------------------------
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+#
+#                                              Main
+#
+# /////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ---------------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Tune the evaluation parameters with Texel's tuning method")
+    parser.add_argument('positions', help='file with one FEN and game result per line')
+    parser.add_argument('--output', default='evaluation_settings_tuned.py', help='evaluation settings module to write')
+    parser.add_argument('--checkpoint', default='texel_checkpoint.json', help='checkpoint file, the run is resumed if it exists')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='number of processes')
+    parser.add_argument('--passes', type=int, default=100, help='max number of passes over all parameters')
+    parser.add_argument('--step', type=int, default=1, help='change to try for each parameter')
+    args = parser.parse_args()
+
+    # Resolve the positions once, the quiet positions are stored next to the checkpoint
+    resolved_path = os.path.splitext(args.checkpoint)[0] + '_positions.npz'
+    if os.path.exists(resolved_path):
+        data = np.load(resolved_path)
+        positions, game_results = (data['boards'], data['is_white_turn'], data['game_phase']), data['results']
+        print(f'Loaded {len(game_results)} resolved positions from {resolved_path}')
+    else:
+        start_time = time.time()
+        with Pool(args.processes) as pool:
+            positions, game_results = resolve_positions(load_positions(args.positions), pool)
+        np.savez(resolved_path, boards=positions[0], is_white_turn=positions[1], game_phase=positions[2], results=game_results)
+        print(f'Resolved {len(game_results)} positions in {time.time() - start_time:.1f} s')
+
+    values, k, start_pass, loss = get_parameters(), None, 0, None
+    checkpoint = load_checkpoint(args.checkpoint) if os.path.exists(args.checkpoint) else None
+    if checkpoint:
+        values, k, start_pass, loss = checkpoint['values'], checkpoint['k'], checkpoint['passes'], checkpoint['loss']
+        print(f'Resuming from pass {start_pass + 1}')
+
+    n = len(game_results)
+    with Pool(args.processes, initializer=init_worker, initargs=(positions, game_results)) as pool:
+        if k is None:
+            k = find_k(values, pool, args.processes, n)
+        values = local_search(values, k, pool, args.processes, n, args.checkpoint, args.output, args.passes, args.step, start_pass, loss)
+
+    set_parameters(values)
+    write_settings(args.output)
+    print(f'Wrote tuned evaluation settings to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,17 +6,26 @@
 #                   - Handles communication with an external gui
 #                   - Handles all common inputs such as fixed depth, time per move,
 #                     time per game (with and without increment)
+#                   - Node limited search (go nodes), mate search (go mate) and searchmoves
+#                   - Searches in a separate thread so that stop, quit and isready are handled during the search
+#                   - Pondering (go ponder and ponderhit)
+#                   - Info about the search progress (nps, seldepth, current move, ...) about once per second
 #
 # /////////////////////////////////////////////////////////////////////////////////////////////////////////
 # ---------------------------------------------------------------------------------------------------------
 
 import sys
 import logging
+import threading
 import time as t
 
 from gamestate import GameState
 from ai import Ai
+from time_manager import TimeManager
+import evaluation as e
 import settings as s
+import helper_functions as hf
+import move_notation as mn
 
 
 # --------------------------------------------------------------------------------
@@ -38,115 +47,179 @@ class Unbuffered(object):
         return getattr(self.stream, attr)
 
 
+# Parameters of the go command, used to find where the list of search moves ends
+go_params = {'searchmoves', 'ponder', 'wtime', 'btime', 'winc', 'binc', 'movestogo', 'depth', 'nodes', 'mate', 'movetime', 'infinite'}
+
+
 class UCI:
 
     def __init__(self):
-        self.gamestate = GameState('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+        self.gamestate = GameState(s.start_fen)
 
         self.best_move = None
         self.best_score = None
 
+        # FEN and moves from the latest position command. GUIs send all moves of the game in each position command,
+        # if the new moves extend these only the new moves are made on the current gamestate.
+        self.position_fen = s.start_fen
+        self.position_moves = []
+
+        # The search runs in its own thread so that commands (stop, quit, isready) are read while searching.
+        # The stop event is polled by the search in every node.
+        self.search_thread = None
+        self.stop_event = threading.Event()
+        self.output_lock = threading.Lock()
+
+        # Pondering. The search started with "go ponder" has no time limit until ponderhit, then the time limit
+        # from the go command starts counting without restarting the search.
+        self.searcher = None
+        self.pondering = False
+
+        # Time management for the current search, and time (ms) reserved for communication lag on each move
+        self.time_manager = TimeManager()
+        self.move_overhead = s.move_overhead
+        self.multi_pv = 1
+
+    # Send a line to the GUI, from the main thread or the search thread
+    def output(self, line):
+        with self.output_lock:
+            print(line, flush=True)
+            logging.debug(line)
+
+    # Stop the ongoing search (if any) and wait for it to send its best move
+    def stop_search(self):
+        if self.search_thread:
+            self.stop_event.set()
+            self.search_thread.join()
+            self.search_thread = None
+
     def main(self):
 
         logging.basicConfig(filename='log_uci.log', level=logging.DEBUG)
 
-        def output(line):
-            print(line, flush=True)
-            logging.debug(line)
+        output = self.output
 
-        engine_quit = False
         while True:
-            engine_input = input()
+            try:
+                engine_input = input().strip()
+            except EOFError:
+                engine_input = 'quit'
 
             logging.debug(f'>>> {engine_input} ')
 
             # Quit engine
-            if engine_input in 'quit stop':
+            if engine_input == 'quit':
+                self.stop_search()
                 break
 
+            # Stop the search and send the best move found so far
+            elif engine_input == 'stop':
+                self.stop_search()
+
+            # The opponent played the expected move, continue the ponder search as a normal search
+            elif engine_input == 'ponderhit':
+                if self.search_thread and self.pondering:
+                    self.time_manager.restart()
+                    self.searcher.stoptime = self.time_manager.stoptime
+                    self.searcher.timeset = self.time_manager.timeset
+                    self.pondering = False
+
             # Engine info
             elif engine_input == 'uci':
                 output('id name Endamat Chess')
                 output('id author Elias Nilsson')
+                output(f'option name Eval Hash type spin default {s.eval_hash_mb} min 1 max 1024')
+                output('option name Ponder type check default false')
+                output(f'option name Move Overhead type spin default {s.move_overhead} min 0 max 5000')
+                output(f'option name MultiPV type spin default 1 min 1 max {s.max_multi_pv}')
                 output('uciok')
 
-            # Check to see if engine is ready
+            # Check to see if engine is ready, also answered during search
             elif engine_input == 'isready':
                 output('readyok')
 
-            # Create a new game
-            elif engine_input == 'ucinewgame':
-                self.gamestate = GameState('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
-
-            # Handle a given position
-            elif engine_input.startswith('position'):
-
-                # Split engine input into parts
+            # Set an engine option, "setoption name <id> value <x>"
+            elif engine_input.startswith('setoption'):
+                self.stop_search()
                 inputs = engine_input.split()
+                if 'name' in inputs and 'value' in inputs:
+                    name = ' '.join(inputs[inputs.index('name') + 1:inputs.index('value')])
+                    value = ' '.join(inputs[inputs.index('value') + 1:])
 
-                try:
-                    # Handle building up the board from a FEN string
-                    if inputs[1] == "fen":
+                    # Evaluation cache size in MB
+                    if name.lower() == 'eval hash':
+                        e.set_eval_hash_size(min(1024, max(1, int(value))))
 
-                        # If moves are given in input, initiate board and make the moves
-                        if "moves" in inputs:
-
-                            # Find the entire FEN in the command
-                            fen = ' '.join(inputs[2:inputs.index('moves')])
-                            self.gamestate = GameState(fen)
-
-                            # Loop through the moves and make them on the board
-                            moves = inputs[inputs.index('moves') + 1:]
-                            for move in moves:
-                                gamestate_move = self.parse_move(move)
-                                self.gamestate.make_move(gamestate_move)
-                        else:
-                            fen = ' '.join(inputs[2:])
-                            self.gamestate = GameState(fen)
-
-                    # Handle board from building up the board from the start pos
-                    elif inputs[1] == "startpos":
-
-                        # Init board state to start pos
-                        self.gamestate = GameState('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+                    # The GUI tells if pondering is allowed, the ponder search itself is started with "go ponder"
+                    elif name.lower() == 'ponder':
+                        pass
 
-                        # If moves are given in input, initiate board and make the moves
-                        if 'moves' in inputs:
+                    # Time reserved for communication lag on each move
+                    elif name.lower() == 'move overhead':
+                        self.move_overhead = min(5000, max(0, int(value)))
 
-                            # Loop through the moves and make them on the board
-                            moves = inputs[inputs.index('moves') + 1:]
-                            for move in moves:
-                                gamestate_move = self.parse_move(move)
-                                self.gamestate.make_move(gamestate_move)
+                    # Number of best lines to search and send info about
+                    elif name.lower() == 'multipv':
+                        self.multi_pv = min(s.max_multi_pv, max(1, int(value)))
                     else:
-                        print("Unknown position type")
+                        output(f'info string unknown option "{name}"')
 
-                except Exception as exep:
-                    print("Something went wrong with the position. Please try again")
-                    print(exep)
+            # Create a new game
+            elif engine_input == 'ucinewgame':
+                self.stop_search()
+                self.gamestate = GameState(s.start_fen)
+                self.position_fen, self.position_moves = s.start_fen, []
+                e.clear_eval_hash()
+
+            # Handle a given position
+            elif engine_input.startswith('position'):
+                self.stop_search()
+                self.set_position(engine_input.split())
 
             # The go command will initiate search and we need to output best move from given position
             elif engine_input.startswith('go'):
+                self.stop_search()
 
                 # Default options
                 depth = -1
-                time = -1
-                movetime = -1
-                stoptime = 0
+                time = 0
+                movetime = 0
                 inc = 0
-                timeset = 0
-                movestogo = 50
-
-                # Loop through given parameters after go command
-                _, *params = engine_input.split(' ')
-                for param, value in zip(*2*(iter(params),)):
-
-                    # Infinite search
+                movestogo = 0
+                nodes = 0
+                mate = 0
+                search_moves = []
+                infinite = False
+                ponder = False
+
+                # Loop through given parameters after go command. Most parameters are followed by a value.
+                params = engine_input.split()[1:]
+                while params:
+                    param = params.pop(0)
+
+                    # Infinite search, only stopped by stop or quit
                     if param == 'infinite':
-                        pass
+                        infinite = True
+                        continue
+
+                    # Ponder search, search without time limit until ponderhit or stop
+                    if param == 'ponder':
+                        ponder = True
+                        continue
+
+                    # Only search these root moves, the moves are given until the next parameter
+                    if param == 'searchmoves':
+                        while params and params[0] not in go_params:
+                            search_moves.append(params.pop(0))
+                        continue
+
+                    if not params:
+                        output(f'info string "{param}" is missing a value')
+                        break
+                    value = params.pop(0)
 
                     # Fixed depth search
-                    elif param == 'depth':
+                    if param == 'depth':
                         depth = max(1, int(value))  # Can't use 0 or negative values as depth
 
                     # Black time increment if black turn
@@ -177,80 +250,56 @@ class UCI:
                     elif param == 'movestogo':
                         movestogo = int(value)
 
+                    # Search this many nodes, gives the same result on any machine
+                    elif param == 'nodes':
+                        nodes = max(1, int(value))
+
+                    # Search for a mate in this many moves, stop when it is found
+                    elif param == 'mate':
+                        mate = max(1, int(value))
+
                     # Different time controls placeholder
                     else:
-                        print(f'"{param}" with value "{value}" is not a valid/legal input command.')
+                        output(f'info string "{param}" with value "{value}" is not a valid/legal input command.')
+
+                # Only keep the legal search moves, search all moves if none of them are legal
+                valid_moves = [mn.move_to_uci(move) for move in self.gamestate.get_valid_moves()]
+                root_moves = [move for move in search_moves if move in valid_moves]
+                if search_moves and not root_moves:
+                    output('info string no legal move in searchmoves, searching all moves')
+
+                # Adjudicate draw by insufficient material, there is nothing to search for since no move changes the result.
+                # All (search) moves draw, the first ones are sent as the MultiPV lines. Without legal moves (stalemate) the
+                # normal search path sends the best move.
+                draw_moves = root_moves or valid_moves
+                if self.gamestate.is_material_draw and draw_moves and not infinite and not ponder:
+                    if self.multi_pv == 1:
+                        output(f'info depth 1 score cp 0 nodes 0 time 0 pv {draw_moves[0]}')
+                    else:
+                        for line, move in enumerate(draw_moves[:self.multi_pv]):
+                            output(f'info multipv {line + 1} depth 1 score cp 0 nodes 0 time 0 pv {move}')
+                    output('info string draw by insufficient material')
+                    output(f'bestmove {draw_moves[0]}')
+                    continue
 
                 # If depth is not available, set it to something large
                 if depth == -1:
                     depth = 64
 
-                # Init start time
-                starttime = t.time()
-
-                # If move time was given, update time to movetime and moves to go to 1 (1 move in x ms)
-                if movetime != -1:
-                    time = movetime
-                    movestogo = 1
-
-                # If time control is available, flag that we play with time control and set timing
-                if time != -1:
-                    timeset = 1
-
-                    # Divide time equally between how many moves we should do
-                    time /= movestogo
-
-                    # Lag compensation 100 ms
-                    if time > 1.5:
-                        time -= 0.1
-
-                    # Add time and increment to get what time we should stop at
-                    stoptime = starttime + time + inc
-
-                    # Increment when time is almost up
-                    if time < 1.5 and inc and depth == 64:
-                        stoptime = starttime + inc - 0.1
-
-                # Search position given the parameters from GUI
-                searcher = Ai(self.gamestate, search_depth=depth, stoptime=stoptime, timeset=timeset)
-
-                searcher.nodes = -1
-
-                searcher.time_start = t.time()
-
-                # Initialize best move and best score
-                self.best_move = self.gamestate.get_valid_moves()[0]
-                self.best_score = 0
-
-                for current_depth in range(1, depth + 1):
-
-                    # Break if time is up
-                    if searcher.stopped or engine_quit:
-                        break
-
-                    # Calculate move and score for current depth
-                    move, score = searcher.ai_make_move(current_depth=current_depth, best_move=self.best_move, best_score=self.best_score)
-
-                    # Print info to GUI after each depth if we returned a valid move (engine didn't stop calculating).
-                    # Check if we reached mate score, if so calculate how many moves left until mate to print in GUI.
-                    if not searcher.stopped:
-                        if -searcher.mate_value < score < -searcher.mate_score:
-                            output('info score mate %d depth %d nodes %ld time %d pv %s' % (-(score + searcher.mate_value) / 2 - 1, current_depth, searcher.nodes, searcher.timer * 1000, searcher.pv_line))
-
-                        elif searcher.mate_score < score < searcher.mate_value:
-                            output('info score mate %d depth %d nodes %ld time %d pv %s' % ((searcher.mate_value - score) / 2 + 1, current_depth, searcher.nodes, searcher.timer * 1000, searcher.pv_line))
-
-                        else:
-                            output('info score cp %d depth %d nodes %ld time %d pv %s' % (score, current_depth, searcher.nodes, searcher.timer * 1000, searcher.pv_line))
+                # A mate in x moves is found within 2x plies
+                if mate:
+                    depth = min(depth, 2 * mate)
 
-                        # Update best move and best score
-                        self.best_move, self.best_score = move, score
+                # Time for the move. When pondering or in an infinite search there is no time limit until ponderhit.
+                self.time_manager = TimeManager(time_left=0 if infinite else time, inc=inc, movestogo=movestogo, movetime=0 if infinite else movetime, move_overhead=self.move_overhead)
+                self.pondering = ponder
+                stoptime, timeset = (0, 0) if ponder else (self.time_manager.stoptime, self.time_manager.timeset)
 
-                # Output best move to engine console
-                if self.best_move[2] in 'pQpRpBpN':
-                    output(f'bestmove {f"{s.square_to_board[self.best_move[0]]}{s.square_to_board[self.best_move[1]]}{self.best_move[2][-1].lower()}"}')
-                else:
-                    output(f'bestmove {f"{s.square_to_board[self.best_move[0]]}{s.square_to_board[self.best_move[1]]}"}')
+                # Search position given the parameters from GUI in the search thread
+                self.stop_event.clear()
+                self.searcher = Ai(self.gamestate, search_depth=depth, stoptime=stoptime, timeset=timeset, stop_event=self.stop_event, node_limit=nodes, root_moves=root_moves, multi_pv=self.multi_pv)
+                self.search_thread = threading.Thread(target=self.search, args=(self.searcher, depth, infinite, mate), daemon=True)
+                self.search_thread.start()
 
             elif engine_input.startswith('time'):
                 our_time = int(engine_input.split()[1])
@@ -258,49 +307,136 @@ class UCI:
             elif engine_input.startswith('otim'):
                 opp_time = int(engine_input.split()[1])
 
-            else:
+            elif engine_input:
                 output(f'"{engine_input}" is currently not a valid input command.')
-                pass
 
-    # Get a move from GUI and return it if legal
-    def parse_move(self, move_string):
+    # Iterative deepening, runs in the search thread. Sends the best move when done or stopped.
+    def search(self, searcher, depth, infinite, mate=0):
 
-        possible_moves = self.gamestate.get_valid_moves()
+        output = self.output
 
-        # From and to square
-        from_square = s.board_to_square[move_string[0] + move_string[1]]
-        to_square = s.board_to_square[move_string[2] + move_string[3]]
+        searcher.nodes = -1
 
-        # Loop over possible moves to see if the move is in the list
-        for move in possible_moves:
+        searcher.time_start = t.time()
+        searcher.info_output = output
 
-            if move[0] == from_square and move[1] == to_square:
+        # Checkmate or stalemate, there is nothing to search. The GUI still gets a best move (the null move 0000).
+        valid_moves = self.gamestate.get_valid_moves()
+        if not valid_moves:
+            is_checkmate = self.gamestate.check_for_checks(self.gamestate.king_location[not self.gamestate.is_white_turn])
+            output('info depth 0 score %s nodes 0 time 0' % ('mate 0' if is_checkmate else 'cp 0'))
+            while (infinite or self.pondering) and not self.stop_event.wait(0.005):
+                pass
+            output('bestmove 0000')
+            return
 
-                # Check for promotion
-                if move[2] in 'pQpRpBpN':
+        # Initialize best move and best score
+        self.best_move = valid_moves[0]
+        if searcher.root_moves:
+            self.best_move = next(move for move in valid_moves if mn.move_to_uci(move) in searcher.root_moves)
+        self.best_score = 0
 
-                    # Queen
-                    if move[2][-1] == 'Q' and move_string[4] == 'q':
-                        return move
+        # Send info about the search progress from another thread while searching
+        search_done = threading.Event()
+        reporter = threading.Thread(target=self.report_info, args=(searcher, search_done), daemon=True)
+        reporter.start()
 
-                    # Rook
-                    elif move[2][-1] == 'R' and move_string[4] == 'r':
-                        return move
+        for current_depth in range(1, depth + 1):
 
-                    # Bishop
-                    elif move[2][-1] == 'B' and move_string[4] == 'b':
-                        return move
+            # Break if time is up or the search was stopped
+            if searcher.stopped or self.stop_event.is_set():
+                break
 
-                    # Knight
-                    elif move[2][-1] == 'N' and move_string[4] == 'n':
-                        return move
+            # Calculate move and score for current depth
+            move, score = searcher.ai_make_move(current_depth=current_depth, best_move=self.best_move, best_score=self.best_score)
 
-                # Return legal move if no promotion
+            # Print info to GUI after each depth if we returned a valid move (engine didn't stop calculating).
+            # The score is given as moves left until mate if we reached a mate score, else in centipawns.
+            if not searcher.stopped:
+                info = 'depth %d seldepth %d nodes %ld nps %d hashfull %d time %d tbhits %d' % (current_depth, searcher.seldepth, searcher.nodes, searcher.nodes / searcher.timer, e.get_eval_hash_full(), searcher.timer * 1000, searcher.tb_hits)
+                if searcher.multi_pv == 1:
+                    output('info score %s %s pv %s' % (hf.get_uci_score(score), info, mn.get_uci_line(searcher.pv_moves)))
                 else:
-                    return move
+                    for line, (line_score, line_moves) in enumerate(searcher.multi_pv_lines):
+                        output('info multipv %d score %s %s pv %s' % (line + 1, hf.get_uci_score(line_score), info, mn.get_uci_line(line_moves)))
+                output('info string extension nodes %s' % ' '.join(f'{extension} {nodes}' for extension, nodes in searcher.extension_nodes.items()))
+                output('info string eval tiers %s' % ' '.join(f'{tier} {count}' for tier, count in e.eval_counts.items()))
+                output('info string eval hash hits %d misses %d' % (e.eval_hash_stats['hits'], e.eval_hash_stats['misses']))
+
+                # Update best move and best score
+                self.best_move, self.best_score = move, score
+
+                # Stop if a mate within the given number of moves is found
+                if mate and 0 < hf.moves_to_mate(score) <= mate:
+                    break
+
+                # Stop if there is no time for another iteration, the time isn't counted while pondering
+                self.time_manager.update(move, score)
+                if not self.pondering and self.time_manager.is_done():
+                    break
+
+        # Stop the info reporter, so that no info is sent after the best move
+        search_done.set()
+        reporter.join()
+
+        # In an infinite or ponder search the best move is not sent until the GUI says stop (or ponderhit), even if the max depth is reached
+        while (infinite or self.pondering) and not self.stop_event.wait(0.005):
+            pass
+
+        # Output best move to engine console, with the expected reply from the PV line to ponder on
+        if len(searcher.pv_moves) > 1 and searcher.pv_moves[0] == self.best_move:
+            output(f'bestmove {mn.move_to_uci(self.best_move)} ponder {mn.move_to_uci(searcher.pv_moves[1])}')
+        else:
+            output(f'bestmove {mn.move_to_uci(self.best_move)}')
+
+    # Send info about the ongoing search about every info_interval seconds, runs in its own thread. The search only
+    # updates counters (nodes, seldepth, current root move), all formatting and output is done here.
+    def report_info(self, searcher, search_done):
+
+        while not search_done.wait(s.info_interval):
+            elapsed = max(0.001, t.time() - searcher.time_start)
+            line = 'info depth %d seldepth %d nodes %d nps %d hashfull %d time %d tbhits %d' % (searcher.current_depth, searcher.seldepth, searcher.nodes, searcher.nodes / elapsed, e.get_eval_hash_full(), elapsed * 1000, searcher.tb_hits)
+            current_move, current_move_number = searcher.current_move, searcher.current_move_number
+            if current_move:
+                line += ' currmove %s currmovenumber %d' % (mn.move_to_uci(current_move), current_move_number)
+            self.output(line)
+
+    # Set up the position from a position command, "position [fen <fen> | startpos] moves <move1> ... <movei>"
+    def set_position(self, inputs):
+
+        try:
+            # Find the FEN and the moves in the command
+            moves = inputs[inputs.index('moves') + 1:] if 'moves' in inputs else []
+            if inputs[1] == 'fen':
+                fen = ' '.join(inputs[2:inputs.index('moves')] if 'moves' in inputs else inputs[2:])
+            elif inputs[1] == 'startpos':
+                fen = s.start_fen
+            else:
+                self.output('info string unknown position type')
+                return
+
+            # Only make the new moves if the position extends the previous one, this also keeps the gamestate
+            # history for 3-fold repetition. Otherwise start over from the FEN.
+            if fen == self.position_fen and moves[:len(self.position_moves)] == self.position_moves:
+                new_moves = moves[len(self.position_moves):]
+            else:
+                self.gamestate = GameState(fen)
+                new_moves = moves
+
+            # Set the position before making the moves, so that the gamestate is rebuilt next time if a move fails
+            self.position_fen, self.position_moves = None, []
+
+            for move_string in new_moves:
+                move = mn.uci_to_move(self.gamestate, move_string)
+                if not move or not self.gamestate.make_legal_move(move):
+                    self.output(f'info string illegal move {move_string}')
+                    return
+
+            self.position_fen, self.position_moves = fen, moves
 
-        # Else the move is illegal
-        return 0
+        except Exception as exep:
+            self.output('info string something went wrong with the position')
+            self.output(f'info string {exep}')
 
 
 if __name__ == '__main__':